@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+'''
+Runs jobs, such as processing uploaded reports, on a bounded pool of worker
+threads in the background, and tracks their status, progress and results so
+that clients can poll for them.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import collections
+import Queue
+import threading
+import time
+import traceback
+import uuid
+
+class Job(object):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, func, args):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.status = Job.QUEUED
+        # Fraction of the job completed, from 0.0 to 1.0, along with a short
+        # description of what the job is doing.
+        self.progress = 0.0
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_on = time.time()
+        self.finished_on = None
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+
+    def set_progress(self, progress, stage=None):
+        '''
+        Reports that the job is @progress (from 0.0 to 1.0) of the way done
+        and is now at @stage. Called by the running job.
+        '''
+        with self.lock:
+            self.progress = min(max(float(progress), 0.0), 1.0)
+            self.stage = stage
+
+    def run(self):
+        with self.lock:
+            self.status = Job.RUNNING
+        try:
+            result = self.func(self, *self.args)
+        except Exception as e:
+            traceback.print_exc()
+            with self.lock:
+                self.status = Job.FAILED
+                self.error = str(e)
+        else:
+            with self.lock:
+                self.status = Job.DONE
+                self.progress = 1.0
+                self.result = result
+        with self.lock:
+            self.finished_on = time.time()
+        self.finished.set()
+
+    def to_dict(self):
+        with self.lock:
+            job = {
+                'id' : self.id,
+                'status' : self.status,
+                'progress' : self.progress,
+                'stage' : self.stage
+            }
+            if self.status == Job.DONE:
+                job['result'] = self.result
+            if self.status == Job.FAILED:
+                job['error'] = self.error
+            return job
+
+class JobQueue(object):
+    DEFAULT_NUM_WORKERS = 2
+    DEFAULT_MAX_JOBS = 256
+
+    def __init__(self, num_workers=DEFAULT_NUM_WORKERS,
+                 max_jobs=DEFAULT_MAX_JOBS):
+        '''
+        Runs jobs on @num_workers worker threads, at most that many at a time,
+        and keeps the status of up to @max_jobs finished jobs around for
+        polling, forgetting the oldest ones first.
+        '''
+        if num_workers < 1:
+            raise Exception('JobQueue requires at least 1 worker')
+        self.max_jobs = max_jobs
+        self.queue = Queue.Queue()
+        # Job id -> Job, in submission order.
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self.work,
+                                      name='JobQueue-' + str(i))
+            # Workers must not keep the process alive on exit.
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.run()
+            with self.lock:
+                self.forget_finished()
+
+    def submit(self, func, *args):
+        '''
+        Queues a call to func(job, *args), where job is the Job that @func may
+        report its progress to, and returns the id of the job straight away.
+        The job's result is whatever @func returns.
+        '''
+        job = Job(uuid.uuid4().hex, func, args)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job.id
+
+    def forget_finished(self):
+        # Expects self.lock to be held. Queued and running jobs are never
+        # forgotten.
+        finished = [job_id for job_id, job in self.jobs.iteritems()
+                    if job.finished.is_set()]
+        for job_id in finished[:max(len(finished) - self.max_jobs, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        '''
+        Returns the status of the job @job_id as a dict of its id, status,
+        progress and stage, plus its result once done or error if failed, or
+        None if there is no such job.
+        '''
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return job.to_dict() if job is not None else None
+
+    def wait(self, job_id, timeout=None):
+        '''
+        Blocks until the job @job_id finishes or @timeout seconds pass, and
+        returns its status as get does.
+        '''
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.finished.wait(timeout)
+        return job.to_dict()
+
+    def shutdown(self):
+        '''
+        Stops the workers once the jobs queued so far have run.
+        '''
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return dict([(status, statuses.count(status)) for status in
+                     (Job.QUEUED, Job.RUNNING, Job.DONE, Job.FAILED)])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+'''
+Serializes list formula results for responses, either whole or streamed in
+chunks as JSON or NDJSON.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+from flask import json
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Number of values serialized at a time when streaming list responses.
+LIST_RESPONSE_CHUNK_SIZE = 1024
+
+def cell_title(cell):
+    return cell.title.val if cell.title is not None else None
+
+def cell_date(cell):
+    return cell.date.val if cell.date is not None else None
+
+# Keys of list responses and the field of each cell they list.
+LIST_FIELDS = (('data', lambda cell : cell.val),
+               ('titles', cell_title),
+               ('dates', cell_date))
+
+def list_data(cells):
+    return dict([(key, [field(cell) for cell in cells])
+                 for key, field in LIST_FIELDS])
+
+def stream_list_json(cells, chunk_size=LIST_RESPONSE_CHUNK_SIZE):
+    '''
+    Yields the JSON of list_data(@cells) in chunks of up to @chunk_size
+    values, without building the lists of values.
+    '''
+    yield '{'
+    for i, (key, field) in enumerate(LIST_FIELDS):
+        yield (', ' if i > 0 else '') + json.dumps(key) + ': ['
+        for start in range(0, len(cells), chunk_size):
+            chunk = cells[start:start + chunk_size]
+            yield (', ' if start > 0 else '') + \
+                ', '.join([json.dumps(field(cell)) for cell in chunk])
+        yield ']'
+    yield '}\n'
+
+def stream_list_ndjson(cells, chunk_size=LIST_RESPONSE_CHUNK_SIZE):
+    '''
+    Yields a line of JSON of the form {"val": ..., "title": ..., "date": ...}
+    per cell of @cells, in chunks of up to @chunk_size lines.
+    '''
+    for start in range(0, len(cells), chunk_size):
+        chunk = cells[start:start + chunk_size]
+        yield ''.join([json.dumps({'val': cell.val,
+                                   'title': cell_title(cell),
+                                   'date': cell_date(cell)}) + '\n'
+                       for cell in chunk])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+'''
+Bounded LRU cache of serialized formula results, keyed by their ETags, whose
+entries expire after a time to live.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import collections
+import threading
+import time
+
+class ResultCache(object):
+    DEFAULT_MAX_SIZE = 1024
+    DEFAULT_MAX_BYTES = 64 << 20
+    DEFAULT_TTL = 300
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, clock=time.time):
+        '''
+        Holds up to @max_size results, whose bodies take up to @max_bytes in
+        total, for @ttl seconds each as measured by @clock.
+        '''
+        if max_size < 1:
+            raise Exception('ResultCache requires a max_size of at least 1')
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        # ETag -> (expiry time, body, mimetype), in least to most recently
+        # used order.
+        self.results = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, etag):
+        '''
+        Returns the body and mimetype of the result cached for @etag, or None
+        if there is none or it has expired.
+        '''
+        with self.lock:
+            result = self.results.pop(etag, None)
+            if result is None or result[0] <= self.clock():
+                if result is not None:
+                    self.bytes -= len(result[1])
+                self.misses += 1
+                return None
+            self.results[etag] = result
+            self.hits += 1
+            return result[1], result[2]
+
+    def put(self, etag, body, mimetype):
+        '''
+        Caches @body, of @mimetype, for @etag. Bodies larger than max_bytes
+        are not cached.
+        '''
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.results.pop(etag, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self.results[etag] = (self.clock() + self.ttl, body, mimetype)
+            self.bytes += len(body)
+            while len(self.results) > self.max_size or \
+                    self.bytes > self.max_bytes:
+                _, (_, evicted, _) = self.results.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size' : len(self.results),
+                'max_size' : self.max_size,
+                'bytes' : self.bytes,
+                'max_bytes' : self.max_bytes,
+                'hits' : self.hits,
+                'misses' : self.misses
+            }
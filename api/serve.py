@@ -8,7 +8,9 @@ TODO(aditya): Define HTTP interface to FormulaEngine via a REST API.
 __author__ = 'Aditya Viswanathan'
 __email__ = 'aditya@adityaviswanathan.com'
 
-from flask import Flask, flash, jsonify, redirect, render_template, request
+from flask import Flask, Response, flash, json, jsonify, redirect, \
+    render_template, request, url_for
+import hashlib
 import os
 import sys
 from werkzeug.utils import secure_filename
@@ -17,11 +19,41 @@ from app import app
 # methods have bindings into Function.
 my_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(my_path, os.pardir)))
-from report_utils import AxisDecision, ReportTraverser, to_csv
-from formula_engine import ParseTree, Function
+from report_utils import AxisDecisionCache, TraverserRegistry, \
+    load_workbook, to_csv
+from formula_engine import FormulaCache, Function
 from entities import Db, ActionExecutor
+from job_queue import Job, JobQueue
+from list_response import NDJSON_MIMETYPE, list_data, stream_list_json, \
+    stream_list_ndjson
+from result_cache import ResultCache
 
 ALLOWED_EXTENSIONS = set(['xlsx', 'csv', 'txt'])
+# Parsed and compiled formulas, shared across requests.
+FORMULA_CACHE = FormulaCache(
+    app.config.get('FORMULA_CACHE_SIZE', FormulaCache.DEFAULT_MAX_SIZE))
+# Axis decisions keyed by report contents, shared across requests.
+AXIS_DECISION_CACHE = AxisDecisionCache(
+    app.config.get('AXIS_DECISION_CACHE_SIZE',
+                   AxisDecisionCache.DEFAULT_MAX_SIZE),
+    sidecar=app.config.get('AXIS_DECISION_SIDECAR', False))
+# Loaded reports, shared across requests.
+TRAVERSER_REGISTRY = TraverserRegistry(
+    app.config.get('TRAVERSER_REGISTRY_SIZE',
+                   TraverserRegistry.DEFAULT_MAX_SIZE),
+    app.config.get('TRAVERSER_REGISTRY_BYTES',
+                   TraverserRegistry.DEFAULT_MAX_BYTES),
+    AXIS_DECISION_CACHE,
+    app.config.get('AXIS_DECISION_SAMPLE_ROWS'))
+# Serialized formula results keyed by their ETags, shared across requests.
+RESULT_CACHE = ResultCache(
+    app.config.get('RESULT_CACHE_SIZE', ResultCache.DEFAULT_MAX_SIZE),
+    app.config.get('RESULT_CACHE_BYTES', ResultCache.DEFAULT_MAX_BYTES),
+    app.config.get('RESULT_CACHE_TTL', ResultCache.DEFAULT_TTL))
+# Uploads being processed in the background.
+JOB_QUEUE = JobQueue(
+    app.config.get('UPLOAD_WORKERS', JobQueue.DEFAULT_NUM_WORKERS),
+    app.config.get('UPLOAD_MAX_JOBS', JobQueue.DEFAULT_MAX_JOBS))
 
 
 def allowed_file(filename):
@@ -74,104 +106,323 @@ def update_entity(entity_name):
     return jsonify(entry)
 
 
+def save_upload():
+    '''
+    Saves the file uploaded with the current request to the upload folder and
+    returns its path, or None if no file was uploaded.
+    '''
+    if 'file' not in request.files:
+        print 'No file part.'
+        return None
+    f = request.files['file']
+    if f.filename == '':
+        print 'No selected file.'
+        return None
+    if not allowed_file(f.filename):
+        print 'Extension of file "' + f.filename + '" not allowed.'
+    filename = secure_filename(f.filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    f.save(filepath)
+    print 'Processed file "' + filename + '".'
+    return filepath
+
+def report_headers(traverser):
+    '''
+    Returns the dates and titles of the report of @traverser.
+    '''
+    dates_ptree = FORMULA_CACHE.get('get_dates(0)')
+    titles_ptree = FORMULA_CACHE.get('get_titles(0)')
+    d = [date.val for date in dates_ptree.evaluate_tree(
+        is_list=True, traversers=[traverser])]
+    t = [title.val for title in titles_ptree.evaluate_tree(
+        is_list=True, traversers=[traverser])]
+    return d, t
+
+def report_rows(traverser, dates, titles):
+    '''
+    Returns the values of the report of @traverser, a row per title in
+    @titles, blank for blank titles.
+    '''
+    r = []
+    # Cells of every title are fetched in a single pass over the report.
+    for title, cells in zip(titles, traverser.get_grid()):
+        if not title.strip():
+            r.append([''] * len(dates[1:]))
+            continue
+        r.append([cell.val for cell in cells])
+    return r
+
+def process_upload(job, filepath):
+    '''
+    Converts and decides the axes of the report uploaded to @filepath and
+    registers its traverser, or the traverser of each sheet of an uploaded
+    workbook, reporting progress to @job. Returns the name (None for reports
+    that are not workbooks) and filename of each sheet, and the filename,
+    dates and titles of the first; their values are served from
+    TRAVERSER_REGISTRY, so that finished jobs hold on to little memory. Runs
+    on the workers of JOB_QUEUE.
+    '''
+    job.set_progress(0.1, 'deciding axes')
+    print 'Making axis decision...'
+    if filepath.endswith('.xlsx'):
+        # The sheets of workbooks are loaded straight into in-memory
+        # traversers, with the CSVs that later requests read written on the
+        # side. Sheets that are not reports are left out.
+        traversers = load_workbook(
+            filepath, folder=app.config['UPLOAD_FOLDER'],
+            cache=AXIS_DECISION_CACHE,
+            sample_rows=app.config.get('AXIS_DECISION_SAMPLE_ROWS'),
+            processes=app.config.get('UPLOAD_SHEET_PROCESSES'),
+            skip_errors=True)
+        if len(traversers) == 0:
+            raise Exception('No sheet of ' + os.path.basename(filepath) +
+                            ' is a report')
+        for traverser in traversers:
+            TRAVERSER_REGISTRY.put(traverser.file_name, traverser)
+            print_axes(traverser)
+    else:
+        data_file = to_csv(filepath, app.config['UPLOAD_FOLDER']) if \
+            not filepath.endswith('.csv') else filepath
+        # The upload may replace a registered report of the same name.
+        TRAVERSER_REGISTRY.invalidate(data_file)
+        traversers = [load_traverser(data_file)]
+    job.set_progress(0.8, 'fetching headers')
+    d, t = report_headers(traversers[0])
+    print 'Fetched headers.'
+    return {
+        'filename' : traversers[0].file_name,
+        'dates' : d,
+        'titles' : t,
+        'sheets' : [{'name' : traverser.name, 'filename' : traverser.file_name}
+                    for traverser in traversers]
+    }
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
         if 'file' not in request.files:
             flash('No file part')
             return redirect(request.url)
-        f = request.files['file']
-        if f.filename == '':
-            print 'No selected file.'
+        filepath = save_upload()
+        if filepath is None:
             return redirect(request.url)
-        if not allowed_file(f.filename):
-            print 'Extension of file "' + f.filename + '" not allowed.'
-        if f:
-            filename = secure_filename(f.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            f.save(filepath)
-            print 'Processed file "' + filename + '".'
-            print 'Making axis decision...'
-            print filepath.endswith('.csv')
-            data_file = to_csv(filepath, app.config['UPLOAD_FOLDER']) if \
-                not filepath.endswith('.csv') else filepath
-            axis_decision = AxisDecision(data_file)
-            axis_decision.decide()
-            print 'Decided that ' + str(axis_decision.date_axis) + \
-                ' is the date axis and ' + str(axis_decision.title_axis) + \
-                ' is the title axis.'
-            print 'Decided that ' + str(axis_decision.date_index) + \
-                ' is the date axis start index and ' + \
-                str(axis_decision.title_index) + \
-                ' is the title axis start index.'
-            traverser = ReportTraverser(data_file,
-                                        axis_decision.date_axis,
-                                        axis_decision.date_index,
-                                        axis_decision.title_axis,
-                                        axis_decision.title_index)
-            print 'Constructed ReportTraverser.'
-            dates_ptree = ParseTree('get_dates(0)', [traverser])
-            titles_ptree = ParseTree('get_titles(0)', [traverser])
-            print 'Constructed ParseTree.'
-            d = [date.val for date in dates_ptree.evaluate_tree(is_list=True)]
-            t = [title.val for title in titles_ptree.evaluate_tree(
-                is_list=True)]
-            print 'Fetched headers.'
-            r = []
-            for title in t:
-                if not title.strip():
-                    r.append([''] * len(d[1:]))
-                    continue
-                title_ptree = ParseTree(
-                    'get_cells_by_title(0, ' + title + ')', [traverser])
-                r.append(
-                    [date.val for date in title_ptree.evaluate_tree(is_list=True)])
-            print 'Fetched base report data.'
-            funcs = Function.NAMES
-            return render_template('home.html', dates=d, titles=t, rows=r, funcs=funcs, filename=data_file)
+        # The upload is processed in the background, rather than holding up
+        # the request, and its page polls for it.
+        job_id = JOB_QUEUE.submit(process_upload, filepath)
+        return redirect(url_for('report', job_id=job_id), code=303)
     # GET request default case.
     return render_template('home.html')
 
+@app.route('/reports/<job_id>', methods=['GET'])
+def report(job_id):
+    '''
+    Renders the report uploaded by the job @job_id once it is processed, and
+    its progress until then. Renders the sheet of an uploaded workbook named
+    by the query arg 'sheet', or else its first sheet.
+    '''
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return render_template('home.html', error='No upload with id ' +
+                               job_id), 404
+    if job['status'] == Job.FAILED:
+        return render_template('home.html', error='Unable to process upload: ' +
+                               job['error'])
+    if job['status'] != Job.DONE:
+        return render_template('home.html', job=job)
+    data_file = job['result']['filename']
+    sheet_name = request.args.get('sheet')
+    if sheet_name is not None:
+        data_files = [sheet['filename'] for sheet in job['result']['sheets']
+                      if sheet['name'] == sheet_name]
+        if len(data_files) == 0:
+            return render_template('home.html', error='No sheet named ' +
+                                   sheet_name + ' in upload ' + job_id), 404
+        data_file = data_files[0]
+    # The report's values are read from its registered traverser, which is
+    # reloaded if it has since been evicted or changed.
+    traverser = load_traverser(data_file)
+    d, t = report_headers(traverser)
+    r = report_rows(traverser, d, t)
+    print 'Fetched base report data.'
+    funcs = Function.NAMES
+    return render_template('home.html', dates=d, titles=t, rows=r,
+                           funcs=funcs, filename=data_file)
+
+@app.route('/upload', methods=['POST'])
+def upload():
+    '''
+    Queues the processing of the uploaded report and returns the id of its
+    job straight away, to be polled at /jobs/<job_id>.
+    '''
+    filepath = save_upload()
+    if filepath is None:
+        return jsonify(error='No file uploaded'), 400
+    job_id = JOB_QUEUE.submit(process_upload, filepath)
+    return jsonify(job=job_id), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    '''
+    Returns the status, progress and, once done, the result of the job
+    @job_id, i.e. the sheets of a processed upload and the filename, dates and
+    titles of its first. The values of each sheet can be fetched with the
+    formula get_grid(0) via /execute, given its filename.
+    '''
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify(error='No job with id ' + job_id), 404
+    return jsonify(job)
+
+
+def print_axes(traverser):
+    print 'Decided that ' + str(traverser.date_axis) + \
+        ' is the date axis and ' + str(traverser.title_axis) + \
+        ' is the title axis.'
+    print 'Decided that ' + str(traverser.date_axis_index) + \
+        ' is the date axis start index and ' + \
+        str(traverser.title_axis_index) + ' is the title axis start index.'
+
+
+def load_traverser(filename):
+    '''
+    Returns the in-memory ReportTraverser over the report at @filename from
+    the registry, which loads it and decides its axes on first use.
+    '''
+    traverser = TRAVERSER_REGISTRY.get(filename)
+    print_axes(traverser)
+    return traverser
+
+
+def singleton_data(cell):
+    return {
+        'data': cell.val,
+        'titles': cell.title.val,
+        'dates': cell.date.val
+    }
+
+
+def evaluate_formula(formula_string, is_list, traversers, memo=None):
+    ptree = FORMULA_CACHE.get(formula_string)
+    if is_list:
+        return list_data(ptree.evaluate_tree(is_list=True,
+                                             traversers=traversers,
+                                             memo=memo))
+    return singleton_data(ptree.evaluate_tree(traversers=traversers,
+                                              memo=memo))
+
+
+def result_etag(version, ptree, is_list, mimetype):
+    '''
+    Returns a strong ETag for the result of @ptree over the traverser of
+    @version, as returned by TRAVERSER_REGISTRY.get_versioned, as a list if
+    @is_list, served as @mimetype.
+    '''
+    digest = hashlib.sha1()
+    for part in (version, ptree.normalize(), str(bool(is_list)), mimetype):
+        digest.update(part.encode('utf-8') + '\0')
+    return digest.hexdigest()
+
+
+def cache_result(etag, chunks, mimetype):
+    '''
+    Yields @chunks of a response body as they come, then caches the whole
+    body for @etag, unless it outgrows RESULT_CACHE.
+    '''
+    body = []
+    size = 0
+    for chunk in chunks:
+        yield chunk
+        if body is not None:
+            body.append(chunk)
+            size += len(chunk)
+            if size > RESULT_CACHE.max_bytes:
+                body = None
+    if body is not None:
+        RESULT_CACHE.put(etag, ''.join(body), mimetype)
+
+
+def result_response(body, mimetype, etag):
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # The representation of list results depends on the Accept header.
+    response.vary.add('Accept')
+    return response
+
 
 @app.route('/execute', methods=['POST'])
 def execute_formula():
+    '''
+    Evaluates a formula against a report. List results are streamed as they
+    are serialized, as the JSON list_data would produce or, if the client
+    accepts application/x-ndjson over application/json, as a line of JSON per
+    cell. Responses carry an ETag of the formula and the version of the report
+    its traverser was loaded from, so that conditional requests for unchanged
+    results are answered with a 304, and results are cached for
+    RESULT_CACHE_TTL seconds.
+    '''
     payload = request.get_json()
     # TODO(aditya): Check that 'filename' and 'formulaString' are in payload.
-    axis_decision = AxisDecision(payload['filename'])
-    axis_decision.decide()
-    print 'Decided that ' + str(axis_decision.date_axis) + \
-        ' is the date axis and ' + str(axis_decision.title_axis) + \
-        ' is the title axis.'
-    print 'Decided that ' + str(axis_decision.date_index) + \
-        ' is the date axis start index and ' + \
-        str(axis_decision.title_index) + ' is the title axis start index.'
-    traverser = ReportTraverser(payload['filename'],
-                                axis_decision.date_axis,
-                                axis_decision.date_index,
-                                axis_decision.title_axis,
-                                axis_decision.title_index)
-    print 'Constructed ReportTraverser.'
-    ptree = ParseTree(payload['formulaString'], [traverser])
-    if 'isList' in payload.keys() and payload['isList']:
-        list_parse_output = ptree.evaluate_tree(is_list=True)
-        print list_parse_output
-        list_data = {
-            'data': [i.val for i in list_parse_output],
-            'titles': [i.title.val if i.title is not None else i.title for i in list_parse_output],
-            'dates': [i.date.val if i.date is not None else i.date for i in list_parse_output]
-        }
-        print 'Sending the following list data response to client: ' +  \
-            str(list_data)
-        return jsonify(list_data)
-    parse_output = ptree.evaluate_tree()
-    singleton_data = {
-        'data': parse_output.val,
-        'titles': parse_output.title.val,
-        'dates': parse_output.date.val
-    }
-    print 'Sending the following singleton data response to client: ' +  \
-        str(singleton_data)
-    return jsonify(singleton_data)
+    is_list = 'isList' in payload.keys() and payload['isList']
+    mimetype = 'application/json'
+    if is_list and request.accept_mimetypes.best_match(
+            ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        mimetype = NDJSON_MIMETYPE
+    ptree = FORMULA_CACHE.get(payload['formulaString'])
+    # The ETag is of the very traverser the result is evaluated against,
+    # whose registry entry is revalidated against the file on every request.
+    traverser, version = TRAVERSER_REGISTRY.get_versioned(payload['filename'])
+    etag = result_etag(version, ptree, is_list, mimetype)
+    # If-None-Match is compared weakly (RFC 7232, section 3.2), so that
+    # validators weakened by proxies, e.g. W/"<etag>", still match.
+    if request.if_none_match.contains_weak(etag):
+        response = result_response('', mimetype, etag)
+        response.status_code = 304
+        return response
+    cached = RESULT_CACHE.get(etag)
+    if cached is not None:
+        return result_response(cached[0], cached[1], etag)
+    if is_list:
+        cells = ptree.evaluate_tree(is_list=True, traversers=[traverser])
+        chunks = stream_list_ndjson(cells) if mimetype == NDJSON_MIMETYPE \
+            else stream_list_json(cells)
+        return result_response(cache_result(etag, chunks, mimetype),
+                                mimetype, etag)
+    body = json.dumps(singleton_data(ptree.evaluate_tree(
+        traversers=[traverser]))) + '\n'
+    RESULT_CACHE.put(etag, body, mimetype)
+    return result_response(body, mimetype, etag)
+
+
+@app.route('/execute_batch', methods=['POST'])
+def execute_formula_batch():
+    '''
+    Evaluates a batch of formulas against a single report. Expects a payload
+    of the form {'filename': ..., 'formulas': [{'formulaString': ...,
+    'isList': ...}, ...]} and responds with {'results': [...]}, holding the
+    response /execute would send for each formula, in order, or {'error': ...}
+    for formulas that fail to evaluate.
+    '''
+    # A missing or malformed body is rejected like a payload missing keys.
+    payload = request.get_json(silent=True) or {}
+    if 'filename' not in payload or \
+            not isinstance(payload.get('formulas'), list):
+        return jsonify(
+            {'error': 'Expected "filename" and a list of "formulas".'}), 400
+    # The axis decision and report are loaded once for the whole batch, and
+    # traverser lookups shared between formulas are evaluated once.
+    traversers = [load_traverser(payload['filename'])]
+    memo = {}
+    results = []
+    for formula in payload['formulas']:
+        try:
+            results.append(evaluate_formula(formula['formulaString'],
+                                            formula.get('isList', False),
+                                            traversers,
+                                            memo))
+        except Exception as e:
+            results.append({'error': str(e)})
+    print 'Evaluated a batch of ' + str(len(results)) + ' formulas.'
+    return jsonify({'results': results})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+'''
+Tests JobQueue.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import threading
+import unittest
+from job_queue import Job, JobQueue
+
+def add(job, a, b):
+    return a + b
+
+def fail(job):
+    raise Exception('Malformed report')
+
+def block(job, started, release):
+    job.set_progress(0.5, 'blocked')
+    started.release()
+    release.wait()
+    return 'released'
+
+class JobQueueRunning(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue(num_workers=2)
+
+    def tearDown(self):
+        self.queue.shutdown()
+
+    def test_result(self):
+        job_id = self.queue.submit(add, 2, 3)
+        job = self.queue.wait(job_id, 5)
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(job['status'], Job.DONE)
+        self.assertEqual(job['progress'], 1.0)
+        self.assertEqual(job['result'], 5)
+        self.assertEqual(self.queue.get(job_id), job)
+
+    def test_failure(self):
+        job = self.queue.wait(self.queue.submit(fail), 5)
+        self.assertEqual(job['status'], Job.FAILED)
+        self.assertEqual(job['error'], 'Malformed report')
+        self.assertNotIn('result', job)
+
+    def test_progress(self):
+        started = threading.Semaphore(0)
+        release = threading.Event()
+        job_id = self.queue.submit(block, started, release)
+        # The id is returned before the job finishes.
+        started.acquire()
+        job = self.queue.get(job_id)
+        self.assertEqual(job['status'], Job.RUNNING)
+        self.assertEqual(job['progress'], 0.5)
+        self.assertEqual(job['stage'], 'blocked')
+        self.assertEqual(self.queue.wait(job_id, 0.01)['status'], Job.RUNNING)
+        release.set()
+        self.assertEqual(self.queue.wait(job_id, 5)['result'], 'released')
+
+    def test_bounded_workers(self):
+        started = threading.Semaphore(0)
+        release = threading.Event()
+        job_ids = [self.queue.submit(block, started, release)
+                   for i in range(3)]
+        started.acquire()
+        started.acquire()
+        # Only as many jobs as workers run at a time.
+        statuses = [self.queue.get(job_id)['status'] for job_id in job_ids]
+        self.assertEqual(statuses, [Job.RUNNING, Job.RUNNING, Job.QUEUED])
+        self.assertEqual(self.queue.stats()[Job.QUEUED], 1)
+        release.set()
+        for job_id in job_ids:
+            self.assertEqual(self.queue.wait(job_id, 5)['status'], Job.DONE)
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.queue.get('missing'))
+        self.assertIsNone(self.queue.wait('missing', 0.01))
+
+    def test_requires_worker(self):
+        with self.assertRaises(Exception):
+            JobQueue(num_workers=0)
+
+class JobQueueRetention(unittest.TestCase):
+    def test_forgets_oldest_finished(self):
+        queue = JobQueue(num_workers=1, max_jobs=2)
+        job_ids = [queue.submit(add, i, i) for i in range(4)]
+        queue.shutdown()
+        self.assertIsNone(queue.get(job_ids[0]))
+        self.assertIsNone(queue.get(job_ids[1]))
+        self.assertEqual(queue.get(job_ids[2])['result'], 4)
+        self.assertEqual(queue.get(job_ids[3])['result'], 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+'''
+Tests the serialization of list formula results.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import json
+import os
+import sys
+import unittest
+from list_response import LIST_RESPONSE_CHUNK_SIZE, list_data, \
+    stream_list_json, stream_list_ndjson
+# Append parent dir to $PYTHONPATH to import Cell.
+my_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(my_path, os.pardir)))
+from report_utils import Cell
+
+def make_cells(count):
+    title = Cell('Late Fee')
+    return [Cell(str(float(i)), title, Cell('MONTH ' + str(i)))
+            for i in range(count)]
+
+class ListResponseStreaming(unittest.TestCase):
+    def assertStreamsListData(self, cells, **kwargs):
+        chunks = list(stream_list_json(cells, **kwargs))
+        self.assertEqual(json.loads(''.join(chunks)), list_data(cells))
+        return chunks
+
+    def test_json(self):
+        self.assertEqual(self.assertStreamsListData([]),
+                         ['{', '"data": [', ']', ', "titles": [', ']',
+                          ', "dates": [', ']', '}\n'])
+        self.assertStreamsListData(make_cells(1))
+        # Cells with no title or date, e.g. those computed by formulas.
+        self.assertStreamsListData([Cell(3.0), Cell(u'Caf\xe9')])
+
+    def test_json_chunks(self):
+        cells = make_cells(2 * LIST_RESPONSE_CHUNK_SIZE + 1)
+        chunks = self.assertStreamsListData(cells)
+        # Each list is split across three chunks of values, of which all but
+        # the first start with a delimiter.
+        values = [chunk for chunk in chunks if not chunk.endswith('[') and
+                  chunk not in ('{', ']', '}\n')]
+        self.assertEqual(len(values), 3 * 3)
+        self.assertEqual(len([chunk for chunk in values
+                              if chunk.startswith(', ')]), 3 * 2)
+        self.assertStreamsListData(make_cells(10), chunk_size=3)
+        self.assertStreamsListData(make_cells(9), chunk_size=3)
+
+    def test_ndjson(self):
+        self.assertEqual(list(stream_list_ndjson([])), [])
+        cells = make_cells(2 * LIST_RESPONSE_CHUNK_SIZE + 1) + \
+            [Cell(1.0), Cell('2.0', title=Cell('Rent')),
+             Cell('3.0', date=Cell('JAN 17'))]
+        chunks = list(stream_list_ndjson(cells))
+        self.assertEqual(len(chunks), 3)
+        lines = ''.join(chunks).splitlines()
+        self.assertEqual(len(lines), len(cells))
+        expected = list_data(cells)
+        for i, line in enumerate(lines):
+            cell = json.loads(line)
+            self.assertEqual(sorted(cell.keys()), ['date', 'title', 'val'])
+            self.assertEqual((cell['val'], cell['title'], cell['date']),
+                             (expected['data'][i], expected['titles'][i],
+                              expected['dates'][i]))
+        self.assertEqual(json.loads(lines[-3]),
+                         {'val': 1.0, 'title': None, 'date': None})
+
+if __name__ == '__main__':
+    unittest.main()
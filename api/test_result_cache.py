@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+'''
+Tests ResultCache.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import unittest
+from result_cache import ResultCache
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class ResultCacheBounds(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_get_put(self):
+        cache = ResultCache(clock=self.clock)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', '{"data": 1}', 'application/json')
+        self.assertEqual(cache.get('a'), ('{"data": 1}', 'application/json'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['bytes'], len('{"data": 1}'))
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=10, clock=self.clock)
+        cache.put('a', 'body', 'application/json')
+        self.clock.now = 9.0
+        self.assertIsNotNone(cache.get('a'))
+        self.clock.now = 10.0
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_max_size(self):
+        cache = ResultCache(max_size=2, clock=self.clock)
+        cache.put('a', 'a', 'application/json')
+        cache.put('b', 'b', 'application/json')
+        # Marks 'a' as most recently used, so 'b' is evicted.
+        cache.get('a')
+        cache.put('c', 'c', 'application/json')
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_max_bytes(self):
+        cache = ResultCache(max_bytes=10, clock=self.clock)
+        cache.put('a', 'x' * 6, 'application/json')
+        cache.put('b', 'x' * 6, 'application/json')
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        cache.put('c', 'x' * 11, 'application/json')
+        self.assertIsNone(cache.get('c'))
+        self.assertIsNotNone(cache.get('b'))
+        # Replacing an entry does not count its old body.
+        cache.put('b', 'x' * 8, 'application/json')
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+    def test_requires_size(self):
+        with self.assertRaises(Exception):
+            ResultCache(max_size=0)
+
+if __name__ == '__main__':
+    unittest.main()
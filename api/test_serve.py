@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+'''
+Tests the upload and formula endpoints of the REST API.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import json
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+import types
+import unittest
+# Append parent dir to $PYTHONPATH to import the api package and testdata.
+my_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(my_path, os.pardir))
+sys.path.append(root_path)
+
+# The app reads its settings, deployment secrets among them, from api.config,
+# which is not checked in.
+class TestingConfig(object):
+    SECRET_KEY = 'test'
+    STRIPE_SECRET_KEY = 'test'
+
+config = types.ModuleType('api.config')
+config.DevelopmentConfig = TestingConfig
+sys.modules['api.config'] = config
+import serve
+
+class Uploads(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        serve.app.config['UPLOAD_FOLDER'] = self.folder
+        serve.app.config['UPLOAD_SHEET_PROCESSES'] = 1
+        self.client = serve.app.test_client()
+
+    def tearDown(self):
+        for file_name in os.listdir(self.folder):
+            serve.TRAVERSER_REGISTRY.invalidate(
+                os.path.join(self.folder, file_name))
+        shutil.rmtree(self.folder)
+
+    def upload(self, file_name, path='/upload'):
+        with open(os.path.join(root_path, 'testdata', file_name), 'rb') as f:
+            return self.client.post(path, data={'file' : (f, file_name)})
+
+    def poll(self, job_id, timeout=10):
+        '''
+        Polls the job @job_id until it is finished and returns it.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            response = self.client.get('/jobs/' + job_id)
+            self.assertEqual(response.status_code, 200)
+            job = json.loads(response.data)
+            if job['status'] in ('done', 'failed'):
+                return job
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def execute(self, filename, formula_string):
+        response = self.client.post('/execute', data=json.dumps({
+            'filename' : filename,
+            'formulaString' : formula_string
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)['data']
+
+    def test_upload(self):
+        response = self.upload('cashflow_test.csv')
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.data)['job']
+        job = self.poll(job_id)
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['progress'], 1.0)
+        data_file = os.path.join(self.folder, 'cashflow_test.csv')
+        self.assertEqual(job['result']['filename'], data_file)
+        self.assertIn('Late Fee', job['result']['titles'])
+        self.assertIn('OCT 17', job['result']['dates'])
+        self.assertEqual(self.execute(data_file,
+                                      'get_cell_by_text(0, Late Fee, OCT 17)'),
+                         '220.0')
+
+    def test_failed_upload(self):
+        response = self.client.post('/upload', data={
+            'file' : (StringIO.StringIO('no dates here\n'), 'notes.csv')})
+        self.assertEqual(response.status_code, 202)
+        job = self.poll(json.loads(response.data)['job'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertTrue(job['error'])
+        self.assertNotIn('result', job)
+        response = self.client.get('/reports/' + job['id'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Unable to process upload', response.data)
+
+    def test_unknown_job(self):
+        response = self.client.get('/jobs/nope')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', json.loads(response.data))
+        self.assertEqual(self.client.get('/reports/nope').status_code, 404)
+        self.assertEqual(self.client.post('/upload').status_code, 400)
+
+    def test_form_upload(self):
+        response = self.upload('cashflow_test.csv', '/')
+        self.assertEqual(response.status_code, 303)
+        path = response.headers['Location'].split('localhost', 1)[-1]
+        job_id = path.rsplit('/', 1)[1]
+        self.assertEqual(path, '/reports/' + job_id)
+        self.assertEqual(self.poll(job_id)['status'], 'done')
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(os.path.join(self.folder, 'cashflow_test.csv'),
+                      response.data)
+
+    def test_workbook_sheets(self):
+        response = self.upload('properties_test.xlsx')
+        job = self.poll(json.loads(response.data)['job'])
+        self.assertEqual(job['status'], 'done')
+        sheets = job['result']['sheets']
+        self.assertEqual([sheet['name'] for sheet in sheets],
+                         ['Hardy', 'Hardy (Tempe)'])
+        self.assertEqual(job['result']['filename'], sheets[0]['filename'])
+        # Every sheet is registered and queried through its CSV.
+        for sheet in sheets:
+            self.assertEqual(serve.TRAVERSER_REGISTRY.get(
+                sheet['filename']).name, sheet['name'])
+            self.assertEqual(self.execute(
+                sheet['filename'],
+                'get_cell_by_text(0, Late Fee, OCT 17)'), '220.0')
+        response = self.client.get('/reports/' + job['id'] +
+                                   '?sheet=Hardy%20(Tempe)')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(sheets[1]['filename'], response.data)
+        response = self.client.get('/reports/' + job['id'] + '?sheet=Nope')
+        self.assertEqual(response.status_code, 404)
+
+    def test_workbook_skips_other_sheets(self):
+        # The second sheet of the workbook is not a report.
+        response = self.upload('cashflow_test.xlsx')
+        job = self.poll(json.loads(response.data)['job'])
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual([sheet['name'] for sheet in job['result']['sheets']],
+                         ['Cash Flow'])
+        self.assertIn('Late Fee', job['result']['titles'])
+
+class ExecuteCaching(unittest.TestCase):
+    LATE_FEES = 'get_cells_by_title(0, Late Fee)'
+    JAN_LATE_FEE = 'get_cell_by_text(0, Late Fee, JAN 17)'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.folder, 'cashflow_test.csv')
+        shutil.copyfile(os.path.join(root_path, 'testdata/cashflow_test.csv'),
+                        self.data_file)
+        serve.RESULT_CACHE.clear()
+        self.client = serve.app.test_client()
+
+    def tearDown(self):
+        serve.TRAVERSER_REGISTRY.invalidate(self.data_file)
+        shutil.rmtree(self.folder)
+
+    def execute(self, formula_string, is_list=True, headers={}):
+        return self.client.post('/execute', data=json.dumps({
+            'filename' : self.data_file,
+            'formulaString' : formula_string,
+            'isList' : is_list
+        }), content_type='application/json', headers=headers)
+
+    def test_etag(self):
+        response = self.execute(ExecuteCaching.LATE_FEES)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIn('Accept', response.headers['Vary'])
+        self.assertEqual(json.loads(response.data)['titles'][0], 'Late Fee')
+        # Formulas that only differ in spacing share an ETag.
+        respaced = self.execute('get_cells_by_title( 0,Late Fee )')
+        self.assertEqual(respaced.headers['ETag'], etag)
+        self.assertEqual(respaced.data, response.data)
+        # ETags differ by formula, isList and representation.
+        self.assertNotEqual(
+            self.execute('get_cells_by_title(0, Rent-Tempe)').headers['ETag'],
+            etag)
+        self.assertNotEqual(
+            self.execute(ExecuteCaching.LATE_FEES, False).headers['ETag'], etag)
+        ndjson = self.execute(ExecuteCaching.LATE_FEES,
+                              headers={'Accept' : 'application/x-ndjson'})
+        self.assertEqual(ndjson.mimetype, 'application/x-ndjson')
+        self.assertNotEqual(ndjson.headers['ETag'], etag)
+
+    def test_not_modified(self):
+        etag = self.execute(ExecuteCaching.LATE_FEES).headers['ETag']
+        response = self.execute(ExecuteCaching.LATE_FEES,
+                                headers={'If-None-Match' : etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.assertEqual(response.headers['ETag'], etag)
+        # Weakened validators, e.g. from proxies that compress responses,
+        # also match.
+        for if_none_match in ('W/' + etag, '"other", W/' + etag, '*'):
+            response = self.execute(ExecuteCaching.LATE_FEES,
+                                    headers={'If-None-Match' : if_none_match})
+            self.assertEqual(response.status_code, 304)
+        response = self.execute(ExecuteCaching.LATE_FEES,
+                                headers={'If-None-Match' : '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_results(self):
+        first = self.execute(ExecuteCaching.LATE_FEES)
+        # Streamed bodies are cached once fully sent.
+        body = first.data
+        hits = serve.RESULT_CACHE.stats()['hits']
+        second = self.execute(ExecuteCaching.LATE_FEES)
+        self.assertEqual(serve.RESULT_CACHE.stats()['hits'], hits + 1)
+        self.assertEqual(second.data, body)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        singleton = self.execute(ExecuteCaching.JAN_LATE_FEE, False)
+        self.assertEqual(json.loads(singleton.data)['data'], '0.0')
+        self.assertEqual(self.execute(ExecuteCaching.JAN_LATE_FEE, False).data,
+                         singleton.data)
+        self.assertEqual(serve.RESULT_CACHE.stats()['hits'], hits + 2)
+
+    def test_changed_report(self):
+        response = self.execute(ExecuteCaching.LATE_FEES)
+        etag = response.headers['ETag']
+        self.assertIn('220.0', json.loads(response.data)['data'])
+        # A same-size upload moved over the report within the same mtime.
+        stat = os.stat(self.data_file)
+        with open(self.data_file) as f:
+            contents = f.read()
+        upload = os.path.join(self.folder, 'upload.csv')
+        with open(upload, 'w') as f:
+            f.write(contents.replace('220.0', '221.0', 1))
+        os.utime(upload, (stat.st_atime, stat.st_mtime))
+        os.rename(upload, self.data_file)
+        response = self.execute(ExecuteCaching.LATE_FEES,
+                                headers={'If-None-Match' : etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('221.0', json.loads(response.data)['data'])
+
+class ExecuteBatch(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.folder, 'cashflow_test.csv')
+        shutil.copyfile(os.path.join(root_path, 'testdata/cashflow_test.csv'),
+                        self.data_file)
+        self.client = serve.app.test_client()
+
+    def tearDown(self):
+        serve.TRAVERSER_REGISTRY.invalidate(self.data_file)
+        shutil.rmtree(self.folder)
+
+    def execute_batch(self, payload):
+        return self.client.post('/execute_batch', data=json.dumps(payload),
+                                content_type='application/json')
+
+    def test_results(self):
+        response = self.execute_batch({
+            'filename' : self.data_file,
+            'formulas' : [
+                {'formulaString' : 'get_cell_by_text(0, Late Fee, JAN 17)'},
+                {'formulaString' : 'Divide(1, 0)'},
+                {'formulaString' : 'get_cells_by_title(0, Late Fee)',
+                 'isList' : True},
+                {'formulaString' : 'NoSuchFunction(1)'}
+            ]
+        })
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0], {
+            'data' : '0.0', 'titles' : 'Late Fee', 'dates' : 'JAN 17'})
+        self.assertEqual(results[1].keys(), ['error'])
+        self.assertEqual(results[2]['titles'][0], 'Late Fee')
+        self.assertIn('220.0', results[2]['data'])
+        self.assertIn('NoSuchFunction', results[3]['error'])
+
+    def test_shared_evaluation(self):
+        calls = []
+        evaluate_formula = serve.evaluate_formula
+
+        def record(formula_string, is_list, traversers, memo=None):
+            calls.append((traversers, memo))
+            return evaluate_formula(formula_string, is_list, traversers, memo)
+        serve.evaluate_formula = record
+        self.addCleanup(setattr, serve, 'evaluate_formula', evaluate_formula)
+        response = self.execute_batch({
+            'filename' : self.data_file,
+            'formulas' : [
+                {'formulaString' : 'Add(get_cells_by_title(0, Late Fee))'},
+                {'formulaString' : 'Count(get_cells_by_title(0, Late Fee))'}
+            ]
+        })
+        self.assertEqual(response.status_code, 200)
+        for result in json.loads(response.data)['results']:
+            self.assertNotIn('error', result)
+        self.assertEqual(len(calls), 2)
+        (traversers, memo), (other_traversers, other_memo) = calls
+        self.assertIs(traversers, other_traversers)
+        self.assertIs(memo, other_memo)
+        self.assertIs(traversers[0],
+                      serve.TRAVERSER_REGISTRY.get(self.data_file))
+        # The title lookup both formulas share was made once, for the report.
+        self.assertEqual(len(memo), 1)
+        self.assertEqual(len(memo.values()[0]), 1)
+
+    def test_bad_request(self):
+        for payload in ({}, {'filename' : self.data_file},
+                        {'filename' : self.data_file, 'formulas' : 'Add(1)'}):
+            response = self.execute_batch(payload)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', json.loads(response.data))
+        for data in ('', 'not json'):
+            response = self.client.post('/execute_batch', data=data,
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/execute_batch',
+                                    data={'filename' : self.data_file})
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,8 +21,10 @@ OUT_FOLDER = 'out'
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('file', help='run ETL on a supplied file')
+    parser.add_argument(
+        '--sheets', nargs='+',
+        help='names of the workbook sheets to run ETL on, all by default')
     args = parser.parse_args()
-    data_file = report_utils.to_csv(args.file, OUT_FOLDER)
 
     # Algo:
     # A rolling rent collection report, at a high level, is a 2D matrix with
@@ -32,14 +34,22 @@ def main():
     # a) Mapping each axis to either time or row title.
     # b) Computing the start index of both time and row title.
 
-    axis_decision = report_utils.AxisDecision(data_file)
-    axis_decision.decide()
-    traverser = report_utils.ReportTraverser(
-        data_file,
-        axis_decision.date_axis,
-        axis_decision.date_index,
-        axis_decision.title_axis,
-        axis_decision.title_index)
+    if args.file.endswith('.xlsx'):
+        # Each sheet of a workbook is a report, decided and traversed in
+        # memory, with its CSV written to OUT_FOLDER on the side. Sheets are
+        # processed in parallel.
+        traversers = report_utils.load_workbook(args.file, args.sheets,
+                                                OUT_FOLDER)
+    else:
+        data_file = report_utils.to_csv(args.file, OUT_FOLDER)
+        axis_decision = report_utils.AxisDecision(data_file)
+        axis_decision.decide()
+        traversers = [report_utils.ReportTraverser(
+            data_file,
+            axis_decision.date_axis,
+            axis_decision.date_index,
+            axis_decision.title_axis,
+            axis_decision.title_index)]
 
 if __name__ == '__main__':
     main()
@@ -9,3 +9,4 @@ __email__ = 'aditya@adityaviswanathan.com'
 
 from formula_engine.parse_tree import ParseTree
 from formula_engine.function import Function
+from formula_engine.formula_cache import FormulaCache
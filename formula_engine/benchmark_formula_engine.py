@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks ParseTree evaluation against a synthetic report.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from parse_tree import ParseTree
+# Append parent dir to $PYTHONPATH to import ReportTraverser, whose public
+# methods have bindings into the ParseTreeNode.
+my_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(my_path, os.pardir)))
+from report_utils import ReportTraverser
+from report_utils.axis import Axis
+from report_utils.benchmark_report_utils import synthetic_dates, \
+    synthetic_titles, write_synthetic_report
+
+def bench(label, func, number):
+    secs = min(timeit.repeat(func, repeat=3, number=number)) / number
+    print('{label:<40} {ms:>12.3f} ms'.format(label=label, ms=secs * 1000))
+
+def formulas(num_titles, num_dates):
+    titles = synthetic_titles(num_titles)
+    dates = synthetic_dates(num_dates)
+    by_dates = ', '.join(['get_cells_by_date(0, ' + date + ')'
+                          for date in dates[:12]])
+    return [
+        ('vector add of 12 dates', 'VectorAdd(' + by_dates + ')'),
+        ('vector divide of 2 dates',
+         'VectorDivide(get_cells_by_date(0, ' + dates[0] + '), ' +
+         'get_cells_by_date(0, ' + dates[1] + '))'),
+        ('average of a title',
+         'Average(get_cells_by_title(0, ' + titles[num_titles // 2] + '))'),
+        ('scalar arithmetic', 'Add(Multiply(12, 100), Divide(10, 4), 1)'),
+    ]
+
+def bench_formulas(file_name, num_titles, num_dates, number):
+    for numeric in [False, True]:
+        mode = 'numeric' if numeric else 'in-memory'
+        traverser = ReportTraverser(file_name, Axis.ROW, 0, Axis.COL, 0,
+                                    in_memory=True, numeric=numeric)
+        for label, formula in formulas(num_titles, num_dates):
+            bench(mode + ' ' + label,
+                  lambda : ParseTree(formula, [traverser]).evaluate_tree(
+                      is_list=True),
+                  number)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--titles', type=int, default=10000,
+                        help='number of title rows in the synthetic report')
+    parser.add_argument('--dates', type=int, default=60,
+                        help='number of date columns in the synthetic report')
+    parser.add_argument('--number', type=int, default=5,
+                        help='number of evaluations timed per formula')
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(folder, 'synthetic.csv')
+        write_synthetic_report(file_name, args.titles, args.dates)
+        print('Synthetic report: {titles} titles x {dates} dates'
+              .format(titles=args.titles, dates=args.dates))
+        bench_formulas(file_name, args.titles, args.dates, args.number)
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    main()
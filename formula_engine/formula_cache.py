@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+'''
+Bounded LRU cache of parsed and compiled formulas, keyed by formula string.
+Cached ParseTrees are not bound to any traversers, so a single cached formula
+can be evaluated against any list of traversers via
+ParseTree.evaluate_tree(traversers=...).
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import collections
+import threading
+from parse_tree import ParseTree
+
+class FormulaCache(object):
+    DEFAULT_MAX_SIZE = 512
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        if max_size < 1:
+            raise Exception('FormulaCache requires a max_size of at least 1')
+        self.max_size = max_size
+        self.trees = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, formula_string):
+        '''
+        Returns the compiled ParseTree for @formula_string, parsing and
+        compiling it on a cache miss. Formulas that fail to compile are not
+        cached.
+        '''
+        with self.lock:
+            tree = self.trees.pop(formula_string, None)
+            if tree is not None:
+                self.hits += 1
+                # Re-insert to mark as most recently used.
+                self.trees[formula_string] = tree
+                return tree
+            self.misses += 1
+        tree = ParseTree(formula_string)
+        tree.compile_tree()
+        with self.lock:
+            self.trees[formula_string] = tree
+            while len(self.trees) > self.max_size:
+                self.trees.popitem(last=False)
+        return tree
+
+    def clear(self):
+        with self.lock:
+            self.trees.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size' : len(self.trees),
+                'max_size' : self.max_size,
+                'hits' : self.hits,
+                'misses' : self.misses
+            }
@@ -8,6 +8,7 @@ __author__ = 'Aditya Viswanathan'
 __email__ = 'aditya@adityaviswanathan.com'
 
 import math
+import numpy
 import operator
 import os
 import sys
@@ -39,6 +40,8 @@ class Function(object):
         'get_cell_by_text',
         'get_cells_by_date',
         'get_cells_by_title',
+        'get_block',
+        'get_grid',
         'VectorAdd',
         'VectorSubtract',
         'VectorMultiply',
@@ -51,7 +54,14 @@ class Function(object):
         'get_dates',
         'get_titles',
         'get_cells_by_date',
-        'get_cells_by_title'])
+        'get_cells_by_title',
+        'get_block',
+        'get_grid'])
+    # Returns a list of lists of cells, one per title, which are flattened in
+    # title order.
+    GRID_BINDINGS = set([
+        'get_block',
+        'get_grid'])
     # Expects list arguments.
     VECTOR_FUNCTIONS = set([
         'VectorAdd',
@@ -87,6 +97,8 @@ class Function(object):
     CELL_BINDINGS = set([
         'get_cells_by_date',
         'get_cells_by_title',
+        'get_block',
+        'get_grid',
         'get_cell_by_index',
         'get_cell_by_text'])
     FUNCTION_ARGC = {
@@ -99,10 +111,27 @@ class Function(object):
         'get_cell_by_index' : 3,
         'get_cell_by_text' : 3,
         'get_cells_by_date' : 2,
-        'get_cells_by_title' : 2
+        'get_cells_by_title' : 2,
+        'get_block' : 5,
+        'get_grid' : 1
+    }
+    # NumPy ufuncs that vectorize the operators of VECTOR_FUNCTIONS.
+    VECTOR_UFUNCS = {
+        'add' : 'add',
+        'sub' : 'subtract',
+        'mul' : 'multiply',
+        'truediv' : 'true_divide',
+        'floordiv' : 'floor_divide'
     }
     BINDINGS = LIST_BINDINGS | SINGLETON_BINDINGS
+    # Bindings dispatched by traverser_func, which accept a memo of responses.
+    TRAVERSER_BINDINGS = set(BINDINGS)
     RETURNS_LIST = LIST_BINDINGS | VECTOR_FUNCTIONS
+    # Class-level registry of function definitions, keyed by function name.
+    # Populated once below and extended via Function.register.
+    DEFINITIONS = {}
+    # Definitions that also take the calling node's traversers and parent.
+    CONTEXTUAL_DEFINITIONS = set()
 
     @staticmethod
     def operator_func(n):
@@ -117,45 +146,57 @@ class Function(object):
 
     @staticmethod
     def vector_operator_func(n):
+        '''
+        Private helper that applies a well-defined Python built-in operator
+        element-wise across a list of vectors. The vectors are zero-padded to
+        the same length and reduced in a single NumPy call; Cells are only
+        rebuilt for the result, annotated by the first vector.
+        '''
+        ufunc = getattr(numpy, Function.VECTOR_UFUNCS[n])
+
         def sparse(veclist):
             maxlen = max(map(len, veclist))
-            sparse_veclist = []
             # Append zeros (make sparse) to any vector whose length is less
             # than maxlen.
-            for vec in veclist:
-                sparse_veclist.append(
-                    vec + [Cell(0)]*(maxlen - len(vec)))
-            return sparse_veclist
+            sparse_matrix = numpy.zeros((len(veclist), maxlen))
+            for vec_index, vec in enumerate(veclist):
+                sparse_matrix[vec_index, :len(vec)] = [float(i.val) for i in vec]
+            return sparse_matrix
 
-        def flatten(sparse_veclist):
-            flattened_vec = []
-            # All vectors are the same length at the time of this call, so we
-            # can safely resort to the length of the first vector in the list
-            # of vectors.
-            for i in range(0, len(sparse_veclist[0])):
-                flattened_vec.append(Cell(
-                    reduce(getattr(operator, n),
-                           [float(vec[i].val) for vec in sparse_veclist]),
-                    sparse_veclist[0][i].title,
-                    sparse_veclist[0][i].date))
-            return flattened_vec
+        def flatten(veclist, sparse_matrix):
+            # Python raises on division by zero where NumPy would return inf
+            # or nan, so check divisors up front to preserve that behavior.
+            if (n in ['truediv', 'floordiv'] and
+                    (sparse_matrix[1:] == 0).any()):
+                raise ZeroDivisionError('float division by zero')
+            with numpy.errstate(over='ignore', invalid='ignore'):
+                flattened = ufunc.reduce(sparse_matrix, axis=0).tolist()
+            # Padded entries of the first vector carry no annotations.
+            first_vec = veclist[0]
+            return [Cell(val,
+                         first_vec[i].title if i < len(first_vec) else None,
+                         first_vec[i].date if i < len(first_vec) else None)
+                    for i, val in enumerate(flattened)]
 
         # Args list @a is a list of vectors of cells.
-        return lambda a : flatten(sparse(a))
+        return lambda a : flatten(a, sparse(a))
 
     @staticmethod
     def constant_func(val):
         return [Cell(val, None)]
 
-    def average_func(self, args):
-        fails = 0
-        subtract_args = [self.function_defs['Count'](args)[0],
-            Function.constant_func(fails)[0]]
-        real_count = self.function_defs['Subtract'](subtract_args)[0]
-        divide_args = [self.function_defs['Add'](args)[0], real_count]
-        return self.function_defs['Divide'](divide_args)
+    @staticmethod
+    def average_func(args):
+        # Sums and counts @args in a single pass, rather than evaluating Count,
+        # Subtract, Add and Divide over @args in turn.
+        total = reduce(operator.add, [float(i.val) for i in args])
+        return [ReportTraverser.cell_to_float(Cell(
+            total / float(len(args)),
+            args[0].title,
+            args[0].date))]
 
-    def traverser_func(self, n):
+    @staticmethod
+    def traverser_func(n):
         '''
         Private helper that maps @n to its corresponding API in
         ReportTraverser. In the case of singleton responses, we return a
@@ -164,97 +205,239 @@ class Function(object):
         which is handled here. In the case we cannot safely convert a
         particular cell to numeric, we skip over it.
         '''
-        def dispatch(arr, is_list):
-            traverser_index = int(float(arr[0].val)) # 1st arg is report index.
-            traverser_args = arr[1:] if len(arr) > 1 else []
-            # Execute the ReportTraverser binding.
-            vals = lambda a : [i.val for i in a]
-            res = getattr(self.traversers[traverser_index], n)(*vals(traverser_args))
-            wrapped_res = res if is_list else [res]
+        def dispatch(arr, traversers, parent, memo=None):
+            is_numeric = Function.is_numeric_context(parent)
+            res, is_float = Function.fetch_binding(n, arr, traversers,
+                                                   is_numeric, memo)
             # Don't typecast to float if the caller does not require a numeric
-            # response.
-            if self.parent is None or self.parent.val not in Function.NUMERIC_FUNCTIONS:
-                return wrapped_res
-            return ReportTraverser.cells_to_floats(wrapped_res, True)
+            # response or the cells were already served as floats.
+            if not is_numeric or is_float:
+                return res
+            return ReportTraverser.cells_to_floats(res, True)
 
-        return lambda a : dispatch(a, n in Function.LIST_BINDINGS)
+        return dispatch
+
+    @staticmethod
+    def is_numeric_context(parent):
+        return parent is not None and parent.val in Function.NUMERIC_FUNCTIONS
 
-    def if_else_func(self, args):
+    @staticmethod
+    def fetch_binding(n, arr, traversers, is_numeric, memo=None):
+        '''
+        Private helper that executes the ReportTraverser binding @n over args
+        @arr, returning the cells in list form and whether they are already
+        floats. Responses are cached in @memo, if given, so that a binding
+        shared by several nodes or formulas is executed only once.
+        '''
+        # 1st arg is report index or name.
+        traverser_index = Function.traverser_index(arr[0].val, traversers)
+        traverser_args = tuple(i.val for i in arr[1:])
+        traverser = traversers[traverser_index]
+        # Numeric traversers serve numeric callers straight from their
+        # precomputed float matrix, skipping string parsing altogether.
+        is_float = (is_numeric and traverser.values is not None and
+                    n in ReportTraverser.FLOAT_BINDINGS)
+        key = (n, traverser_index, traverser_args, is_float)
+        if memo is not None and key in memo:
+            return list(memo[key]), is_float
+        if is_float:
+            res = getattr(traverser, ReportTraverser.FLOAT_BINDINGS[n])(
+                *traverser_args)
+        else:
+            # Execute the ReportTraverser binding.
+            res = getattr(traverser, n)(*traverser_args)
+            if n in Function.GRID_BINDINGS:
+                res = [cell for cells in res for cell in cells]
+            res = res if n in Function.LIST_BINDINGS else [res]
+        if memo is not None:
+            memo[key] = res
+            res = list(res)
+        return res, is_float
+
+    @staticmethod
+    def traverser_index(ref, traversers):
+        '''
+        Returns the index in @traversers of the traverser that @ref addresses,
+        either by its index or by its name, e.g. the name of its sheet.
+        Numeric refs are always indexes, and must be whole and not negative.
+        '''
+        try:
+            index = float(ref)
+        except ValueError:
+            index = None
+        if index is not None:
+            if not index.is_integer() or index < 0:
+                raise Exception('Expected a whole traverser index of at least '
+                                '0, found "' +
+                                Function.unicode_text(ref).encode('utf-8') +
+                                '".')
+            return int(index)
+        # Sheet names are read as unicode, while formulas may be byte strings,
+        # so both are compared as unicode.
+        name = Function.unicode_text(ref)
+        for index, traverser in enumerate(traversers):
+            if traverser.name is not None and \
+                    Function.unicode_text(traverser.name) == name:
+                return index
+        raise Exception('Cannot find traverser named "' +
+                        name.encode('utf-8') + '".')
+
+    @staticmethod
+    def unicode_text(text):
+        # Byte strings are taken to be UTF-8.
+        return text if isinstance(text, unicode) else \
+            str(text).decode('utf-8', 'replace')
+
+    @staticmethod
+    def if_else_func(args, traversers, parent):
+        branch = args[1] if Function.if_else_condition(args) else args[2]
+        return Function.if_else_result(branch, parent)
+
+    @staticmethod
+    def if_else_condition(args):
         # Expects boolean numeric as condition value.
-        check_condition = lambda args : args[0].val > 0.0
-        def success_case(args):
-            # If the return value of the success block is list and this is not
-            # the root node, then return the list itself instead of wrapping a
-            # singleton.
-            if isinstance(args[1], list) and self.parent is not None:
-                return args[1]
-            return [args[1]]
-        def failure_case(args):
-            # If the return value of the success block is list and this is not
-            # the root node, then return the list itself instead of wrapping a
-            # singleton.
-            if isinstance(args[2], list) and self.parent is not None:
-                return args[2]
-            return [args[2]]
-        return success_case(args) if check_condition(args) else failure_case(args)
+        return args[0].val > 0.0
+
+    @staticmethod
+    def if_else_result(branch, parent):
+        # If the return value of the selected block is list and this is not
+        # the root node, then return the list itself instead of wrapping a
+        # singleton.
+        if isinstance(branch, list) and parent is not None:
+            return branch
+        return [branch]
+
+    @staticmethod
+    def register(name, definition, argc=None, contextual=False, numeric=False,
+                 vector=False, list_binding=False, singleton_binding=False):
+        '''
+        Registers @definition as the function @name, making it available to
+        formulas without editing NAMES and the set constants by hand. The
+        definition is called as definition(args), or as
+        definition(args, traversers, parent) if it is @contextual. Bindings
+        are always contextual.
+        '''
+        Function.NAMES.add(name)
+        if argc is not None:
+            Function.FUNCTION_ARGC[name] = argc
+        if numeric:
+            Function.NUMERIC_FUNCTIONS.add(name)
+        if vector:
+            Function.VECTOR_FUNCTIONS.add(name)
+            Function.RETURNS_LIST.add(name)
+        if list_binding:
+            Function.LIST_BINDINGS.add(name)
+            Function.RETURNS_LIST.add(name)
+        if singleton_binding:
+            Function.SINGLETON_BINDINGS.add(name)
+        if list_binding or singleton_binding:
+            Function.BINDINGS.add(name)
+            contextual = True
+        Function.DEFINITIONS[name] = definition
+        Function.TRAVERSER_BINDINGS.discard(name)
+        if contextual:
+            Function.CONTEXTUAL_DEFINITIONS.add(name)
+        else:
+            Function.CONTEXTUAL_DEFINITIONS.discard(name)
+
+    @staticmethod
+    def unregister(name):
+        '''
+        Removes the function @name registered with register.
+        '''
+        Function.NAMES.discard(name)
+        Function.FUNCTION_ARGC.pop(name, None)
+        Function.DEFINITIONS.pop(name, None)
+        for names in (Function.NUMERIC_FUNCTIONS, Function.VECTOR_FUNCTIONS,
+                      Function.RETURNS_LIST, Function.LIST_BINDINGS,
+                      Function.SINGLETON_BINDINGS, Function.BINDINGS,
+                      Function.CONTEXTUAL_DEFINITIONS):
+            names.discard(name)
+
+    @staticmethod
+    def call(func_name, args=[], traversers=[], parent=None):
+        '''
+        Evaluates the function @func_name over @args, where @traversers and
+        @parent are the context of the calling node.
+        '''
+        definition = Function.lookup(func_name)
+        Function.check_argc(func_name, args)
+        if func_name in Function.CONTEXTUAL_DEFINITIONS:
+            return definition(args, traversers, parent)
+        return definition(args)
+
+    @staticmethod
+    def lookup(func_name):
+        '''
+        Returns the registered definition of @func_name.
+        '''
+        if func_name not in Function.DEFINITIONS:
+            raise Exception(
+                'Cannot find definition for function "' + func_name + '".')
+        return Function.DEFINITIONS[func_name]
+
+    @staticmethod
+    def check_argc(func_name, args):
+        if func_name in Function.FUNCTION_ARGC and \
+                len(args) != Function.FUNCTION_ARGC[func_name]:
+            raise Exception(
+                'Expected ' + str(Function.FUNCTION_ARGC[func_name]) + \
+                ' args for ' + func_name + ', found ' + \
+                str(len(args)) + ' (' + str(args) + ').')
 
     def is_recognized_function(self):
-        return self.func_name in self.function_defs.keys()
+        return self.func_name in Function.DEFINITIONS
 
     def __init__(self, func_name, traversers=[], parent=None):
         self.func_name = func_name
         self.traversers = traversers
         self.parent = parent
 
-        self.function_defs = {
-            'Add' : Function.operator_func('add'), # varargs.
-            'Subtract' : Function.operator_func('sub'), # varargs.
-            'Multiply' : Function.operator_func('mul'), # varargs.
-            'Divide' : Function.operator_func('truediv'), # varargs.
-            'FloorDivide' : Function.operator_func('floordiv'), # varargs.
-            'GreaterThan' : Function.operator_func('gt'), # boolean (0/1) return type.
-            'GreaterEqualThan' : Function.operator_func('ge'), # boolean (0/1) return type.
-            'LessThan' : Function.operator_func('lt'), # boolean (0/1) return type.
-            'LessEqualThan' : Function.operator_func('le'), # boolean (0/1) return type.
-            'Count' : (lambda a : [Cell(
-                len(a),
-                a[0].title if len(a) > 0 else Cell(None),
-                a[0].date if len(a) > 0 else Cell(None))]), # varargs.
-            'Average' : self.average_func, # varargs.
-            'Floor' : (lambda a : [Cell(
-                math.floor(float(a[0].val)),
-                a[0].title,
-                a[0].date)]),
-            'Ceiling' : (lambda a : [Cell(
-                math.ceil(float(a[0].val)),
-                a[0].title,
-                a[0].date)]),
-            'Round' : (lambda a : [Cell(
-                round(float(a[0].val), int(a[1].val)),
-                a[0].title,
-                a[0].date)]),
-            'get_dates' : self.traverser_func('get_dates'),
-            'get_titles' : self.traverser_func('get_titles'),
-            'get_cell_by_index' : self.traverser_func('get_cell_by_index'),
-            'get_cell_by_text' : self.traverser_func('get_cell_by_text'),
-            'get_cells_by_date' : self.traverser_func('get_cells_by_date'),
-            'get_cells_by_title' : self.traverser_func('get_cells_by_title'),
-            'VectorAdd' : Function.vector_operator_func('add'),
-            'VectorSubtract' : Function.vector_operator_func('sub'),
-            'VectorMultiply' : Function.vector_operator_func('mul'),
-            'VectorDivide' : Function.vector_operator_func('truediv'),
-            'VectorFloorDivide' : Function.vector_operator_func('floordiv'),
-            'IfElse' : self.if_else_func
-        }
-
     def evaluate(self, args=[]):
-        if not self.is_recognized_function():
-            raise Exception(
-                'Cannot find definition for function "' + self.func_name + '".')
-        if self.func_name in Function.FUNCTION_ARGC and \
-                len(args) != Function.FUNCTION_ARGC[self.func_name]:
-            raise Exception(
-                'Expected ' + str(Function.FUNCTION_ARGC[self.func_name]) + \
-                ' args for ' + self.func_name + ', found ' + \
-                str(len(args)) + ' (' + str(args) + ').')
-        return self.function_defs[self.func_name](args)
+        return Function.call(self.func_name, args, self.traversers, self.parent)
+
+# Registers the built-in function definitions. Function.NAMES and the set
+# constants above already describe these functions.
+Function.DEFINITIONS.update({
+    'Add' : Function.operator_func('add'), # varargs.
+    'Subtract' : Function.operator_func('sub'), # varargs.
+    'Multiply' : Function.operator_func('mul'), # varargs.
+    'Divide' : Function.operator_func('truediv'), # varargs.
+    'FloorDivide' : Function.operator_func('floordiv'), # varargs.
+    'GreaterThan' : Function.operator_func('gt'), # boolean (0/1) return type.
+    'GreaterEqualThan' : Function.operator_func('ge'), # boolean (0/1) return type.
+    'LessThan' : Function.operator_func('lt'), # boolean (0/1) return type.
+    'LessEqualThan' : Function.operator_func('le'), # boolean (0/1) return type.
+    'Count' : (lambda a : [Cell(
+        len(a),
+        a[0].title if len(a) > 0 else Cell(None),
+        a[0].date if len(a) > 0 else Cell(None))]), # varargs.
+    'Average' : Function.average_func, # varargs.
+    'Floor' : (lambda a : [Cell(
+        math.floor(float(a[0].val)),
+        a[0].title,
+        a[0].date)]),
+    'Ceiling' : (lambda a : [Cell(
+        math.ceil(float(a[0].val)),
+        a[0].title,
+        a[0].date)]),
+    'Round' : (lambda a : [Cell(
+        round(float(a[0].val), int(a[1].val)),
+        a[0].title,
+        a[0].date)]),
+    'get_dates' : Function.traverser_func('get_dates'),
+    'get_titles' : Function.traverser_func('get_titles'),
+    'get_cell_by_index' : Function.traverser_func('get_cell_by_index'),
+    'get_cell_by_text' : Function.traverser_func('get_cell_by_text'),
+    'get_cells_by_date' : Function.traverser_func('get_cells_by_date'),
+    'get_cells_by_title' : Function.traverser_func('get_cells_by_title'),
+    'get_block' : Function.traverser_func('get_block'),
+    'get_grid' : Function.traverser_func('get_grid'),
+    'VectorAdd' : Function.vector_operator_func('add'),
+    'VectorSubtract' : Function.vector_operator_func('sub'),
+    'VectorMultiply' : Function.vector_operator_func('mul'),
+    'VectorDivide' : Function.vector_operator_func('truediv'),
+    'VectorFloorDivide' : Function.vector_operator_func('floordiv'),
+    'IfElse' : Function.if_else_func
+})
+Function.CONTEXTUAL_DEFINITIONS.update(Function.BINDINGS | set(['IfElse']))
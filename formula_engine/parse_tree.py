@@ -14,11 +14,16 @@ class ParseTree(object):
     TOKEN_ARG_START = '('
     TOKEN_ARG_END = ')'
     TOKEN_ARG_DELIMITER = ','
+    # Quotes args that hold the other tokens, e.g. sheet names such as
+    # "Hardy (Tempe)". Quoted args are taken as is, up to the closing quote.
+    TOKEN_QUOTE = '"'
 
     def __init__(self, input_str, traversers=[]):
         self.input = input_str
         self.traversers = traversers
         self.root = None
+        # Closure compiled from the built tree, reused across evaluations.
+        self.program = None
 
     @staticmethod
     def evaluate_trees(trees):
@@ -27,26 +32,101 @@ class ParseTree(object):
             vals.append(tree.evaluate_tree(is_list=False))
         return vals
 
-    def evaluate_tree(self, is_list=False):
+    def evaluate_tree(self, is_list=False, traversers=None, memo=None):
         '''
-        Recursively evaluates the ParseTree.
+        Evaluates the ParseTree by running its compiled program, building and
+        compiling the tree on first use. Evaluates against @traversers if
+        provided, else against the traversers the ParseTree was built with.
+        Passing the same @memo dict to several evaluations shares the results
+        of common subtrees and traverser bindings across them, e.g. across a
+        batch of formulas run on the same report.
+        '''
+        if self.program is None:
+            self.compile_tree()
+        res = self.program(self.traversers if traversers is None else
+                           traversers, memo)
+        if is_list:
+            # If the root is IfElse and the caller requests a return value of
+            # list, the list is the first and only element in the response.
+            return res[0] if self.root.val == 'IfElse' else res
+        return res[0]
+
+    def returns_list(self):
+        '''
+        Returns whether the formula evaluates to a list of cells rather than a
+        single cell, as inferred when the tree is built.
         '''
         if self.root is None:
             self.build_tree()
-        self.root.set_is_list(is_list)
-        if is_list:
-            return self.root.evaluate()
-        return self.root.evaluate()[0]
+        return self.root.returns_list
+
+    def normalize(self):
+        '''
+        Returns the formula in a canonical spelling, e.g. "Add(1, 2)" for
+        "Add( 1,2 )", building the tree on first use. Formulas with equal
+        normalized strings evaluate alike.
+        '''
+        if self.root is None:
+            self.build_tree()
+        return self.root.normalize()
+
+    def compile_tree(self):
+        '''
+        Compiles the ParseTree into a closure so that later evaluations skip
+        the recursive walk over ParseTreeNodes. Structurally identical subtrees
+        are evaluated once per evaluation.
+        '''
+        if self.root is None:
+            self.build_tree()
+        counts = {}
+        self.root.index_subtrees(counts)
+        shared_keys = frozenset([key for key, count in counts.iteritems()
+                                 if count > 1])
+        root_program = self.root.compile(shared_keys)
+
+        def program(traversers, memo=None):
+            # Results are memoized per list of traversers, so a memo shared
+            # across evaluations never mixes up results from distinct reports.
+            results = {} if memo is None else \
+                memo.setdefault(tuple([id(t) for t in traversers]), {})
+            return root_program(traversers, results)
+        self.program = program
 
     def build_tree(self):
         '''
         Builds a ParseTree over self.input by doing a linear scan of the input
-        string and mutating the ParseTree in-place.
+        string and mutating the ParseTree in-place. The built tree is then
+        checked and its constant subtrees folded (see ParseTreeNode.analyze).
         '''
         stutter = 0
         self.root = curr = None
+        self.program = None
+        quoted = False
+        # Contents of the quoted arg just scanned, if any.
+        quote = None
         for index, c in enumerate(self.input):
-            if c == ParseTree.TOKEN_ARG_START:
+            if quoted:
+                if c == ParseTree.TOKEN_QUOTE:
+                    quoted = False
+                    quote = self.input[stutter:index]
+                    stutter = index + 1
+                continue
+            if self.root is not None and curr is None and not c.isspace():
+                raise Exception('Unexpected "' + c + '" after the end of ' +
+                                'formula "' + self.input + '".')
+            if quote is not None and not c.isspace() and \
+                    c not in (ParseTree.TOKEN_ARG_END,
+                              ParseTree.TOKEN_ARG_DELIMITER):
+                raise Exception('Unexpected "' + c + '" after quoted arg "' +
+                                quote + '" in formula "' + self.input + '".')
+            if c == ParseTree.TOKEN_QUOTE:
+                if curr is None or self.input[stutter:index].strip():
+                    raise Exception('Unexpected "' + c + '" in formula "' +
+                                    self.input + '". Only whole args may ' +
+                                    'be quoted.')
+                quoted = True
+                stutter = index + 1
+            elif c == ParseTree.TOKEN_ARG_START:
                 func = ParseTreeNode(self.input[stutter:index].strip(),
                                      ParseTreeNodeType.FUNCTION,
                                      self.traversers,
@@ -58,21 +138,42 @@ class ParseTree(object):
                 curr = func
                 stutter = index + 1
             elif c == ParseTree.TOKEN_ARG_END:
-                if stutter != index and self.input[stutter:index].strip():
+                if curr is None:
+                    raise Exception('Unbalanced "' + c + '" in formula "' +
+                                    self.input + '".')
+                if quote is not None or (stutter != index and
+                                         self.input[stutter:index].strip()):
                     # Arg before delimiter must have been CONSTANT.
-                    arg = ParseTreeNode(self.input[stutter:index].strip(),
+                    arg = ParseTreeNode(self.input[stutter:index].strip()
+                                        if quote is None else quote,
                                         ParseTreeNodeType.CONSTANT,
                                         self.traversers,
                                         curr)
                     curr.children.append(arg)
                 curr = curr.parent
                 stutter = index + 1
+                quote = None
             elif c == ParseTree.TOKEN_ARG_DELIMITER:
-                if stutter != index:
+                if curr is None:
+                    raise Exception('Unexpected "' + c + '" outside of a ' +
+                                    'function in formula "' + self.input + '".')
+                if quote is not None or stutter != index:
                     # Arg before delimiter must have been CONSTANT.
-                    arg = ParseTreeNode(self.input[stutter:index].strip(),
+                    arg = ParseTreeNode(self.input[stutter:index].strip()
+                                        if quote is None else quote,
                                         ParseTreeNodeType.CONSTANT,
                                         self.traversers,
                                         curr)
                     curr.children.append(arg)
                 stutter = index + 1
+                quote = None
+        if quoted:
+            raise Exception('Missing closing ' + ParseTree.TOKEN_QUOTE +
+                            ' in formula "' + self.input + '".')
+        if self.root is None:
+            raise Exception('Formula "' + self.input + '" does not call a ' +
+                            'function.')
+        if curr is not None:
+            raise Exception('Missing "' + ParseTree.TOKEN_ARG_END + '" in ' +
+                            'formula "' + self.input + '".')
+        self.root.analyze()
@@ -23,6 +23,8 @@ from function import Function
 class ParseTreeNodeType(enum.Enum):
     CONSTANT = 0
     FUNCTION = 1
+    # Function over constants only, evaluated once when the tree is built.
+    FOLDED = 2
 
 class ParseTreeNode(object):
     def __init__(self, val, node_type, traversers, parent):
@@ -31,47 +33,253 @@ class ParseTreeNode(object):
         self.traversers = traversers
         self.parent = parent
         self.children = []
-        self.is_list = False
-
-    def set_is_list(self, is_list):
-        self.is_list = is_list
+        # Structural key of the subtree, set by index_subtrees.
+        self.key = None
+        # Whether the node may evaluate to a list of cells, set by analyze.
+        self.returns_list = False
+        # Cells of a FOLDED node.
+        self.cells = None
 
     def evaluate_with_args(self, args):
-        f = Function(self.val, self.traversers, self.parent)
-        # If the function to be evaluated is IfElse and the caller requests
-        # a return value of list, we need to return the list which is the first
-        # and only element in the response from Function.
-        if self.val == 'IfElse' and self.is_list:
-            return f.evaluate(args)[0]
-        return (Function.constant_func(self.val) \
-                if self.type == ParseTreeNodeType.CONSTANT \
-                else f.evaluate(args))
+        if self.type == ParseTreeNodeType.CONSTANT:
+            return Function.constant_func(self.val)
+        return Function.call(self.val, args, self.traversers, self.parent)
 
-    def evaluate(self):
-        # Specially handles arguments for IfElse. In particular, the first arg
-        # is a boolean numeric condition whereas the following two args are
-        # success/failure blocks that are substituted depending on the outcome
-        # of the condition.
-        def insert_if_else_arg(child, child_index, args):
-            if self.val == 'IfElse':
-                if child_index > 0 and child.val in Function.RETURNS_LIST:
-                    args.append(child.evaluate())
-                else:
-                    args += child.evaluate()
-                return True
-            return False
+    def evaluate_branch(self):
+        # IfElse branches that return lists are passed through as lists,
+        # otherwise only the first cell of the branch is used.
+        res = self.evaluate()
+        return res if self.val in Function.RETURNS_LIST else res[0]
+
+    def evaluate_if_else(self):
+        '''
+        Evaluates the condition of IfElse and then only the selected branch, so
+        that the branch which is not taken is never computed.
+        '''
+        Function.check_argc(self.val, self.children)
+        condition = self.children[0].evaluate()
+        branch_node = self.children[1] if \
+            Function.if_else_condition(condition) else self.children[2]
+        branch = branch_node.evaluate_branch()
+        return Function.if_else_result(branch, self.parent)
 
+    def evaluate(self):
+        if self.type == ParseTreeNodeType.FOLDED:
+            return list(self.cells)
+        if self.val == 'IfElse' and self.type == ParseTreeNodeType.FUNCTION:
+            return self.evaluate_if_else()
         if self.val not in Function.BINDINGS and len(self.children) > 0:
             args = []
-            for child_index, child in enumerate(self.children):
-                # Handle IfElse function args.
-                if insert_if_else_arg(child, child_index, args):
-                    continue
+            for child in self.children:
                 # Append the list responses from vector functions to @args.
-                elif self.val in Function.VECTOR_FUNCTIONS:
+                if self.val in Function.VECTOR_FUNCTIONS:
                     args.append(child.evaluate())
                 # Merge the list responses from non-vector functions to @args.
                 else:
                     args += child.evaluate()
             return self.evaluate_with_args(args)
         return self.evaluate_with_args(self.children)
+
+    def analyze(self):
+        '''
+        Checks the subtree rooted at this node for unknown functions, arity
+        and arg types, infers whether each node may return a list and folds
+        functions over constants only into FOLDED nodes. Runs once when the
+        tree is built, so malformed formulas fail before any traverser I/O.
+        '''
+        if self.type != ParseTreeNodeType.FUNCTION:
+            return
+        Function.lookup(self.val)
+        for child in self.children:
+            child.analyze()
+        self.check_args()
+        if self.val == 'IfElse':
+            self.returns_list = any(
+                [child.returns_list for child in self.children[1:]])
+        else:
+            self.returns_list = self.val in Function.RETURNS_LIST
+        self.fold()
+
+    def check_args(self):
+        func_name = self.val
+        if func_name in Function.BINDINGS:
+            # Bindings are passed their child nodes as args, the first of which
+            # is the index or name of the traverser.
+            for child in self.children:
+                if child.type != ParseTreeNodeType.CONSTANT:
+                    raise Exception('Expected constant args for ' + func_name +
+                                    ', found "' + child.val + '".')
+            if len(self.children) > 0 and not self.children[0].val.strip():
+                raise Exception('Expected traverser index or name for ' +
+                                func_name + ', found "' +
+                                self.children[0].val + '".')
+        elif func_name in Function.NUMERIC_FUNCTIONS:
+            for child in self.children:
+                if child.type != ParseTreeNodeType.CONSTANT:
+                    continue
+                try:
+                    float(child.val)
+                except ValueError:
+                    raise Exception('Expected numeric args for ' + func_name +
+                                    ', found "' + child.val + '".')
+        if func_name not in Function.FUNCTION_ARGC:
+            return
+        # The number of args is known up front unless a child may return a
+        # list that is merged into the args.
+        list_children = [child for child in self.children
+                         if child.returns_list]
+        if (func_name in Function.BINDINGS or func_name == 'IfElse' or
+                func_name in Function.VECTOR_FUNCTIONS or
+                len(list_children) == 0):
+            Function.check_argc(func_name,
+                                [child.val for child in self.children])
+        elif len(self.children) - len(list_children) > \
+                Function.FUNCTION_ARGC[func_name]:
+            raise Exception(
+                'Expected ' + str(Function.FUNCTION_ARGC[func_name]) + \
+                ' args for ' + func_name + ', found at least ' + \
+                str(len(self.children) - len(list_children)) + '.')
+
+    def fold(self):
+        # Folds functions that depend only on constant args. Functions that
+        # depend on their caller or on traversers are left as is.
+        if (self.val in Function.CONTEXTUAL_DEFINITIONS or
+                len(self.children) == 0 or
+                any([child.type == ParseTreeNodeType.FUNCTION
+                     for child in self.children])):
+            return
+        try:
+            cells = self.evaluate()
+        except Exception:
+            # Leave the error, e.g. division by zero, to evaluation time, where
+            # it only surfaces if this node is actually evaluated.
+            return
+        self.cells = cells
+        self.type = ParseTreeNodeType.FOLDED
+
+    def normalize(self):
+        '''
+        Returns the subtree rooted at this node as a formula string, spelled
+        the same way however the original formula was spaced.
+        '''
+        if self.type == ParseTreeNodeType.CONSTANT:
+            return self.constant_text()
+        return self.val + '(' + \
+            ', '.join([child.normalize() for child in self.children]) + ')'
+
+    def constant_text(self):
+        '''
+        Returns the val of this CONSTANT node as a formula would spell it:
+        quoted, as parsed by ParseTree.build_tree, if it is empty, holds
+        delimiters or has surrounding whitespace, and as is otherwise.
+        '''
+        if not self.val or self.val != self.val.strip() or \
+                any([token in self.val for token in '(),']):
+            return '"' + self.val + '"'
+        return self.val
+
+    def index_subtrees(self, counts):
+        '''
+        Sets self.key to a structural key of the subtree rooted at this node
+        and tallies the keys of function subtrees in @counts. Subtrees with
+        equal keys evaluate to the same cells against the same traversers:
+        the key spells out the function, its args and, for functions that
+        depend on their caller, the calling function.
+        '''
+        if self.type == ParseTreeNodeType.CONSTANT:
+            self.key = self.constant_text()
+            return
+        for child in self.children:
+            child.index_subtrees(counts)
+        if self.type == ParseTreeNodeType.FOLDED:
+            self.key = self.val + '(' + \
+                ','.join([child.key for child in self.children]) + ')'
+            return
+        context = ''
+        if self.val in Function.CONTEXTUAL_DEFINITIONS:
+            context = (self.parent.val if self.parent is not None else '') + ':'
+        self.key = context + self.val + '(' + \
+            ','.join([child.key for child in self.children]) + ')'
+        counts[self.key] = counts.get(self.key, 0) + 1
+
+    def compile(self, shared_keys=frozenset()):
+        '''
+        Lowers the subtree rooted at this node into a closure that takes the
+        list of traversers to evaluate against and a memo dict, and returns the
+        same cells as evaluate(). Function lookups, arity and argument handling
+        (including the special-casing of IfElse args) are resolved once here
+        rather than on every evaluation. Subtrees whose keys (see
+        index_subtrees) are in @shared_keys are evaluated once per memo.
+        '''
+        if self.type == ParseTreeNodeType.CONSTANT:
+            val = self.val
+            return lambda traversers, memo : Function.constant_func(val)
+        if self.type == ParseTreeNodeType.FOLDED:
+            cells = self.cells
+            return lambda traversers, memo : list(cells)
+        program = self.compile_function(shared_keys)
+        if self.key not in shared_keys:
+            return program
+        key = self.key
+
+        def memoized(traversers, memo):
+            if key not in memo:
+                memo[key] = program(traversers, memo)
+            return list(memo[key])
+        return memoized
+
+    def compile_function(self, shared_keys):
+        func_name = self.val
+        parent = self.parent
+        definition = Function.lookup(func_name)
+        if func_name in Function.TRAVERSER_BINDINGS:
+            call = lambda args, traversers, memo : definition(
+                args, traversers, parent, memo)
+        elif func_name in Function.CONTEXTUAL_DEFINITIONS:
+            call = lambda args, traversers, memo : definition(
+                args, traversers, parent)
+        else:
+            call = lambda args, traversers, memo : definition(args)
+        if func_name in Function.BINDINGS or len(self.children) == 0:
+            # Bindings are passed their (constant) child nodes as args.
+            static_args = list(self.children)
+            Function.check_argc(func_name, static_args)
+            return lambda traversers, memo : call(static_args, traversers, memo)
+        if func_name == 'IfElse':
+            return self.compile_if_else(shared_keys)
+        # Each child either has its list response appended to args as a single
+        # arg or merged into args, mirroring evaluate().
+        appends = func_name in Function.VECTOR_FUNCTIONS
+        child_programs = [child.compile(shared_keys) for child in self.children]
+
+        def program(traversers, memo):
+            args = []
+            for child_program in child_programs:
+                if appends:
+                    args.append(child_program(traversers, memo))
+                else:
+                    args += child_program(traversers, memo)
+            Function.check_argc(func_name, args)
+            return call(args, traversers, memo)
+        return program
+
+    def compile_if_else(self, shared_keys):
+        '''
+        Compiles IfElse so that, as in evaluate_if_else(), only the branch
+        selected by the condition is run.
+        '''
+        Function.check_argc(self.val, self.children)
+        condition_program = self.children[0].compile(shared_keys)
+        branches = [(child.compile(shared_keys),
+                     child.val in Function.RETURNS_LIST)
+                    for child in self.children[1:]]
+        parent = self.parent
+
+        def program(traversers, memo):
+            branch_program, returns_list = branches[0] if \
+                Function.if_else_condition(
+                    condition_program(traversers, memo)) else branches[1]
+            res = branch_program(traversers, memo)
+            branch = res if returns_list else res[0]
+            return Function.if_else_result(branch, parent)
+        return program
@@ -10,7 +10,10 @@ __email__ = 'aditya@adityaviswanathan.com'
 import os
 import sys
 import unittest
+from function import Function
+from formula_cache import FormulaCache
 from parse_tree import ParseTree
+from parse_tree_node import ParseTreeNodeType
 # Append parent dir to $PYTHONPATH to import ReportTraverser, whose public
 # methods have bindings into the ParseTreeNode.
 my_path = os.path.dirname(os.path.abspath(__file__))
@@ -82,6 +85,61 @@ class ParseTreeBasic(unittest.TestCase):
         for input_str, val in answers.iteritems():
             self.assertEqual(ParseTree(input_str).evaluate_tree().val, val)
 
+    def test_if_else_short_circuit(self):
+        # The branch that is not taken would raise if it were evaluated.
+        answers = {
+            'IfElse(GreaterThan(2,1), 1, Divide(1, 0))' : '1',
+            'IfElse(GreaterThan(1,2), Divide(1, 0), -1)' : '-1',
+            'Add(IfElse(GreaterThan(0,1), Divide(1, 0), 2), 1)' : 3.0
+        }
+        for input_str, val in answers.iteritems():
+            tree = ParseTree(input_str)
+            self.assertEqual(tree.evaluate_tree().val, val)
+            self.assertEqual(tree.root.evaluate()[0].val, val)
+        with self.assertRaises(ZeroDivisionError):
+            ParseTree('IfElse(GreaterThan(2,1), Divide(1, 0), 1)').evaluate_tree()
+
+class FunctionRegistry(unittest.TestCase):
+    def test_builtins_registered(self):
+        self.assertEqual(set(Function.DEFINITIONS.keys()), Function.NAMES)
+
+    def test_register(self):
+        self.addCleanup(Function.unregister, 'TestNegate')
+        Function.register(
+            'TestNegate',
+            lambda a : [report_utils.Cell(-float(a[0].val), a[0].title,
+                                          a[0].date)],
+            argc=1,
+            numeric=True)
+        self.assertIn('TestNegate', Function.NAMES)
+        self.assertIn('TestNegate', Function.NUMERIC_FUNCTIONS)
+        self.assertEqual(
+            ParseTree('Add(TestNegate(2), 5)').evaluate_tree().val, 3.0)
+        with self.assertRaises(Exception):
+            ParseTree('TestNegate(2, 3)').evaluate_tree()
+
+    def test_register_contextual(self):
+        self.addCleanup(Function.unregister, 'TestTraverserCount')
+        Function.register(
+            'TestTraverserCount',
+            lambda a, traversers, parent : [report_utils.Cell(len(traversers))],
+            argc=0,
+            contextual=True)
+        self.assertEqual(
+            ParseTree('Add(TestTraverserCount(), 1)', [None, None])
+                .evaluate_tree().val, 3.0)
+
+    def test_unregister(self):
+        Function.register('TestIdentity', lambda a : a, argc=1, vector=True)
+        Function.unregister('TestIdentity')
+        self.assertNotIn('TestIdentity', Function.NAMES)
+        self.assertNotIn('TestIdentity', Function.DEFINITIONS)
+        self.assertNotIn('TestIdentity', Function.FUNCTION_ARGC)
+        self.assertNotIn('TestIdentity', Function.RETURNS_LIST)
+        self.assertEqual(set(Function.DEFINITIONS.keys()), Function.NAMES)
+        with self.assertRaises(Exception):
+            ParseTree('TestIdentity(1)').evaluate_tree()
+
 class ParseTreeTraverser(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -111,6 +169,32 @@ class ParseTreeTraverser(unittest.TestCase):
             self.assertEqual(
                 ParseTree(input_str, [self.traverser]).evaluate_tree().val, val)
 
+    def test_grid_bindings(self):
+        answers = {
+            'Count(get_grid(0))' : 'Multiply(Count(get_titles(0)), ' +
+                'Subtract(Count(get_dates(0)), 1))',
+            'Count(get_block(0, 1, 11, 1, 14))' : '130',
+            'Add(get_block(0, 3, 4, 1, 14))' :
+                'Add(get_cells_by_title(0, Discount/Promotion))',
+            'Add(get_block(0, 3, 5, 10, 11))' :
+                'Add(get_cell_by_text(0, Discount/Promotion, OCT 17), ' +
+                'get_cell_by_index(0, 4, 10))'
+        }
+        for input_str, expected_str in answers.iteritems():
+            self.assertEqual(
+                ParseTree(input_str, [self.traverser]).evaluate_tree().val,
+                ParseTree(expected_str if '(' in expected_str else
+                          'Add(' + expected_str + ')',
+                          [self.traverser]).evaluate_tree().val)
+        # Grids are flattened in title order.
+        res = ParseTree('get_block(0, 3, 5, 12, 14)',
+                        [self.traverser]).evaluate_tree(is_list=True)
+        self.assertEqual([(i.title.val, i.date.val) for i in res],
+                         [('Discount/Promotion', 'DEC 17'),
+                          ('Discount/Promotion', 'Total'),
+                          ('Credit Card Fee paid by tenant', 'DEC 17'),
+                          ('Credit Card Fee paid by tenant', 'Total')])
+
     def test_if_else_list_response(self):
         answers = {
             'IfElse(GreaterThan(2,1), get_dates(0), get_titles(0))' : ['Account Name', 'JAN 17', 'FEB 17'],
@@ -195,6 +279,47 @@ class ParseTreeTraverser(unittest.TestCase):
                              out[0])
             self.assertEqual([i.title for i in res][fixed_index_check].val, out[1])
 
+    def test_vec_padding(self):
+        q0 = 'get_cells_by_title(0, Discount/Promotion)'
+        q1 = 'get_cells_by_date(0, OCT 17)'
+        # Vector arguments skip non-numeric cells, so measure each argument
+        # as a singleton vector sum.
+        short = ParseTree('VectorAdd(' + q0 + ')',
+                          [self.traverser]).evaluate_tree(is_list=True)
+        longest = ParseTree('VectorAdd(' + q1 + ')',
+                            [self.traverser]).evaluate_tree(is_list=True)
+        res = ParseTree('VectorAdd(' + q0 + ', ' + q1 + ')',
+                        [self.traverser]).evaluate_tree(is_list=True)
+        self.assertLess(len(short), len(longest))
+        self.assertEqual(len(res), len(longest))
+        # Entries past the end of the first vector are zero-padded and carry
+        # no annotations.
+        self.assertEqual([i.title.val for i in res[:len(short)]],
+                         [i.title.val for i in short])
+        self.assertEqual([i.title for i in res[len(short):]],
+                         [None] * (len(res) - len(short)))
+        with self.assertRaises(ZeroDivisionError):
+            ParseTree('VectorDivide(' + q1 + ', ' + q0 + ')',
+                      [self.traverser]).evaluate_tree(is_list=True)
+
+class ParseTreeNumericTraverser(ParseTreeTraverser):
+    '''
+    Reruns the ParseTreeTraverser cases against a numeric traverser, which
+    serves numeric functions from its precomputed float matrix.
+    '''
+    @classmethod
+    def setUpClass(self):
+        data_file = open('testdata/cashflow_test.csv').name
+        axis_decision = report_utils.AxisDecision(data_file)
+        axis_decision.decide()
+        self.traverser = report_utils.ReportTraverser(
+            data_file,
+            axis_decision.date_axis,
+            axis_decision.date_index,
+            axis_decision.title_axis,
+            axis_decision.title_index,
+            numeric=True)
+
 class ParseTreeTraversers(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -206,12 +331,14 @@ class ParseTreeTraversers(unittest.TestCase):
                                          axis_decision.date_axis,
                                          axis_decision.date_index,
                                          axis_decision.title_axis,
-                                         axis_decision.title_index),
+                                         axis_decision.title_index,
+                                         name='Hardy'),
             report_utils.ReportTraverser(data_file,
                                          axis_decision.date_axis,
                                          axis_decision.date_index,
                                          axis_decision.title_axis,
-                                         axis_decision.title_index)]
+                                         axis_decision.title_index,
+                                         name='Second Hardy')]
 
     def test_eval_trees(self):
         q1 = 'Add(get_cell_by_index(0, 2, 10), get_cell_by_index(0, 3, 10))'
@@ -235,6 +362,305 @@ class ParseTreeTraversers(unittest.TestCase):
         res = ParseTree(q, self.traversers).evaluate_tree()
         self.assertEqual(res.val, 10579)
 
+    def test_eval_tree_by_name(self):
+        q = 'Add(get_cell_by_index(Hardy, 2, 10), ' + \
+            'get_cell_by_index(Second Hardy, 5, 10))'
+        res = ParseTree(q, self.traversers).evaluate_tree()
+        self.assertEqual(res.val, 10579)
+        # Names and indexes address the same traversers.
+        q = 'Add(get_cell_by_index(Hardy, 2, 10), ' + \
+            'get_cell_by_index(1, 2, 10))'
+        res = ParseTree(q, self.traversers).evaluate_tree(memo={})
+        self.assertEqual(res.val, ParseTree(
+            'Add(get_cell_by_index(0, 2, 10), get_cell_by_index(Second Hardy, '
+            '2, 10))', self.traversers).evaluate_tree().val)
+        with self.assertRaisesRegexp(Exception, 'Cannot find traverser'):
+            ParseTree('get_cells_by_title(Elsewhere, Late Fee)',
+                      self.traversers).evaluate_tree(is_list=True)
+        for ref in ('1.5', '-1'):
+            with self.assertRaisesRegexp(Exception, 'Expected a whole ' +
+                                         'traverser index'):
+                ParseTree('get_cells_by_title(' + ref + ', Late Fee)',
+                          self.traversers).evaluate_tree(is_list=True)
+        self.assertEqual(ParseTree('get_cell_by_index(1.0, 2, 10)',
+                                   self.traversers).evaluate_tree().val,
+                         ParseTree('get_cell_by_index(1, 2, 10)',
+                                   self.traversers).evaluate_tree().val)
+
+    def test_eval_tree_by_quoted_name(self):
+        # Sheet names holding delimiters are quoted.
+        traversers = report_utils.load_workbook('testdata/properties_test.xlsx',
+                                                processes=1)
+        self.assertEqual(traversers[1].name, 'Hardy (Tempe)')
+        q = 'get_cell_by_text("Hardy (Tempe)", Late Fee, OCT 17)'
+        self.assertEqual(ParseTree(q, traversers).evaluate_tree().val, '220.0')
+        q = 'get_dates( "Hardy (Tempe)" )'
+        self.assertEqual(
+            [cell.val for cell in ParseTree(q, traversers).evaluate_tree(
+                is_list=True)],
+            [cell.val for cell in ParseTree('get_dates(1)', traversers)
+             .evaluate_tree(is_list=True)])
+
+    def test_eval_tree_by_unicode_name(self):
+        # Sheet names are read from workbooks as unicode.
+        traversers = [self.traversers[1], report_utils.ReportTraverser(
+            self.traversers[0].file_name,
+            self.traversers[0].date_axis,
+            self.traversers[0].date_axis_index,
+            self.traversers[0].title_axis,
+            self.traversers[0].title_axis_index,
+            name=u'Caf\xe9 Tempe')]
+        expected = ParseTree('get_cell_by_index(1, 2, 10)',
+                             traversers).evaluate_tree().val
+        for q in ('get_cell_by_index(Caf\xc3\xa9 Tempe, 2, 10)',
+                  u'get_cell_by_index(Caf\xe9 Tempe, 2, 10)'):
+            self.assertEqual(ParseTree(q, traversers).evaluate_tree().val,
+                             expected)
+        with self.assertRaisesRegexp(Exception, 'Cannot find traverser'):
+            ParseTree('get_cell_by_index(Caf\xc3\xa9, 2, 10)',
+                      traversers).evaluate_tree()
+
+class ParseTreeCompiled(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        data_file = open('testdata/cashflow_test.csv').name
+        axis_decision = report_utils.AxisDecision(data_file)
+        axis_decision.decide()
+        self.traverser = report_utils.ReportTraverser(
+            data_file,
+            axis_decision.date_axis,
+            axis_decision.date_index,
+            axis_decision.title_axis,
+            axis_decision.title_index)
+
+    def test_matches_interpreter(self):
+        queries = [
+            'Add(Add(2,1), Add(3,1))',
+            'Average(get_cells_by_date(0, SEP 17))',
+            'IfElse(GreaterThan(2,1), get_dates(0), get_titles(0))',
+            'Count(IfElse(GreaterThan(1,2), get_dates(0), get_titles(0)))',
+            'VectorAdd(get_cells_by_title(0, Late Fee), get_cells_by_date(0, OCT 17))',
+            'get_cell_by_text (0, Late Fee, JAN 17  )'
+        ]
+        for q in queries:
+            tree = ParseTree(q, [self.traverser])
+            tree.compile_tree()
+            compiled = tree.program(tree.traversers)
+            interpreted = tree.root.evaluate()
+            # Root IfElse responses wrap list branches in a singleton list.
+            as_tuples = lambda res : [as_tuples(i) if isinstance(i, list)
+                                      else (i.val, i.title, i.date)
+                                      for i in res]
+            self.assertEqual(as_tuples(compiled), as_tuples(interpreted))
+
+    def test_compiles_once(self):
+        tree = ParseTree('Add(get_cell_by_index(0, 2, 10), 1)', [self.traverser])
+        self.assertEqual(tree.evaluate_tree().val, 10360)
+        program = tree.program
+        self.assertEqual(tree.evaluate_tree().val, 10360)
+        self.assertIs(tree.program, program)
+        # The compiled program is not bound to the traversers of the tree.
+        self.assertEqual(program([self.traverser])[0].val, 10360)
+
+class CountingTraverser(report_utils.ReportTraverser):
+    '''
+    ReportTraverser that counts the calls made to get_cells_by_title.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(CountingTraverser, self).__init__(*args, **kwargs)
+        self.calls = 0
+
+    def get_cells_by_title(self, title_text):
+        self.calls += 1
+        return super(CountingTraverser, self).get_cells_by_title(title_text)
+
+class ParseTreeMemo(unittest.TestCase):
+    def setUp(self):
+        data_file = open('testdata/cashflow_test.csv').name
+        axis_decision = report_utils.AxisDecision(data_file)
+        axis_decision.decide()
+        self.traverser = CountingTraverser(
+            data_file,
+            axis_decision.date_axis,
+            axis_decision.date_index,
+            axis_decision.title_axis,
+            axis_decision.title_index)
+
+    def test_common_subexpressions(self):
+        answers = {
+            'Divide(Add(get_cells_by_title(0, Late Fee)), \
+                    Count(get_cells_by_title(0, Late Fee)))' : 1,
+            'Add(Average(get_cells_by_title(0, Late Fee)), \
+                 Average(get_cells_by_title(0,Late Fee)))' : 1,
+            'VectorAdd(get_cells_by_title(0, Late Fee), \
+                       get_cells_by_title(0, Late Fee), \
+                       get_cells_by_title(0, Discount/Promotion))' : 2
+        }
+        for input_str, calls in answers.iteritems():
+            tree = ParseTree(input_str, [self.traverser])
+            self.traverser.calls = 0
+            res = tree.evaluate_tree(is_list=True)
+            self.assertEqual(self.traverser.calls, calls)
+            self.assertEqual([(i.val, i.title, i.date) for i in res],
+                             [(i.val, i.title, i.date)
+                              for i in tree.root.evaluate()])
+            # Each evaluation starts from an empty memo.
+            self.traverser.calls = 0
+            tree.evaluate_tree(is_list=True)
+            self.assertEqual(self.traverser.calls, calls)
+
+    def test_shared_memo(self):
+        trees = [ParseTree(q, [self.traverser]) for q in [
+            'Average(get_cells_by_title(0, Late Fee))',
+            'Count(get_cells_by_title(0, Late Fee))',
+            'Add(get_cells_by_title(0, Late Fee), 1)']]
+        expected = [tree.evaluate_tree().val for tree in trees]
+        self.traverser.calls = 0
+        memo = {}
+        self.assertEqual([tree.evaluate_tree(memo=memo).val for tree in trees],
+                         expected)
+        self.assertEqual(self.traverser.calls, 1)
+
+    def test_memo_results_are_copies(self):
+        tree = ParseTree('get_cells_by_title(0, Late Fee)', [self.traverser])
+        memo = {}
+        res = tree.evaluate_tree(is_list=True, memo=memo)
+        count = len(res)
+        res.append(None)
+        self.assertEqual(len(tree.evaluate_tree(is_list=True, memo=memo)),
+                         count)
+        self.assertEqual(self.traverser.calls, 1)
+
+class ParseTreeBuild(unittest.TestCase):
+    def test_constant_folding(self):
+        tree = ParseTree('Add(Multiply(12, 100), get_cell_by_index(0, 2, 10))')
+        tree.build_tree()
+        self.assertEqual(tree.root.type, ParseTreeNodeType.FUNCTION)
+        self.assertEqual(tree.root.children[0].type, ParseTreeNodeType.FOLDED)
+        self.assertEqual(tree.root.children[0].cells[0].val, 1200.0)
+        tree = ParseTree('Multiply(12, Add(1, 2))')
+        tree.build_tree()
+        self.assertEqual(tree.root.type, ParseTreeNodeType.FOLDED)
+        self.assertEqual(tree.evaluate_tree().val, 36.0)
+        self.assertEqual(tree.root.evaluate()[0].val, 36.0)
+
+    def test_folding_defers_errors(self):
+        tree = ParseTree('IfElse(GreaterThan(2,1), 1, Divide(1, 0))')
+        tree.build_tree()
+        condition, _, failure = tree.root.children
+        self.assertEqual(condition.type, ParseTreeNodeType.FOLDED)
+        self.assertEqual(failure.type, ParseTreeNodeType.FUNCTION)
+        self.assertEqual(tree.evaluate_tree().val, '1')
+
+    def test_returns_list(self):
+        answers = {
+            'get_dates(0)' : True,
+            'Count(get_dates(0))' : False,
+            'VectorAdd(get_dates(0), get_titles(0))' : True,
+            'IfElse(GreaterThan(2,1), get_dates(0), 1)' : True,
+            'IfElse(GreaterThan(2,1), 2, 1)' : False,
+            'get_cell_by_text(0, Late Fee, JAN 17)' : False,
+            'Add(1, 2)' : False
+        }
+        for input_str, returns_list in answers.iteritems():
+            self.assertEqual(ParseTree(input_str).returns_list(), returns_list)
+
+    def test_normalize(self):
+        answers = {
+            'Add( 1,2 )' : 'Add(1, 2)',
+            ' Multiply(12,Add(1,  2)) ' : 'Multiply(12, Add(1, 2))',
+            'get_cells_by_title(0,  Late Fee )' : 'get_cells_by_title(0, Late Fee)',
+            'IfElse(GreaterThan(2,1),get_dates(0),1)' :
+                'IfElse(GreaterThan(2, 1), get_dates(0), 1)'
+        }
+        for input_str, normalized in answers.iteritems():
+            self.assertEqual(ParseTree(input_str).normalize(), normalized)
+            self.assertEqual(ParseTree(normalized).normalize(), normalized)
+        self.assertNotEqual(ParseTree('get_dates(0)').normalize(),
+                            ParseTree('get_dates(1)').normalize())
+
+    def test_quoted_args(self):
+        tree = ParseTree('get_cells_by_title( "Hardy (Tempe)" ,Late Fee)')
+        tree.build_tree()
+        self.assertEqual([child.val for child in tree.root.children],
+                         ['Hardy (Tempe)', 'Late Fee'])
+        self.assertEqual(tree.root.children[0].type, ParseTreeNodeType.CONSTANT)
+        # Quotes are kept where needed to read the arg back the same.
+        answers = {
+            'get_cells_by_title( "Hardy (Tempe)" ,Late Fee)' :
+                'get_cells_by_title("Hardy (Tempe)", Late Fee)',
+            'get_cells_by_title("Hardy", "Late Fee")' :
+                'get_cells_by_title(Hardy, Late Fee)',
+            'get_cells_by_title(" Hardy", Late Fee)' :
+                'get_cells_by_title(" Hardy", Late Fee)',
+            'get_cells_by_title("Hardy, Tempe", Late Fee)' :
+                'get_cells_by_title("Hardy, Tempe", Late Fee)'
+        }
+        for input_str, normalized in answers.iteritems():
+            self.assertEqual(ParseTree(input_str).normalize(), normalized)
+            self.assertEqual(ParseTree(normalized).normalize(), normalized)
+        self.assertNotEqual(ParseTree('Count("1, 2")').normalize(),
+                            ParseTree('Count(1, 2)').normalize())
+
+class FormulaCacheLRU(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        data_file = open('testdata/cashflow_test.csv').name
+        axis_decision = report_utils.AxisDecision(data_file)
+        axis_decision.decide()
+        self.traverser = report_utils.ReportTraverser(
+            data_file,
+            axis_decision.date_axis,
+            axis_decision.date_index,
+            axis_decision.title_axis,
+            axis_decision.title_index)
+        self.in_memory_traverser = report_utils.ReportTraverser(
+            data_file,
+            axis_decision.date_axis,
+            axis_decision.date_index,
+            axis_decision.title_axis,
+            axis_decision.title_index,
+            in_memory=True)
+
+    def test_hits_and_misses(self):
+        cache = FormulaCache(max_size=4)
+        tree = cache.get('Add(1, 2)')
+        self.assertIs(cache.get('Add(1, 2)'), tree)
+        cache.get('Add(2, 3)')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['max_size'], 4)
+
+    def test_evicts_least_recently_used(self):
+        cache = FormulaCache(max_size=2)
+        first = cache.get('Add(1, 2)')
+        cache.get('Add(2, 3)')
+        # Touch the first formula so that the second is evicted next.
+        cache.get('Add(1, 2)')
+        cache.get('Add(3, 4)')
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertIs(cache.get('Add(1, 2)'), first)
+        misses = cache.stats()['misses']
+        cache.get('Add(2, 3)')
+        self.assertEqual(cache.stats()['misses'], misses + 1)
+
+    def test_evaluates_against_any_traversers(self):
+        cache = FormulaCache()
+        q = 'Average(get_cells_by_date(0, SEP 17))'
+        expected = ParseTree(q, [self.traverser]).evaluate_tree().val
+        for traverser in [self.traverser, self.in_memory_traverser]:
+            self.assertEqual(cache.get(q).evaluate_tree(
+                traversers=[traverser]).val, expected)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_invalid_formula_not_cached(self):
+        cache = FormulaCache()
+        with self.assertRaises(Exception):
+            cache.get('IDONTEXIST(1.1)')
+        self.assertEqual(cache.stats()['size'], 0)
+
 class ParseTreeErrors(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -267,5 +693,39 @@ class ParseTreeErrors(unittest.TestCase):
             for invalid in invalids:
                 ParseTree(invalid, [self.traverser]).evaluate_tree()
 
+    def test_static_checks(self):
+        answers = {
+            'IDONTEXIST(1)' : 'Cannot find definition',
+            'Floor(1.1, 2.1)' : 'Expected 1 args',
+            'Floor(get_dates(0), 1, 2)' : 'found at least 2',
+            'IfElse(GreaterThan(1, 2), 1)' : 'Expected 3 args',
+            'get_cells_by_title(Add(1, 2), Late Fee)' : 'Expected constant args',
+            'get_cells_by_title( , Late Fee)' : 'Expected traverser index',
+            'Add(1, abc)' : 'Expected numeric args',
+            'Add(1, 2' : 'Missing',
+            'Add(1, 2))' : 'Unexpected',
+            'Add(1, 2) Add(3)' : 'Unexpected',
+            '' : 'does not call a function',
+            '42' : 'does not call a function',
+            'get_dates("Hardy (Tempe))' : 'Missing closing',
+            'get_dates(Hardy "Tempe")' : 'Only whole args',
+            'get_dates("Hardy" Tempe)' : 'after quoted arg',
+            '"get_dates"(0)' : 'Only whole args'
+        }
+        for input_str, message in answers.iteritems():
+            with self.assertRaisesRegexp(Exception, message):
+                ParseTree(input_str, [self.traverser]).build_tree()
+
+    def test_fails_before_traverser_io(self):
+        traverser = CountingTraverser(self.traverser.file_name,
+                                      self.traverser.date_axis,
+                                      self.traverser.date_axis_index,
+                                      self.traverser.title_axis,
+                                      self.traverser.title_axis_index)
+        with self.assertRaises(Exception):
+            ParseTree('Add(get_cells_by_title(0, Late Fee), Floor(1, 2))',
+                      [traverser]).evaluate_tree()
+        self.assertEqual(traverser.calls, 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -8,6 +8,10 @@ __author__ = 'Aditya Viswanathan'
 __email__ = 'aditya@adityaviswanathan.com'
 
 from report_utils.axis_decision import AxisDecision
+from report_utils.axis_decision_cache import AxisDecisionCache, content_hash
+from report_utils.report_loader import load_rows, load_workbook, load_xlsx
 from report_utils.report_traverser import Cell
 from report_utils.report_traverser import ReportTraverser
 from report_utils.to_csv import to_csv
+from report_utils.traverser_registry import TraverserRegistry
+from report_utils.xlsx_reader import XlsxReader
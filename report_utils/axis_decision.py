@@ -14,26 +14,103 @@ from date_axis_decider import DateAxisDecider
 from title_axis_decider import TitleAxisDecider
 
 class AxisDecision(object):
-    def __init__(self, file_name):
+    # Ways in which decide() reached its decision, recorded in decision_path.
+    PATH_CACHE = 'cache'
+    PATH_SAMPLE = 'sample'
+    PATH_FULL = 'full'
+    # Sampled first, but the sample was ambiguous and the full report was
+    # scanned instead.
+    PATH_FALLBACK = 'fallback'
+    DEFAULT_MIN_CONFIDENCE = 0.5
+
+    def __init__(self, file_name, cache=None, sample_rows=None,
+                 min_confidence=DEFAULT_MIN_CONFIDENCE, rows=None):
+        '''
+        Decides the axes of the report at @file_name. If an AxisDecisionCache
+        @cache is given, decisions are looked up in and added to it. If
+        @sample_rows is given, axes are first decided over only that many
+        leading rows of the report, and the full report is only scanned if
+        the confidence of the sampled date or title axis is below
+        @min_confidence. Decisions over a sample are not added to @cache. If
+        @rows is given, the report is read from it rather than from
+        @file_name, and it may be iterated more than once.
+        '''
         self.file_name = file_name
-        self.row_values = []
-        self.col_values = []
-        self.index_values()
+        self.rows = rows
+        self.cache = cache
+        self.sample_rows = sample_rows
+        self.min_confidence = min_confidence
+        # Sums of the date and title scores of the cells in each row and col,
+        # and the number of cells in each, accumulated lazily by decide()
+        # unless the decision is cached.
+        self.row_date_scores = []
+        self.row_title_scores = []
+        self.row_counts = []
+        self.col_date_scores = []
+        self.col_title_scores = []
+        self.col_counts = []
+        self.indexed = False
         self.date_axis = Axis.NONE
         self.date_index = -1
         self.title_axis = Axis.NONE
         self.title_index = -1
+        # How clearly the decided date and title entries beat the others, and
+        # the lesser of the two.
+        self.date_confidence = 0.0
+        self.title_confidence = 0.0
+        self.confidence = 0.0
+        self.decision_path = None
+
+    def index_values(self, max_rows=None):
+        '''
+        Scores every cell of up to @max_rows leading rows of the report, or of
+        all of them, in a single pass over the file. Only the per-row and
+        per-col score sums and cell counts are kept, not the cells. Returns
+        whether the whole report was indexed.
+        '''
+        self.indexed = True
+        self.row_date_scores = []
+        self.row_title_scores = []
+        self.row_counts = []
+        self.col_date_scores = []
+        self.col_title_scores = []
+        self.col_counts = []
+        score_date = DateAxisDecider(None).score_cell
+        score_title = TitleAxisDecider(None).score_cell
+        for row_index, row in enumerate(self.read_rows()):
+            if max_rows is not None and row_index >= max_rows:
+                return False
+            row_date_score = 0
+            row_title_score = 0
+            for col_index, col in enumerate(row):
+                date_score = score_date(col)
+                title_score = score_title(col)
+                row_date_score += date_score
+                row_title_score += title_score
+                if len(self.col_counts) <= col_index:
+                    self.col_date_scores.append(0)
+                    self.col_title_scores.append(0)
+                    self.col_counts.append(0)
+                self.col_date_scores[col_index] += date_score
+                self.col_title_scores[col_index] += title_score
+                self.col_counts[col_index] += 1
+            self.row_date_scores.append(row_date_score)
+            self.row_title_scores.append(row_title_score)
+            self.row_counts.append(len(row))
+        return True
 
-    def index_values(self):
-        # Underlying data indexed by either row or col.
+    def read_rows(self):
+        if self.rows is not None:
+            for row in self.rows:
+                yield row
+            return
         with open(self.file_name) as csv_file:
-            for row_index, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                self.row_values.append([])
-                for col_index, col in enumerate(row):
-                    self.row_values[row_index].append(col)
-                    if len(self.col_values)-1 < col_index:
-                        self.col_values.append([])
-                    self.col_values[col_index].append(col)
+            for row in csv.reader(csv_file, delimiter=','):
+                yield row
+
+    @staticmethod
+    def average_scores(scores, counts):
+        return [score / float(count) for score, count in zip(scores, counts)]
 
     @staticmethod
     def find_axis(row_decider, col_decider):
@@ -49,18 +126,104 @@ class AxisDecision(object):
             return (Axis.COL, col_decider)
         return (Axis.NONE, None)
 
+    @staticmethod
+    def axis_confidence(row_decider, col_decider, axis):
+        '''
+        Returns how clearly the top entry along @axis beats every other row and
+        column, from 0.0 (tied or undecided) to 1.0.
+        '''
+        if axis is Axis.NONE:
+            return 0.0
+        decider, other_decider = (row_decider, col_decider) \
+            if axis is Axis.ROW else (col_decider, row_decider)
+        top_index = decider.top_indexes[0]
+        top_score = decider.entries_scores[top_index]
+        if top_score <= 0.0:
+            return 0.0
+        runner_up = max([0.0] + other_decider.entries_scores +
+                        [score for index, score in
+                         enumerate(decider.entries_scores)
+                         if index != top_index])
+        return (top_score - runner_up) / top_score
+
+    @staticmethod
+    def title_confidence_of(scores, index):
+        '''
+        Returns how clearly the entry at @index of @scores, the average title
+        scores of the entries along the title axis, beats every other entry,
+        from 0.0 (tied or beaten) to 1.0. Title scores are at most 0.0, for
+        entries without any numbers, so this is how much closer to 0.0 the
+        entry scores than the runner-up does.
+        '''
+        if index >= len(scores) or len(scores) < 2:
+            return 0.0
+        runner_up = max([score for other_index, score in enumerate(scores)
+                         if other_index != index])
+        if runner_up >= 0.0:
+            return 0.0
+        return max(scores[index] - runner_up, 0.0) / -runner_up
+
     def find_date_axis(self):
-        row_date_decider = DateAxisDecider(self.row_values)
-        col_date_decider = DateAxisDecider(self.col_values)
-        return AxisDecision.find_axis(row_date_decider, col_date_decider)
+        row_date_decider = DateAxisDecider(None, AxisDecision.average_scores(
+            self.row_date_scores, self.row_counts))
+        col_date_decider = DateAxisDecider(None, AxisDecision.average_scores(
+            self.col_date_scores, self.col_counts))
+        date_axis = AxisDecision.find_axis(row_date_decider, col_date_decider)
+        self.date_confidence = AxisDecision.axis_confidence(
+            row_date_decider, col_date_decider, date_axis[0])
+        return date_axis
 
     def find_title_axis(self):
-        row_title_decider = TitleAxisDecider(self.row_values)
-        col_title_decider = TitleAxisDecider(self.col_values)
+        row_title_decider = TitleAxisDecider(None, AxisDecision.average_scores(
+            self.row_title_scores, self.row_counts))
+        col_title_decider = TitleAxisDecider(None, AxisDecision.average_scores(
+            self.col_title_scores, self.col_counts))
         return AxisDecision.find_axis(
             row_title_decider, col_title_decider)
 
     def decide(self):
+        if self.cache is not None:
+            decision = self.cache.get(self.file_name)
+            if decision is not None:
+                self.date_axis = decision['date_axis']
+                self.date_index = decision['date_index']
+                self.title_axis = decision['title_axis']
+                self.title_index = decision['title_index']
+                self.decision_path = AxisDecision.PATH_CACHE
+                return
+        self.decision_path = AxisDecision.PATH_FULL
+        if self.sample_rows is not None:
+            if self.index_values(self.sample_rows):
+                # The report fits in the sample, which is then a full scan.
+                self.detect()
+            elif self.detect_sample():
+                self.decision_path = AxisDecision.PATH_SAMPLE
+            else:
+                self.decision_path = AxisDecision.PATH_FALLBACK
+                self.index_values()
+                self.detect()
+        else:
+            self.index_values()
+            self.detect()
+        if self.cache is not None and \
+                self.decision_path != AxisDecision.PATH_SAMPLE:
+            self.cache.put(self.file_name, self)
+
+    def detect_sample(self):
+        '''
+        Decides the axes over the sampled rows. Returns whether the decision
+        is confident enough to stand for the whole report.
+        '''
+        try:
+            self.detect()
+        except Exception:
+            return False
+        return self.confidence >= self.min_confidence
+
+    def detect(self):
+        '''
+        Decides the axes by scoring every indexed row and column.
+        '''
         self.date_axis, date_axis_metadata = self.find_date_axis()
         self.title_axis, title_axis_metadata = self.find_title_axis()
         if self.date_axis is Axis.NONE:
@@ -79,3 +242,10 @@ class AxisDecision(object):
         # opposite axis.
         if self.title_axis is self.date_axis:
             self.title_axis = Axis.opposite(self.date_axis)
+        title_scores, title_counts = (self.row_title_scores, self.row_counts) \
+            if self.title_axis is Axis.ROW else \
+            (self.col_title_scores, self.col_counts)
+        self.title_confidence = AxisDecision.title_confidence_of(
+            AxisDecision.average_scores(title_scores, title_counts),
+            self.title_index)
+        self.confidence = min(self.date_confidence, self.title_confidence)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+'''
+Caches AxisDecision results keyed by a hash of the report contents, so that
+repeat decisions over an unchanged report skip axis detection entirely.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from axis import Axis
+
+def content_hash(file_name):
+    '''
+    Returns the hex SHA-1 digest of the contents of @file_name.
+    '''
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda : f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AxisDecisionCache(object):
+    DEFAULT_MAX_SIZE = 256
+    SIDECAR_SUFFIX = '.axis.json'
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, sidecar=False):
+        '''
+        Holds up to @max_size decisions in memory. If @sidecar, decisions are
+        also persisted as JSON next to each report, so that they outlive the
+        process.
+        '''
+        if max_size < 1:
+            raise Exception('AxisDecisionCache requires a max_size of at least 1')
+        self.max_size = max_size
+        self.sidecar = sidecar
+        # Content hash -> decision, in least to most recently used order.
+        self.decisions = collections.OrderedDict()
+        # File name -> (mtime, size, inode, content hash), to skip rehashing
+        # files that have not changed since they were last hashed. Bounded by
+        # max_size along with the decisions, in least to most recently used
+        # order.
+        self.hashes = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def file_hash(self, file_name):
+        stat = os.stat(file_name)
+        stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+        with self.lock:
+            memo = self.hashes.pop(file_name, None)
+            if memo is not None and memo[:3] == stamp:
+                self.hashes[file_name] = memo
+                return memo[3]
+        file_hash = content_hash(file_name)
+        with self.lock:
+            self.hashes.pop(file_name, None)
+            self.hashes[file_name] = stamp + (file_hash,)
+            while len(self.hashes) > self.max_size:
+                self.hashes.popitem(last=False)
+        return file_hash
+
+    def get(self, file_name):
+        '''
+        Returns the cached decision for the current contents of @file_name as
+        a dict of date_axis, date_index, title_axis and title_index, or None.
+        '''
+        file_hash = self.file_hash(file_name)
+        with self.lock:
+            decision = self.decisions.pop(file_hash, None)
+            if decision is not None:
+                self.decisions[file_hash] = decision
+                self.hits += 1
+                return dict(decision)
+        decision = self.read_sidecar(file_name, file_hash)
+        with self.lock:
+            if decision is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.insert(file_hash, decision)
+        return dict(decision)
+
+    def put(self, file_name, axis_decision):
+        '''
+        Caches the decided axes and indexes of @axis_decision for the current
+        contents of @file_name.
+        '''
+        self.put_axes(file_name,
+                      axis_decision.date_axis,
+                      axis_decision.date_index,
+                      axis_decision.title_axis,
+                      axis_decision.title_index)
+
+    def put_axes(self, file_name, date_axis, date_index, title_axis,
+                 title_index):
+        '''
+        Caches the given axes and indexes for the current contents of
+        @file_name.
+        '''
+        file_hash = self.file_hash(file_name)
+        decision = {
+            'date_axis' : date_axis,
+            'date_index' : date_index,
+            'title_axis' : title_axis,
+            'title_index' : title_index
+        }
+        with self.lock:
+            self.insert(file_hash, decision)
+        if self.sidecar:
+            self.write_sidecar(file_name, file_hash, decision)
+
+    def insert(self, file_hash, decision):
+        # Expects self.lock to be held.
+        self.decisions.pop(file_hash, None)
+        self.decisions[file_hash] = decision
+        while len(self.decisions) > self.max_size:
+            self.decisions.popitem(last=False)
+
+    def invalidate(self, file_name):
+        '''
+        Drops any cached decision for @file_name, including its sidecar if
+        this cache writes sidecars.
+        '''
+        with self.lock:
+            memo = self.hashes.pop(file_name, None)
+            if memo is not None:
+                self.decisions.pop(memo[3], None)
+        if not self.sidecar:
+            return
+        sidecar_name = file_name + AxisDecisionCache.SIDECAR_SUFFIX
+        if os.path.exists(sidecar_name):
+            os.remove(sidecar_name)
+
+    def read_sidecar(self, file_name, file_hash):
+        if not self.sidecar:
+            return None
+        try:
+            with open(file_name + AxisDecisionCache.SIDECAR_SUFFIX) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        # The sidecar is stale if the report has changed since it was written.
+        if entry.get('hash') != file_hash:
+            return None
+        try:
+            return {
+                'date_axis' : Axis[entry['date_axis']],
+                'date_index' : int(entry['date_index']),
+                'title_axis' : Axis[entry['title_axis']],
+                'title_index' : int(entry['title_index'])
+            }
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def write_sidecar(self, file_name, file_hash, decision):
+        entry = {
+            'hash' : file_hash,
+            'date_axis' : decision['date_axis'].name,
+            'date_index' : decision['date_index'],
+            'title_axis' : decision['title_axis'].name,
+            'title_index' : decision['title_index']
+        }
+        folder = os.path.dirname(os.path.abspath(file_name))
+        # Write to a temp file first so readers never see a partial sidecar.
+        fd, temp_name = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.rename(temp_name, file_name + AxisDecisionCache.SIDECAR_SUFFIX)
+        except Exception:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size' : len(self.decisions),
+                'max_size' : self.max_size,
+                'hits' : self.hits,
+                'misses' : self.misses
+            }
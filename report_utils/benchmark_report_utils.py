@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks ReportTraverser lookups against a synthetic report.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from axis import Axis
+from report_traverser import Cell, ReportTraverser
+try:
+    import tracemalloc
+except ImportError:
+    # tracemalloc ships with Python 3.4+.
+    tracemalloc = None
+
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+          'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+def synthetic_dates(num_dates):
+    return [MONTHS[i % len(MONTHS)] + ' ' + str(10 + i // len(MONTHS))
+            for i in range(num_dates)]
+
+def synthetic_titles(num_titles):
+    return ['Line Item ' + str(i) for i in range(num_titles)]
+
+def write_synthetic_report(file_name, num_titles, num_dates):
+    '''
+    Writes a report with dates across the first row and titles down the
+    first column, in the same quoted CSV format emitted by to_csv.
+    '''
+    with open(file_name, 'w') as csv_file:
+        csv_writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        csv_writer.writerow(['Account Name'] + synthetic_dates(num_dates))
+        for title_index, title in enumerate(synthetic_titles(num_titles)):
+            csv_writer.writerow([title] + [
+                '${:,.2f}'.format((title_index * 31 + date_index * 17) % 9973 + 1)
+                for date_index in range(num_dates)])
+
+def make_traverser(file_name, in_memory):
+    return ReportTraverser(file_name, Axis.ROW, 0, Axis.COL, 0, in_memory)
+
+def bench(label, func, number):
+    secs = min(timeit.repeat(func, repeat=3, number=number)) / number
+    print('{label:<40} {ms:>12.3f} ms'.format(label=label, ms=secs * 1000))
+
+def bench_lookups(file_name, num_titles, num_dates, number):
+    title = synthetic_titles(num_titles)[num_titles // 2]
+    date = synthetic_dates(num_dates)[num_dates // 2]
+    for in_memory in [False, True]:
+        mode = 'in-memory' if in_memory else 'file-backed'
+        traverser = make_traverser(file_name, in_memory)
+        bench(mode + ' get_titles', traverser.get_titles, number)
+        bench(mode + ' get_dates', traverser.get_dates, number)
+        bench(mode + ' get_cells_by_title',
+              lambda : traverser.get_cells_by_title(title), number)
+        bench(mode + ' get_cells_by_date',
+              lambda : traverser.get_cells_by_date(date), number)
+        bench(mode + ' get_cell_by_index',
+              lambda : traverser.get_cell_by_index(num_titles // 2,
+                                                   num_dates // 2), number)
+        bench(mode + ' get_cell_by_text',
+              lambda : traverser.get_cell_by_text(title, date), number)
+
+def bench_numeric(file_name, num_titles, num_dates, number):
+    title = synthetic_titles(num_titles)[num_titles // 2]
+    date = synthetic_dates(num_dates)[num_dates // 2]
+    traverser = ReportTraverser(file_name, Axis.ROW, 0, Axis.COL, 0,
+                                numeric=True)
+    bench('cells_to_floats(get_cells_by_title)',
+          lambda : ReportTraverser.cells_to_floats(
+              traverser.get_cells_by_title(title), True), number)
+    bench('numeric get_float_cells_by_title',
+          lambda : traverser.get_float_cells_by_title(title), number)
+    bench('cells_to_floats(get_cells_by_date)',
+          lambda : ReportTraverser.cells_to_floats(
+              traverser.get_cells_by_date(date), True), number)
+    bench('numeric get_float_cells_by_date',
+          lambda : traverser.get_float_cells_by_date(date), number)
+    bench('numeric get_floats_by_date',
+          lambda : traverser.get_floats_by_date(date), number)
+
+class DictCell(object):
+    '''
+    Reference Cell that keeps its fields in a per-instance __dict__, as Cell
+    did before it was slotted.
+    '''
+    def __init__(self, val, title=None, date=None):
+        self.val = val
+        self.title = title
+        self.date = date
+
+def bytes_per_cell(cell_class, num_cells):
+    title = cell_class('Line Item')
+    date = cell_class('JAN 17')
+    vals = [str(i) for i in range(num_cells)]
+    if tracemalloc is None:
+        # Without tracemalloc, fall back to the shallow size of a cell and its
+        # instance dict, if any.
+        cell = cell_class(vals[0], title, date)
+        size = sys.getsizeof(cell)
+        if hasattr(cell, '__dict__'):
+            size += sys.getsizeof(cell.__dict__)
+        return float(size)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    cells = [cell_class(val, title, date) for val in vals]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Exclude the list holding the cells.
+    return (after - before - len(cells) * 8) / float(num_cells)
+
+def bench_memory(num_cells):
+    if tracemalloc is None:
+        print('tracemalloc is unavailable, reporting sys.getsizeof sizes.')
+    for label, cell_class in [('dict-backed Cell', DictCell),
+                              ('slotted Cell', Cell)]:
+        print('{label:<40} {size:>12.1f} bytes/cell'.format(
+            label=label, size=bytes_per_cell(cell_class, num_cells)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--titles', type=int, default=10000,
+                        help='number of title rows in the synthetic report')
+    parser.add_argument('--dates', type=int, default=60,
+                        help='number of date columns in the synthetic report')
+    parser.add_argument('--number', type=int, default=5,
+                        help='number of calls timed per lookup')
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(folder, 'synthetic.csv')
+        write_synthetic_report(file_name, args.titles, args.dates)
+        print('Synthetic report: {titles} titles x {dates} dates'
+              .format(titles=args.titles, dates=args.dates))
+        bench_lookups(file_name, args.titles, args.dates, args.number)
+        bench_numeric(file_name, args.titles, args.dates, args.number)
+        bench_memory(args.titles * args.dates)
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    main()
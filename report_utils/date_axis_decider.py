@@ -48,27 +48,60 @@ class DateAxisDecider(Decider):
         '(.*{month}.*)'
     ])
 
+    # Precompiled once at class load. MONTHS_REGEXP finds every occurrence of
+    # a month in a single pass: long spellings come first, so each match of a
+    # long spelling (e.g. 'january') also stands for its short prefix ('jan').
+    MONTHS = sorted(months1 | months2, key=len, reverse=True)
+    MONTHS_REGEXP = re.compile('(?=(' + '|'.join(MONTHS) + '))', re.IGNORECASE)
+    SPACE_DIGIT_REGEXP = re.compile(' \d', re.IGNORECASE)
+    UNFORMATTED_REGEXPS = [re.compile(pattern, re.IGNORECASE)
+                           for pattern in unformatted_patterns]
+
     @staticmethod
     def score(regstr, cell):
-        regexp = re.compile(regstr, re.IGNORECASE)
-        match = re.search(regexp, cell)
-        match_prefix = re.match(regexp, cell)
+        regexp = re.compile(regstr, re.IGNORECASE) if \
+            isinstance(regstr, basestring) else regstr
+        match = regexp.search(cell)
+        match_prefix = regexp.match(cell)
         # If entry matches a date pattern, score high.
         if match is not None:
             return 2 if match_prefix is not None else 1
         return 0
 
+    @staticmethod
+    def score_months(cell):
+        '''
+        Scores @cell against formatted_patterns for every month, as
+        sum(score(pattern.format(month=mo), cell)) would. Per month, the
+        '(.*{month}.*)' pattern scores 2 if the month occurs on the first line
+        of @cell and 1 if it occurs on a later line only. The '({month} \d+)'
+        pattern scores 2 if @cell starts with the month followed by a space
+        and a digit and 1 if that sequence occurs anywhere else.
+        '''
+        first_line_end = cell.find('\n')
+        if first_line_end == -1:
+            first_line_end = len(cell)
+        contains_scores = {}
+        number_scores = {}
+        for match in DateAxisDecider.MONTHS_REGEXP.finditer(cell):
+            start = match.start()
+            month = match.group(1).lower()
+            for mo in set([month, month[:3]]):
+                contains_score = 2 if start < first_line_end else 1
+                if contains_scores.get(mo, 0) < contains_score:
+                    contains_scores[mo] = contains_score
+                if DateAxisDecider.SPACE_DIGIT_REGEXP.match(
+                        cell, start + len(mo)):
+                    number_score = 2 if start == 0 else 1
+                    if number_scores.get(mo, 0) < number_score:
+                        number_scores[mo] = number_score
+        return sum(contains_scores.values()) + sum(number_scores.values())
+
     def score_cell(self, cell):
-        entry_score = 0
         # If entry is an empty or all whitespace string, score low.
         if not cell.strip():
             return 0
-        for pattern in (DateAxisDecider.formatted_patterns |
-                        DateAxisDecider.unformatted_patterns):
-            if pattern in DateAxisDecider.formatted_patterns:
-                for mo in (DateAxisDecider.months1 |
-                           DateAxisDecider.months2):
-                    entry_score += self.score(pattern.format(month=mo), cell)
-            else:
-                entry_score += self.score(pattern, cell)
+        entry_score = DateAxisDecider.score_months(cell)
+        for regexp in DateAxisDecider.UNFORMATTED_REGEXPS:
+            entry_score += self.score(regexp, cell)
         return entry_score
@@ -8,20 +8,30 @@ __author__ = 'Aditya Viswanathan'
 __email__ = 'aditya@adityaviswanathan.com'
 
 class Decider(object):
-    def __init__(self, data):
+    def __init__(self, data, entries_scores=None):
+        '''
+        Decides over the entries (rows or cols) of @data, or over the given
+        average cell score of each entry in @entries_scores, in which case
+        @data is not read.
+        '''
         self.data = data
-        self.entries_scores = []
+        self.entries_scores = [] if entries_scores is None else entries_scores
         self.top_indexes = []
+        self.precomputed = entries_scores is not None
+        self.scored = False
 
     def is_axis(self):
-        self.score_entries()
+        if not self.scored:
+            self.score_entries()
         return len(self.top_indexes) > 0
 
     def score_entries(self):
-        for index, entries in enumerate(self.data):
-            s = sum([self.score_cell(e) for e in entries]) / \
-                    float(len(entries))
-            self.entries_scores.append(s)
+        self.scored = True
+        if not self.precomputed:
+            for index, entries in enumerate(self.data):
+                s = sum([self.score_cell(e) for e in entries]) / \
+                        float(len(entries))
+                self.entries_scores.append(s)
         if len(self.entries_scores) == 0:
             return
         top_score = max(self.entries_scores)
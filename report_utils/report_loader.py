@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+'''
+Loads reports straight from rows of cells, e.g. those of an xlsx sheet, into
+in-memory ReportTraversers, deciding their axes over the same rows rather than
+over an intermediate CSV file. The sheets of a workbook are loaded in parallel
+on a process pool.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import multiprocessing
+import os
+import re
+from axis_decision import AxisDecision
+from report_traverser import ReportTraverser
+from to_csv import csv_path, write_csv
+from xlsx_reader import XlsxReader, read_xlsx_rows, text_type
+
+# Characters of sheet names that are left out of the names of their CSVs.
+UNSAFE_FILE_NAME_REGEXP = re.compile(r'[^A-Za-z0-9_.-]+')
+
+def cell_text(val):
+    '''
+    Returns the text of @val, a cell value as read from a workbook, as it
+    reads back from a CSV written by to_csv.
+    '''
+    if val is None:
+        return ''
+    if isinstance(val, float):
+        return repr(val)
+    if isinstance(val, text_type):
+        return val.encode('utf-8')
+    return str(val)
+
+def read_grid(rows):
+    return tuple(tuple([cell_text(val) for val in row]) for row in rows)
+
+def load_rows(rows, file_name=None, csv_file_name=None, cache=None,
+              sample_rows=None, numeric=False):
+    '''
+    Returns an in-memory ReportTraverser over @rows, an iterable of rows of
+    cell values, whose axes are decided over the same rows. The rows are read
+    exactly once. If @csv_file_name is given, the rows are also written to it
+    as a CSV, as to_csv would. @file_name names the source of the rows and, if
+    given, keys the AxisDecisionCache @cache. @sample_rows and @numeric are as
+    for AxisDecision and ReportTraverser.
+    '''
+    grid = read_grid(rows)
+    if csv_file_name is not None:
+        write_csv(grid, csv_file_name)
+    axis_decision = AxisDecision(file_name,
+                                 cache if file_name is not None else None,
+                                 sample_rows=sample_rows,
+                                 rows=grid)
+    axis_decision.decide()
+    if cache is not None and csv_file_name is not None and \
+            axis_decision.decision_path != AxisDecision.PATH_SAMPLE:
+        # Decisions over the CSV are then cache hits too.
+        cache.put(csv_file_name, axis_decision)
+    return ReportTraverser(csv_file_name or file_name,
+                           axis_decision.date_axis,
+                           axis_decision.date_index,
+                           axis_decision.title_axis,
+                           axis_decision.title_index,
+                           numeric=numeric,
+                           rows=grid)
+
+def load_xlsx(path_name, folder=None, cache=None, sample_rows=None,
+              numeric=False):
+    '''
+    Returns an in-memory ReportTraverser over the first sheet of the .xlsx
+    workbook at @path_name, as load_rows. If @folder is given, the sheet is
+    also written to a CSV in it, named as to_csv would.
+    '''
+    csv_file_name = None
+    if folder is not None:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        csv_file_name = csv_path(
+            os.path.splitext(os.path.basename(path_name))[0], folder)
+    # Below is a HACK that assumes the first sheet in the excel workbook is
+    # the one that is to be processed, as in to_csv.
+    return load_rows(read_xlsx_rows(path_name, 0), path_name, csv_file_name,
+                     cache, sample_rows, numeric)
+
+def sheet_csv_path(path_name, sheet_name, folder, sheet_index=None):
+    # e.g. 'exports/properties.xlsx' and sheet 'Hardy St' => 'properties_Hardy_St',
+    # or 'properties_Hardy_St_2' given sheet index 2.
+    name = os.path.splitext(os.path.basename(path_name))[0] + '_' + \
+        UNSAFE_FILE_NAME_REGEXP.sub('_', sheet_name.encode('utf-8'))
+    if sheet_index is not None:
+        name += '_' + str(sheet_index)
+    return csv_path(name, folder)
+
+def sheet_csv_paths(path_name, sheet_names, folder):
+    '''
+    Returns the CSV path in @folder of each of @sheet_names, all the sheets of
+    the workbook at @path_name, as sheet_csv_path. Sheets whose names only
+    differ in characters left out of file names, e.g. 'Hardy St' and
+    'Hardy/St', get their sheet index appended so that their CSVs are kept
+    apart.
+    '''
+    paths = [sheet_csv_path(path_name, sheet_name, folder)
+             for sheet_name in sheet_names]
+    paths = [sheet_csv_path(path_name, sheet_name, folder, sheet_index)
+             if paths.count(path) > 1 else path
+             for sheet_index, (sheet_name, path) in
+             enumerate(zip(sheet_names, paths))]
+    if len(set(paths)) < len(paths):
+        raise Exception('Cannot name the CSVs of the sheets of ' + path_name +
+                        ' apart')
+    return paths
+
+def load_sheet(task):
+    '''
+    Loads a sheet of a workbook and decides its axes, as described by @task, a
+    tuple of the workbook path, sheet index, sheet name, CSV file name (or
+    None), number of rows to sample and whether to skip the sheet if it fails
+    to load. Returns the grid of the sheet along with its date axis, date
+    index, title axis, title index and decision path, or None if the sheet is
+    skipped. Runs in the worker processes of load_workbook, so takes and
+    returns picklable values only.
+    '''
+    path_name, sheet_index, sheet_name, csv_file_name, sample_rows, \
+        skip_errors = task
+    try:
+        with XlsxReader(path_name) as reader:
+            grid = read_grid(reader.rows(sheet_index))
+        if csv_file_name is not None:
+            write_csv(grid, csv_file_name)
+        axis_decision = AxisDecision(csv_file_name or path_name,
+                                     sample_rows=sample_rows, rows=grid)
+        axis_decision.decide()
+    except Exception as e:
+        message = 'Unable to load sheet "' + sheet_name.encode('utf-8') + \
+            '" of ' + path_name + ': ' + str(e)
+        if not skip_errors:
+            raise Exception(message)
+        print message + '. Skipping it.'
+        if csv_file_name is not None and os.path.exists(csv_file_name):
+            os.remove(csv_file_name)
+        return None
+    return (grid, axis_decision.date_axis, axis_decision.date_index,
+            axis_decision.title_axis, axis_decision.title_index,
+            axis_decision.decision_path)
+
+def load_workbook(path_name, sheet_names=None, folder=None, cache=None,
+                  sample_rows=None, numeric=False, processes=None,
+                  skip_errors=False):
+    '''
+    Returns a list of in-memory ReportTraversers, one per sheet of the .xlsx
+    workbook at @path_name, or per sheet named in @sheet_names, in that order.
+    Each traverser is named after its sheet, so formulas may address it by
+    name. Sheets are converted and axis-decided in parallel on a pool of
+    @processes worker processes (by default, one per CPU). If @folder is
+    given, each sheet is also written to a CSV in it, whose decision is added
+    to the AxisDecisionCache @cache, if given, unless it was made over a
+    sample. @sample_rows and @numeric are as for load_rows. Sheets that fail
+    to load, e.g. as they are not reports, fail the whole workbook unless
+    @skip_errors, in which case they are left out.
+    '''
+    with XlsxReader(path_name) as reader:
+        workbook_sheet_names = reader.sheet_names
+    if sheet_names is None:
+        sheet_names = workbook_sheet_names
+    csv_file_names = [None] * len(workbook_sheet_names)
+    if folder is not None:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        csv_file_names = sheet_csv_paths(path_name, workbook_sheet_names,
+                                         folder)
+    tasks = []
+    for sheet_name in sheet_names:
+        if sheet_name not in workbook_sheet_names:
+            raise Exception('Cannot find sheet "' + sheet_name + '" in ' +
+                            path_name)
+        sheet_index = workbook_sheet_names.index(sheet_name)
+        tasks.append((path_name, sheet_index, sheet_name,
+                      csv_file_names[sheet_index], sample_rows, skip_errors))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(tasks))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            sheets = pool.map(load_sheet, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        sheets = [load_sheet(task) for task in tasks]
+    traversers = []
+    for task, sheet in zip(tasks, sheets):
+        if sheet is None:
+            continue
+        _, _, sheet_name, csv_file_name, _, _ = task
+        grid, date_axis, date_index, title_axis, title_index, \
+            decision_path = sheet
+        traverser = ReportTraverser(csv_file_name or path_name,
+                                    date_axis,
+                                    date_index,
+                                    title_axis,
+                                    title_index,
+                                    numeric=numeric,
+                                    rows=grid,
+                                    name=sheet_name)
+        if cache is not None and csv_file_name is not None and \
+                decision_path != AxisDecision.PATH_SAMPLE:
+            cache.put_axes(csv_file_name, date_axis, date_index, title_axis,
+                           title_index)
+        traversers.append(traverser)
+    return traversers
@@ -10,13 +10,17 @@ __author__ = 'Aditya Viswanathan'
 __email__ = 'aditya@adityaviswanathan.com'
 
 import csv
+import itertools
+import numpy
 
 from axis import Axis
 
-# TODO(aditya): Move to model where caller can manage the lifecycle of
-# ReportTraversers in order to avoid excessive I/O to data files.
-
 class Cell(object):
+    # Cells are created in bulk by the traverser and formula engine, so they
+    # carry no per-instance __dict__. Title and date header cells are shared
+    # by reference rather than copied into each cell.
+    __slots__ = ('val', 'title', 'date')
+
     def __init__(self, val, title=None, date=None):
         self.val = val # type string or float.
                        # TODO(aditya): roll into Constant class.
@@ -39,20 +43,172 @@ class Cell(object):
         }
 
 class ReportTraverser(object):
+    # Maps cell bindings to their counterparts that read numeric cells from
+    # the precomputed float matrix of a numeric traverser.
+    FLOAT_BINDINGS = {
+        'get_cell_by_index' : 'get_float_cells_by_index',
+        'get_cell_by_text' : 'get_float_cells_by_text',
+        'get_cells_by_date' : 'get_float_cells_by_date',
+        'get_cells_by_title' : 'get_float_cells_by_title'
+    }
+
     def __init__(
         self,
         file_name,
         date_axis=Axis.NONE,
         date_axis_index=-1,
         title_axis=Axis.NONE,
-        title_axis_index=-1):
+        title_axis_index=-1,
+        in_memory=False,
+        numeric=False,
+        rows=None,
+        name=None):
+        '''
+        Traverses the report at @file_name, or the report held in @rows, an
+        iterable of rows of cell text as read from a report file, in which
+        case the traverser is in-memory and @file_name is only a label. If
+        @name is given, e.g. the name of the sheet the report was read from,
+        formulas may address the traverser by it instead of by index.
+        '''
         if date_axis is Axis.NONE or title_axis is Axis.NONE:
             raise Exception('ReportTraverser requires both date and title axes')
         self.file_name = file_name
+        self.name = name
         self.date_axis = date_axis
         self.date_axis_index = date_axis_index
         self.title_axis = title_axis
         self.title_axis_index = title_axis_index
+        # In-memory mode parses the report file exactly once into an immutable
+        # grid (tuple of row tuples) that backs every subsequent lookup.
+        if rows is not None:
+            self.grid = tuple(tuple(row) for row in rows)
+        else:
+            self.grid = self.load_grid() if in_memory or numeric else None
+        # Header cells, built lazily on first use and shared by reference
+        # between every cell annotated with them.
+        self.title_headers = None
+        self.date_headers = None
+        # Header text to position lookups, built lazily on first use.
+        self.title_lookup = None
+        self.date_lookup = None
+        # Numeric mode denoises and parses the whole grid once into a float64
+        # matrix and a boolean validity mask, both indexed by (title index,
+        # date index) as in get_cell_by_index.
+        self.values = None
+        self.valid = None
+        if numeric:
+            self.values, self.valid = self.load_values()
+
+    def load_grid(self):
+        '''
+        Returns the report file parsed into a tuple of row tuples.
+        '''
+        with open(self.file_name) as csv_file:
+            return tuple(tuple(row) for row in
+                         csv.reader(csv_file, delimiter=','))
+
+    def load_values(self):
+        '''
+        Returns a read-only float64 matrix of the numeric value of every cell
+        in the grid along with a boolean mask of which cells are numeric. Cells
+        are converted as in cell_to_float; missing and non-numeric cells are
+        NaN and masked out.
+        '''
+        row_axis_index = (self.date_axis_index if self.date_axis is Axis.ROW
+                          else self.title_axis_index)
+        col_axis_index = (self.date_axis_index if self.date_axis is Axis.COL
+                          else self.title_axis_index)
+        rows = self.grid[row_axis_index:]
+        num_cols = max([len(row) - col_axis_index for row in rows] + [0])
+        values = numpy.full((len(rows), num_cols), numpy.nan)
+        valid = numpy.zeros((len(rows), num_cols), dtype=bool)
+        for row_index, row in enumerate(rows):
+            for col_index in range(col_axis_index, len(row)):
+                try:
+                    val = float(ReportTraverser.denoise_cell(
+                        row[col_index]).strip())
+                except ValueError:
+                    continue
+                values[row_index, col_index - col_axis_index] = val
+                valid[row_index, col_index - col_axis_index] = True
+        values.flags.writeable = False
+        valid.flags.writeable = False
+        # Orient the matrix so that titles index its rows.
+        if self.title_axis is Axis.ROW:
+            return values.T, valid.T
+        return values, valid
+
+    def read_rows(self):
+        '''
+        Yields the rows of the report, either from the in-memory grid or by
+        re-reading the report file when the traverser is not in-memory.
+        '''
+        if self.grid is not None:
+            for row in self.grid:
+                yield row
+            return
+        with open(self.file_name) as csv_file:
+            for row in csv.reader(csv_file, delimiter=','):
+                yield row
+
+    def get_row(self, row_index):
+        '''
+        Returns the row at @row_index, or None if the report has no such row.
+        '''
+        if self.grid is not None:
+            return self.grid[row_index] if row_index < len(self.grid) else None
+        return next(itertools.islice(self.read_rows(), row_index, None), None)
+
+    def header_lookup(self, axis, axis_index, start_index):
+        '''
+        Returns a dict mapping each header text in the axis at @axis_index to
+        the list of its positions along that axis, in ascending order. Positions
+        are offsets from @start_index, the start index of the opposite axis, and
+        so address the same cells as get_cell_by_index.
+        '''
+        lookup = {}
+        for row_index, row in enumerate(self.read_rows()):
+            if axis is Axis.ROW and row_index == axis_index:
+                for col_index in range(start_index, len(row)):
+                    lookup.setdefault(row[col_index], []).append(
+                        col_index - start_index)
+                break
+            if (axis is Axis.COL and row_index >= start_index and
+                len(row) > axis_index):
+                lookup.setdefault(row[axis_index], []).append(
+                    row_index - start_index)
+        return lookup
+
+    def title_positions(self, title_text):
+        '''
+        Returns the list of positions of titles matching @title_text.
+        '''
+        if self.title_lookup is None:
+            self.title_lookup = self.header_lookup(self.title_axis,
+                                                   self.title_axis_index,
+                                                   self.date_axis_index)
+        return list(self.title_lookup.get(title_text, []))
+
+    def date_positions(self, date_text):
+        '''
+        Returns the list of positions of dates matching @date_text.
+        '''
+        if self.date_lookup is None:
+            self.date_lookup = self.header_lookup(self.date_axis,
+                                                  self.date_axis_index,
+                                                  self.title_axis_index)
+        return list(self.date_lookup.get(date_text, []))
+
+    @staticmethod
+    def pick_position(positions, axis):
+        '''
+        Resolves duplicate header text to a single position: the first match
+        when headers run down a column and the last match when headers run
+        across a row.
+        '''
+        if len(positions) == 0:
+            return -1
+        return positions[0] if axis is Axis.COL else positions[-1]
 
     @staticmethod
     def denoise_cell(cell):
@@ -87,55 +243,63 @@ class ReportTraverser(object):
                 floats.append(float_cell)
         return floats
 
+    def read_dates(self):
+        vals = []
+        if self.date_axis is Axis.ROW:
+            for i, row in enumerate(self.read_rows()):
+                if i == self.date_axis_index:
+                    for col_index, col in enumerate(row):
+                        if col_index < self.title_axis_index:
+                            continue
+                        vals.append(Cell(col, None, None))
+                    break
+        if self.date_axis is Axis.COL:
+            for i, row in enumerate(self.read_rows()):
+                if i < self.title_axis_index:
+                    continue
+                for col_index, col in enumerate(row):
+                    if col_index == self.date_axis_index:
+                        vals.append(Cell(col, None, None))
+                        break
+        return vals
+
+    def read_titles(self):
+        vals = []
+        if self.title_axis is Axis.ROW:
+            for i, row in enumerate(self.read_rows()):
+                if i == self.title_axis_index:
+                    for col_index, col in enumerate(row):
+                        if col_index < self.date_axis_index:
+                            continue
+                        vals.append(Cell(col, None, None))
+                    break
+        if self.title_axis is Axis.COL:
+            for i, row in enumerate(self.read_rows()):
+                if i < self.date_axis_index:
+                    continue
+                for col_index, col in enumerate(row):
+                    if col_index == self.title_axis_index:
+                        vals.append(Cell(col, None, None))
+                        break
+        return vals
+
     def get_dates(self):
         '''
         Returns a list of strings corresponding to the dates in the axis
         containing them.
         '''
-        vals = []
-        with open(self.file_name) as csv_file:
-            if self.date_axis is Axis.ROW:
-                for i, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if i == self.date_axis_index:
-                        for col_index, col in enumerate(row):
-                            if col_index < self.title_axis_index:
-                                continue
-                            vals.append(Cell(col, None, None))
-                        break
-            if self.date_axis is Axis.COL:
-                for i, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if i < self.title_axis_index:
-                        continue
-                    for col_index, col in enumerate(row):
-                        if col_index == self.date_axis_index:
-                            vals.append(Cell(col, None, None))
-                            break
-        return vals
+        if self.date_headers is None:
+            self.date_headers = self.read_dates()
+        return list(self.date_headers)
 
     def get_titles(self):
         '''
         Returns a list of strings corresponding to the titles in the axis
         containing them.
         '''
-        vals = []
-        with open(self.file_name) as csv_file:
-            if self.title_axis is Axis.ROW:
-                for i, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if i == self.title_axis_index:
-                        for col_index, col in enumerate(row):
-                            if col_index < self.date_axis_index:
-                                continue
-                            vals.append(Cell(col, None, None))
-                        break
-            if self.title_axis is Axis.COL:
-                for i, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if i < self.date_axis_index:
-                        continue
-                    for col_index, col in enumerate(row):
-                        if col_index == self.title_axis_index:
-                            vals.append(Cell(col, None, None))
-                            break
-        return vals
+        if self.title_headers is None:
+            self.title_headers = self.read_titles()
+        return list(self.title_headers)
 
     def get_cell_by_index(self, title_index, date_index):
         '''
@@ -161,117 +325,208 @@ class ReportTraverser(object):
                           else self.title_axis_index)
         col_axis_index = (self.date_axis_index if self.date_axis is Axis.COL
                           else self.title_axis_index)
-        row_to_find = row_axis_index + (date_index_in
+        row_to_find = row_axis_index + (date_index_int
                                         if self.date_axis is Axis.COL
                                         else title_index_int)
         col_to_find = col_axis_index + (date_index_int
                                         if self.date_axis is Axis.ROW
                                         else title_index_int)
-        with open(self.file_name) as csv_file:
-            for row_index, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                if row_index == row_to_find:
-                    for col_index, col in enumerate(row):
-                        if col_index == col_to_find:
-                            return Cell(col,
-                                        self.get_titles()[title_index_int],
-                                        self.get_dates()[date_index_int])
-        return Cell(None)
+        row = self.get_row(row_to_find)
+        if row is None or col_to_find >= len(row):
+            return Cell(None)
+        return Cell(row[col_to_find],
+                    self.get_titles()[title_index_int],
+                    self.get_dates()[date_index_int])
 
     def get_cell_by_text(self, title_text, date_text):
-        row_axis_index = (self.date_axis_index if self.date_axis is Axis.ROW
-                          else self.title_axis_index)
-        col_axis_index = (self.date_axis_index if self.date_axis is Axis.COL
-                          else self.title_axis_index)
-        found_date_index = -1
-        found_title_index = -1
-        with open(self.file_name) as csv_file:
-            for row_index, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                if found_date_index >= 0 and found_title_index >= 0:
-                    break
-                if row_index >= row_axis_index:
-                    for col_index, col in enumerate(row):
-                        if (col_index == col_axis_index and
-                            self.date_axis is Axis.COL and
-                            col == date_text):
-                            found_date_index = row_index - row_axis_index
-                        if (col_index == col_axis_index and
-                            self.title_axis is Axis.COL and
-                            col == title_text):
-                            found_title_index = row_index - row_axis_index
-                if row_index == row_axis_index:
-                    for col_index, col in enumerate(row):
-                        if self.date_axis is Axis.ROW and col == date_text:
-                            found_date_index = col_index
-                        if self.title_axis is Axis.ROW and col == title_text:
-                            found_title_index = col_index
-        return self.get_cell_by_index(found_title_index, found_date_index)
+        return self.get_cell_by_index(
+            ReportTraverser.pick_position(self.title_positions(title_text),
+                                          self.title_axis),
+            ReportTraverser.pick_position(self.date_positions(date_text),
+                                          self.date_axis))
 
     def get_cells_by_date(self, date_text):
         vals = []
-        with open(self.file_name) as csv_file:
-            if self.date_axis is Axis.ROW:
-                found_col_index = -1
-                for row_index, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if row_index == self.date_axis_index:
-                        for col_index, col in enumerate(row):
-                            if col_index < self.title_axis_index:
-                                continue
-                            if col == date_text:
-                                found_col_index = col_index
-                                break
-                    elif found_col_index >= 0:
-                        for col_index, col in enumerate(row):
-                            if col_index == found_col_index:
-                                vals.append(Cell(col,
-                                                 self.get_titles()[row_index - self.date_axis_index],
-                                                 self.get_dates()[col_index - self.title_axis_index]))
-            if self.date_axis is Axis.COL:
-                found_row_index = False
-                for row_index, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if found_row_index:
-                        break
-                    if row_index < self.title_axis_index:
-                        continue
-                    for col_index, col in enumerate(row):
-                        if found_row_index:
-                            vals.append(Cell(col,
-                                             self.get_titles()[col_index - self.date_axis_index],
-                                             self.get_dates()[row_index - self.title_axis_index]))
-                        if col_index == self.date_axis_index and col == date_text:
-                            found_row_index = True
+        positions = self.date_positions(date_text)
+        if len(positions) == 0:
+            return vals
+        titles = self.get_titles()
+        date = self.get_dates()[positions[0]]
+        if self.date_axis is Axis.ROW:
+            found_col_index = self.title_axis_index + positions[0]
+            for row_index, row in enumerate(self.read_rows()):
+                if row_index <= self.date_axis_index:
+                    continue
+                if found_col_index < len(row):
+                    vals.append(Cell(row[found_col_index],
+                                     titles[row_index - self.date_axis_index],
+                                     date))
+        if self.date_axis is Axis.COL:
+            row = self.get_row(self.title_axis_index + positions[0])
+            for col_index in range(self.date_axis_index + 1, len(row)):
+                vals.append(Cell(row[col_index],
+                                 titles[col_index - self.date_axis_index],
+                                 date))
         return vals
 
     def get_cells_by_title(self, title_text):
         vals = []
-        with open(self.file_name) as csv_file:
-            if self.title_axis is Axis.ROW:
-                found_col_index = -1
-                for row_index, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if row_index == self.title_axis_index:
-                        for col_index, col in enumerate(row):
-                            if col_index < self.date_axis_index:
-                                continue
-                            if col == title_text:
-                                found_col_index = col_index
-                                break
-                    elif found_col_index >= 0:
-                        for col_index, col in enumerate(row):
-                            if col_index == found_col_index:
-                                vals.append(Cell(col,
-                                                 self.get_titles()[col_index - self.date_axis_index],
-                                                 self.get_dates()[row_index - self.title_axis_index]))
-            if self.title_axis is Axis.COL:
-                found_row_index = False
-                for row_index, row in enumerate(csv.reader(csv_file, delimiter=',')):
-                    if found_row_index:
-                        break
-                    if row_index < self.date_axis_index:
-                        continue
-                    for col_index, col in enumerate(row):
-                        if found_row_index:
-                            vals.append(Cell(col,
-                                             self.get_titles()[row_index - self.date_axis_index],
-                                             self.get_dates()[col_index - self.title_axis_index]))
-                        if col_index == self.title_axis_index and col == title_text:
-                            found_row_index = True
+        positions = self.title_positions(title_text)
+        if len(positions) == 0:
+            return vals
+        title = self.get_titles()[positions[0]]
+        dates = self.get_dates()
+        if self.title_axis is Axis.ROW:
+            found_col_index = self.date_axis_index + positions[0]
+            for row_index, row in enumerate(self.read_rows()):
+                if row_index <= self.title_axis_index:
+                    continue
+                if found_col_index < len(row):
+                    vals.append(Cell(row[found_col_index],
+                                     title,
+                                     dates[row_index - self.title_axis_index]))
+        if self.title_axis is Axis.COL:
+            row = self.get_row(self.date_axis_index + positions[0])
+            for col_index in range(self.title_axis_index + 1, len(row)):
+                vals.append(Cell(row[col_index],
+                                 title,
+                                 dates[col_index - self.title_axis_index]))
         return vals
+
+    def get_block(self, title_start, title_end, date_start, date_end):
+        '''
+        Returns the cells at title positions @title_start up to @title_end and
+        date positions @date_start up to @date_end, addressed as in
+        get_cell_by_index, as a list of lists of cells, one per title. Cells
+        missing from short rows are left out, as in get_cells_by_title. The
+        whole block is read in a single pass over the report.
+        '''
+        bounds = []
+        for bound in (title_start, title_end, date_start, date_end):
+            try:
+                bounds.append(int(bound))
+            except ValueError:
+                raise Exception('Unable to cast supplied block bound ' + \
+                    bound + ' to int.')
+        titles = self.get_titles()
+        dates = self.get_dates()
+        title_range = range(max(bounds[0], 0), min(bounds[1], len(titles)))
+        date_range = range(max(bounds[2], 0), min(bounds[3], len(dates)))
+        block = [[] for title_index in title_range]
+        if len(title_range) == 0 or len(date_range) == 0:
+            return block
+        if self.date_axis is Axis.ROW:
+            # Each title is a row, from which the block spans a range of cols.
+            first_row = self.date_axis_index + title_range[0]
+            last_row = self.date_axis_index + title_range[-1]
+            for row_index, row in enumerate(self.read_rows()):
+                if row_index < first_row:
+                    continue
+                if row_index > last_row:
+                    break
+                title_index = row_index - self.date_axis_index
+                cells = block[title_index - title_range[0]]
+                for date_index in date_range:
+                    col_index = self.title_axis_index + date_index
+                    if col_index >= len(row):
+                        break
+                    cells.append(Cell(row[col_index], titles[title_index],
+                                      dates[date_index]))
+        if self.date_axis is Axis.COL:
+            # Each date is a row, from which the block spans a range of cols.
+            first_row = self.title_axis_index + date_range[0]
+            last_row = self.title_axis_index + date_range[-1]
+            for row_index, row in enumerate(self.read_rows()):
+                if row_index < first_row:
+                    continue
+                if row_index > last_row:
+                    break
+                date_index = row_index - self.title_axis_index
+                for title_index in title_range:
+                    col_index = self.date_axis_index + title_index
+                    if col_index >= len(row):
+                        break
+                    block[title_index - title_range[0]].append(
+                        Cell(row[col_index], titles[title_index],
+                             dates[date_index]))
+        return block
+
+    def get_grid(self):
+        '''
+        Returns the cells of every title, as get_cells_by_title returns them,
+        as a list of lists of cells, one per title, in a single pass over the
+        report.
+        '''
+        return self.get_block(0, len(self.get_titles()),
+                              1, len(self.get_dates()))
+
+    def get_floats_by_title(self, title_text):
+        '''
+        Returns views of the values and validity mask of the cells returned by
+        get_cells_by_title. Requires a numeric traverser.
+        '''
+        positions = self.title_positions(title_text)
+        if len(positions) == 0:
+            return numpy.empty(0), numpy.empty(0, dtype=bool)
+        return self.values[positions[0], 1:], self.valid[positions[0], 1:]
+
+    def get_floats_by_date(self, date_text):
+        '''
+        Returns views of the values and validity mask of the cells returned by
+        get_cells_by_date. Requires a numeric traverser.
+        '''
+        positions = self.date_positions(date_text)
+        if len(positions) == 0:
+            return numpy.empty(0), numpy.empty(0, dtype=bool)
+        return self.values[1:, positions[0]], self.valid[1:, positions[0]]
+
+    def get_float_cells_by_index(self, title_index, date_index):
+        '''
+        Returns the numeric counterpart of get_cell_by_index as a list that is
+        empty if the cell is missing or non-numeric, as in cells_to_floats.
+        Requires a numeric traverser.
+        '''
+        cell = self.get_cell_by_index(title_index, date_index)
+        if cell.title is None or not self.valid[int(title_index),
+                                                int(date_index)]:
+            return []
+        return [Cell(float(self.values[int(title_index), int(date_index)]),
+                     cell.title,
+                     cell.date)]
+
+    def get_float_cells_by_text(self, title_text, date_text):
+        return self.get_float_cells_by_index(
+            ReportTraverser.pick_position(self.title_positions(title_text),
+                                          self.title_axis),
+            ReportTraverser.pick_position(self.date_positions(date_text),
+                                          self.date_axis))
+
+    def get_float_cells_by_date(self, date_text):
+        '''
+        Returns the numeric cells of get_cells_by_date, skipping non-numeric
+        cells as in cells_to_floats. Requires a numeric traverser.
+        '''
+        values, valid = self.get_floats_by_date(date_text)
+        if len(values) == 0:
+            return []
+        titles = self.get_titles()
+        date = self.get_dates()[self.date_positions(date_text)[0]]
+        return [Cell(val, titles[title_index + 1], date)
+                for title_index, (val, is_valid) in
+                enumerate(zip(values.tolist(), valid.tolist()))
+                if is_valid]
+
+    def get_float_cells_by_title(self, title_text):
+        '''
+        Returns the numeric cells of get_cells_by_title, skipping non-numeric
+        cells as in cells_to_floats. Requires a numeric traverser.
+        '''
+        values, valid = self.get_floats_by_title(title_text)
+        if len(values) == 0:
+            return []
+        title = self.get_titles()[self.title_positions(title_text)[0]]
+        dates = self.get_dates()
+        return [Cell(val, title, dates[date_index + 1])
+                for date_index, (val, is_valid) in
+                enumerate(zip(values.tolist(), valid.tolist()))
+                if is_valid]
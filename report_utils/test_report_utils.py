@@ -10,11 +10,25 @@ __email__ = 'aditya@adityaviswanathan.com'
 import argparse
 import csv
 import os
+import shutil
 import sys
+import tempfile
+import threading
 import unittest
+import xlrd
+import zipfile
+import axis_decision_cache
+import traverser_registry
 from axis import Axis
 from axis_decision import AxisDecision
-from report_traverser import ReportTraverser
+from axis_decision_cache import AxisDecisionCache, content_hash
+from date_axis_decider import DateAxisDecider
+from report_loader import cell_text, load_rows, load_workbook, load_xlsx, \
+    sheet_csv_paths
+from report_traverser import Cell, ReportTraverser
+from to_csv import to_csv
+from traverser_registry import TraverserRegistry, traverser_bytes
+from xlsx_reader import XlsxReader
 
 GOLDENS_NAME_SUFFIX = 'goldens'
 LIST_START = '['
@@ -144,14 +158,15 @@ class ReportTraverserGoldens(unittest.TestCase):
             'get_titles values')
 
     @staticmethod
-    def run_goldens_test(file_name):
+    def run_goldens_test(file_name, in_memory=False):
         axis_decision = AxisDecision(file_name)
         axis_decision.decide()
         traverser = ReportTraverser(file_name,
                                     axis_decision.date_axis,
                                     axis_decision.date_index,
                                     axis_decision.title_axis,
-                                    axis_decision.title_index)
+                                    axis_decision.title_index,
+                                    in_memory)
         # Generate representative strings for ReportTraverser's public methods:
         # 1) get_cell_by_index
         # 2) get_cell_by_text
@@ -216,8 +231,759 @@ class ReportTraverserGoldens(unittest.TestCase):
                 err = 'Cannot open file "' + file_name + '", skipping.'
                 if not file_exists(file_name, err):
                     continue
-                # TEST: run goldens test.
+                # TEST: run goldens test against both file-backed and
+                # in-memory traversers.
                 self.assertEqual(golden_test, ReportTraverserGoldens.run_goldens_test(file_name))
+                self.assertEqual(golden_test, ReportTraverserGoldens.run_goldens_test(
+                    file_name, in_memory=True))
+
+class DateAxisDeciderScoring(unittest.TestCase):
+    @staticmethod
+    def reference_score(cell):
+        # Scores @cell by compiling and running every pattern for every month.
+        if not cell.strip():
+            return 0
+        entry_score = 0
+        for pattern in DateAxisDecider.unformatted_patterns:
+            entry_score += DateAxisDecider.score(pattern, cell)
+        for pattern in DateAxisDecider.formatted_patterns:
+            for mo in DateAxisDecider.months1 | DateAxisDecider.months2:
+                entry_score += DateAxisDecider.score(
+                    pattern.format(month=mo), cell)
+        return entry_score
+
+    def test_matches_reference(self):
+        cells = ['JAN 17', 'January 2017', 'JuLy 4th', 'Mayday 5', 'may may 5',
+                 'june 1 jun 2', 'janjan 5', 'jan  5', 'x jan 5', '\njan 5',
+                 'DECEMBER\nDEC 3', 'Summary', 'x\nmarch', '12/31/2017 Jan 1',
+                 '1/2/2017', 'Total', '$4,600.00', '', ' ']
+        with open('testdata/cashflow_test.csv') as csv_file:
+            for row in csv.reader(csv_file):
+                cells += row
+        decider = DateAxisDecider([])
+        for cell in cells:
+            self.assertEqual(decider.score_cell(cell),
+                             DateAxisDeciderScoring.reference_score(cell),
+                             cell)
+
+class AxisDecisionSampling(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.data_file = open('testdata/cashflow_test.csv').name
+        self.expected = AxisDecision(self.data_file)
+        self.expected.decide()
+
+    def decide(self, **kwargs):
+        axis_decision = AxisDecision(self.data_file, **kwargs)
+        axis_decision.decide()
+        self.assertEqual(
+            (axis_decision.date_axis, axis_decision.date_index,
+             axis_decision.title_axis, axis_decision.title_index),
+            (self.expected.date_axis, self.expected.date_index,
+             self.expected.title_axis, self.expected.title_index))
+        return axis_decision
+
+    def test_decision_paths(self):
+        self.assertEqual(self.expected.decision_path, AxisDecision.PATH_FULL)
+        axis_decision = self.decide(sample_rows=50)
+        self.assertEqual(axis_decision.decision_path, AxisDecision.PATH_SAMPLE)
+        self.assertEqual(len(axis_decision.row_counts), 50)
+        self.assertGreaterEqual(axis_decision.confidence,
+                                AxisDecision.DEFAULT_MIN_CONFIDENCE)
+        # The date header sits at row 21, so a shorter sample is ambiguous.
+        axis_decision = self.decide(sample_rows=20)
+        self.assertEqual(axis_decision.decision_path,
+                         AxisDecision.PATH_FALLBACK)
+        self.assertEqual(len(axis_decision.row_counts),
+                         len(self.expected.row_counts))
+        self.assertEqual(self.decide(sample_rows=10000).decision_path,
+                         AxisDecision.PATH_FULL)
+        self.assertEqual(
+            self.decide(sample_rows=50, min_confidence=1.0).decision_path,
+            AxisDecision.PATH_FALLBACK)
+
+    def test_title_confidence(self):
+        dates = ['JAN 17', 'FEB 17', 'MAR 17', 'APR 17']
+        rows = [['Account Name', 'Notes'] + dates]
+        # Notes look like titles in the leading rows only.
+        rows += [['Rent ' + chr(65 + i), 'Paid'] + ['1.0'] * 4
+                 for i in range(10)]
+        rows += [['Fee ' + chr(65 + i), '2.0'] + ['1.0'] * 4
+                 for i in range(20)]
+        axis_decision = AxisDecision(None, sample_rows=8, rows=rows)
+        axis_decision.decide()
+        self.assertEqual(axis_decision.decision_path,
+                         AxisDecision.PATH_FALLBACK)
+        self.assertEqual((axis_decision.title_axis, axis_decision.title_index),
+                         (Axis.COL, 0))
+        self.assertEqual(axis_decision.title_confidence, 1.0)
+        self.assertGreaterEqual(self.decide(sample_rows=50).title_confidence,
+                                AxisDecision.DEFAULT_MIN_CONFIDENCE)
+
+    def test_cached_path(self):
+        cache = AxisDecisionCache()
+        # Decisions over a sample are not cached for callers that decide over
+        # the full report.
+        self.decide(cache=cache, sample_rows=50)
+        self.assertEqual(cache.stats()['size'], 0)
+        self.assertEqual(self.decide(cache=cache).decision_path,
+                         AxisDecision.PATH_FULL)
+        self.assertEqual(self.decide(cache=cache).decision_path,
+                         AxisDecision.PATH_CACHE)
+        self.assertEqual(self.decide(cache=cache, sample_rows=50).decision_path,
+                         AxisDecision.PATH_CACHE)
+
+class AxisDecisionCaching(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.folder, 'cashflow_test.csv')
+        shutil.copyfile('testdata/cashflow_test.csv', self.data_file)
+        self.expected = AxisDecision(self.data_file)
+        self.expected.decide()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def decide(self, cache):
+        axis_decision = AxisDecision(self.data_file, cache)
+        axis_decision.decide()
+        self.assertEqual(
+            (axis_decision.date_axis, axis_decision.date_index,
+             axis_decision.title_axis, axis_decision.title_index),
+            (self.expected.date_axis, self.expected.date_index,
+             self.expected.title_axis, self.expected.title_index))
+        return axis_decision
+
+    def test_skips_detection_when_cached(self):
+        cache = AxisDecisionCache()
+        self.assertTrue(self.decide(cache).indexed)
+        self.assertFalse(self.decide(cache).indexed)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_invalidated_when_file_changes(self):
+        cache = AxisDecisionCache()
+        self.decide(cache)
+        with open(self.data_file, 'a') as f:
+            f.write('"Appended","1.0"\n')
+        self.assertTrue(self.decide(cache).indexed)
+        self.assertEqual(cache.stats()['misses'], 2)
+        cache.invalidate(self.data_file)
+        self.assertTrue(self.decide(cache).indexed)
+
+    def test_sidecar(self):
+        self.decide(AxisDecisionCache(sidecar=True))
+        self.assertTrue(os.path.exists(
+            self.data_file + AxisDecisionCache.SIDECAR_SUFFIX))
+        # A new process reads the decision back from the sidecar.
+        cache = AxisDecisionCache(sidecar=True)
+        self.assertFalse(self.decide(cache).indexed)
+        # Sidecars written for other contents of the file are ignored.
+        with open(self.data_file, 'a') as f:
+            f.write('"Appended","1.0"\n')
+        self.assertTrue(self.decide(AxisDecisionCache(sidecar=True)).indexed)
+
+    def test_invalidate_keeps_sidecars_of_others(self):
+        self.decide(AxisDecisionCache(sidecar=True))
+        cache = AxisDecisionCache()
+        self.decide(cache)
+        # A cache that does not write sidecars leaves them be.
+        cache.invalidate(self.data_file)
+        self.assertTrue(os.path.exists(
+            self.data_file + AxisDecisionCache.SIDECAR_SUFFIX))
+        AxisDecisionCache(sidecar=True).invalidate(self.data_file)
+        self.assertFalse(os.path.exists(
+            self.data_file + AxisDecisionCache.SIDECAR_SUFFIX))
+
+    def test_evicts_least_recently_used(self):
+        cache = AxisDecisionCache(max_size=1)
+        self.decide(cache)
+        other_file = os.path.join(self.folder, 'other.csv')
+        shutil.copyfile('testdata/cashflow_test.csv', other_file)
+        with open(other_file, 'a') as f:
+            f.write('"Appended","1.0"\n')
+        AxisDecision(other_file, cache).decide()
+        self.assertEqual(cache.stats()['size'], 1)
+        self.assertEqual(len(cache.hashes), 1)
+        self.assertTrue(self.decide(cache).indexed)
+
+    def test_rehashes_replaced_files(self):
+        cache = AxisDecisionCache()
+        file_hash = cache.file_hash(self.data_file)
+        # A file of the same size and mtime moved over the report.
+        stat = os.stat(self.data_file)
+        with open(self.data_file) as f:
+            contents = f.read()
+        replacement = os.path.join(self.folder, 'replacement.csv')
+        with open(replacement, 'w') as f:
+            f.write(contents.replace('220.0', '221.0', 1))
+        os.utime(replacement, (stat.st_atime, stat.st_mtime))
+        os.rename(replacement, self.data_file)
+        self.assertEqual(os.stat(self.data_file).st_size, stat.st_size)
+        self.assertNotEqual(cache.file_hash(self.data_file), file_hash)
+        self.assertEqual(cache.file_hash(self.data_file),
+                         content_hash(self.data_file))
+
+class XlsxStreaming(unittest.TestCase):
+    # The first sheet holds the cashflow report and the second one cells of
+    # each type, rich and escaped strings, gaps and merged cells.
+    XLSX_FILE = 'testdata/cashflow_test.xlsx'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_rows_match_xlrd(self):
+        workbook = xlrd.open_workbook(XlsxStreaming.XLSX_FILE)
+        with XlsxReader(XlsxStreaming.XLSX_FILE) as reader:
+            self.assertEqual(reader.sheet_names, workbook.sheet_names())
+            for sheet_index in range(workbook.nsheets):
+                sheet = workbook.sheet_by_index(sheet_index)
+                rows = list(reader.rows(sheet_index))
+                self.assertEqual(len(rows), sheet.nrows)
+                for row_index, row in enumerate(rows):
+                    expected = sheet.row_values(row_index)
+                    self.assertEqual(row, expected)
+                    self.assertEqual([type(i) for i in row],
+                                     [type(i) for i in expected])
+
+    def test_to_csv(self):
+        csv_file_name = to_csv(XlsxStreaming.XLSX_FILE, self.folder)
+        self.assertEqual(os.listdir(self.folder), ['cashflow_test.csv'])
+        sheet = xlrd.open_workbook(XlsxStreaming.XLSX_FILE).sheet_by_index(0)
+        with open(csv_file_name) as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(len(rows), sheet.nrows)
+        for row_index, row in enumerate(rows):
+            self.assertEqual(row, [str(i) if isinstance(i, float) else i
+                                   for i in sheet.row_values(row_index)])
+        # The converted report decides the same as the original CSV.
+        expected = AxisDecision('testdata/cashflow_test.csv')
+        expected.decide()
+        axis_decision = AxisDecision(csv_file_name)
+        axis_decision.decide()
+        self.assertEqual((axis_decision.date_axis, axis_decision.date_index),
+                         (expected.date_axis, expected.date_index))
+
+    def test_failed_conversion_keeps_existing_csv(self):
+        csv_file_name = os.path.join(self.folder, 'broken.csv')
+        with open(csv_file_name, 'w') as csv_file:
+            csv_file.write('"Existing"\n')
+        broken_file = os.path.join(self.folder, 'broken.xlsx')
+        with open(broken_file, 'w') as f:
+            f.write('not a workbook')
+        with self.assertRaises(Exception):
+            to_csv(broken_file, self.folder)
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ['broken.csv', 'broken.xlsx'])
+        with open(csv_file_name) as csv_file:
+            self.assertEqual(csv_file.read(), '"Existing"\n')
+
+class ReportLoading(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assertSameTraverser(self, traverser, expected):
+        self.assertEqual(
+            (traverser.date_axis, traverser.date_axis_index,
+             traverser.title_axis, traverser.title_axis_index),
+            (expected.date_axis, expected.date_axis_index,
+             expected.title_axis, expected.title_axis_index))
+        self.assertEqual([i.val for i in traverser.get_dates()],
+                         [i.val for i in expected.get_dates()])
+        self.assertEqual([i.val for i in traverser.get_titles()],
+                         [i.val for i in expected.get_titles()])
+        self.assertEqual(traverser.grid, expected.load_grid())
+
+    def decided_traverser(self, file_name):
+        axis_decision = AxisDecision(file_name)
+        axis_decision.decide()
+        return ReportTraverser(file_name,
+                               axis_decision.date_axis,
+                               axis_decision.date_index,
+                               axis_decision.title_axis,
+                               axis_decision.title_index)
+
+    def test_cell_text(self):
+        self.assertEqual([cell_text(i) for i in
+                          [u'Late Fee', 1.0, 0.1, 1e20, 7, None, u'Caf\xe9']],
+                         ['Late Fee', '1.0', '0.1', '1e+20', '7', '',
+                          'Caf\xc3\xa9'])
+
+    def test_load_rows(self):
+        expected = self.decided_traverser('testdata/cashflow_test.csv')
+        with open('testdata/cashflow_test.csv') as csv_file:
+            traverser = load_rows(csv.reader(csv_file))
+        self.assertSameTraverser(traverser, expected)
+        self.assertEqual(
+            traverser.get_cell_by_text('Late Fee', 'OCT 17').val,
+            expected.get_cell_by_text('Late Fee', 'OCT 17').val)
+
+    def test_load_xlsx_matches_csv(self):
+        cache = AxisDecisionCache()
+        traverser = load_xlsx('testdata/cashflow_test.xlsx', self.folder,
+                              cache)
+        # The CSV written on the side is the one to_csv writes.
+        csv_folder = os.path.join(self.folder, 'to_csv')
+        csv_file_name = to_csv('testdata/cashflow_test.xlsx', csv_folder)
+        with open(traverser.file_name) as csv_file:
+            with open(csv_file_name) as expected_file:
+                self.assertEqual(csv_file.read(), expected_file.read())
+        self.assertSameTraverser(traverser,
+                                 self.decided_traverser(csv_file_name))
+        # Deciding over the CSV written on the side is a cache hit.
+        axis_decision = AxisDecision(traverser.file_name, cache)
+        axis_decision.decide()
+        self.assertEqual(axis_decision.decision_path, AxisDecision.PATH_CACHE)
+
+    def test_load_xlsx_without_csv(self):
+        traverser = load_xlsx('testdata/cashflow_test.xlsx')
+        self.assertEqual(traverser.file_name, 'testdata/cashflow_test.xlsx')
+        # Numeric cells read as they would from the CSV.
+        self.assertEqual(
+            traverser.get_cell_by_text('Late Fee', 'OCT 17').val, '220.0')
+
+class WorkbookLoading(unittest.TestCase):
+    # Holds a sheet per property: the cashflow report, and the same report
+    # without its first five rows.
+    XLSX_FILE = 'testdata/properties_test.xlsx'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assertLoaded(self, traversers, sheet_names):
+        self.assertEqual([i.name for i in traversers], sheet_names)
+        for traverser in traversers:
+            self.assertEqual(
+                traverser.get_cell_by_text('Late Fee', 'OCT 17').val, '220.0')
+        date_indexes = {'Hardy' : 21, 'Hardy (Tempe)' : 16}
+        self.assertEqual([i.date_axis_index for i in traversers],
+                         [date_indexes[i] for i in sheet_names])
+
+    def test_in_parallel(self):
+        cache = AxisDecisionCache()
+        traversers = load_workbook(WorkbookLoading.XLSX_FILE,
+                                   folder=self.folder, cache=cache,
+                                   processes=2)
+        self.assertLoaded(traversers, ['Hardy', 'Hardy (Tempe)'])
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ['properties_test_Hardy.csv',
+                          'properties_test_Hardy_Tempe_.csv'])
+        # Each CSV holds its sheet, and its decision is cached.
+        for traverser in traversers:
+            with open(traverser.file_name) as csv_file:
+                self.assertEqual(tuple(tuple(row) for row in
+                                       csv.reader(csv_file)),
+                                 traverser.grid)
+            axis_decision = AxisDecision(traverser.file_name, cache)
+            axis_decision.decide()
+            self.assertEqual(axis_decision.decision_path,
+                             AxisDecision.PATH_CACHE)
+            self.assertEqual(axis_decision.date_index,
+                             traverser.date_axis_index)
+
+    def test_colliding_sheet_names(self):
+        # The same workbook, with sheets whose names only differ in
+        # characters left out of file names.
+        xlsx_file = os.path.join(self.folder, 'properties_test.xlsx')
+        with zipfile.ZipFile(WorkbookLoading.XLSX_FILE) as source:
+            with zipfile.ZipFile(xlsx_file, 'w') as dest:
+                for info in source.infolist():
+                    data = source.read(info.filename)
+                    if info.filename == 'xl/workbook.xml':
+                        data = data.replace('name="Hardy (Tempe)"',
+                                            'name="Hardy_St"')
+                        data = data.replace('name="Hardy"', 'name="Hardy St"')
+                    dest.writestr(info, data)
+        csv_folder = os.path.join(self.folder, 'csv')
+        cache = AxisDecisionCache()
+        traversers = load_workbook(xlsx_file, folder=csv_folder, cache=cache,
+                                   processes=2)
+        self.assertEqual(sorted(os.listdir(csv_folder)),
+                         ['properties_test_Hardy_St_0.csv',
+                          'properties_test_Hardy_St_1.csv'])
+        self.assertEqual([i.date_axis_index for i in traversers], [21, 16])
+        for traverser in traversers:
+            axis_decision = AxisDecision(traverser.file_name, cache)
+            axis_decision.decide()
+            self.assertEqual(axis_decision.date_index,
+                             traverser.date_axis_index)
+        # Selecting a sheet names its CSV as loading the whole workbook does.
+        traverser, = load_workbook(xlsx_file, [u'Hardy_St'], csv_folder)
+        self.assertEqual(traverser.file_name,
+                         os.path.join(csv_folder,
+                                      'properties_test_Hardy_St_1.csv'))
+
+    def test_sheet_csv_paths(self):
+        self.assertEqual(
+            sheet_csv_paths('p.xlsx', [u'Hardy St', u'Tempe', u'Hardy/St'], 'out'),
+            ['out/p_Hardy_St_0.csv', 'out/p_Tempe.csv', 'out/p_Hardy_St_2.csv'])
+        with self.assertRaisesRegexp(Exception, 'Cannot name the CSVs'):
+            sheet_csv_paths('p.xlsx', [u'A B', u'A_B', u'A B_1'], 'out')
+
+    def test_selected_sheets(self):
+        traversers = load_workbook(WorkbookLoading.XLSX_FILE,
+                                   ['Hardy (Tempe)'], processes=1)
+        self.assertLoaded(traversers, ['Hardy (Tempe)'])
+        self.assertEqual(traversers[0].file_name, WorkbookLoading.XLSX_FILE)
+
+    def test_errors(self):
+        with self.assertRaisesRegexp(Exception, 'Cannot find sheet "Nope"'):
+            load_workbook(WorkbookLoading.XLSX_FILE, ['Nope'])
+        # Sheets that are not reports fail the whole workbook, naming the
+        # sheet.
+        with self.assertRaisesRegexp(Exception, 'sheet "Edge Cases"'):
+            load_workbook('testdata/cashflow_test.xlsx', processes=2)
+        # Unless they are skipped, along with their CSVs.
+        traversers = load_workbook('testdata/cashflow_test.xlsx', None,
+                                   self.folder, processes=2, skip_errors=True)
+        self.assertEqual([i.name for i in traversers], ['Cash Flow'])
+        self.assertEqual(os.listdir(self.folder),
+                         ['cashflow_test_Cash_Flow.csv'])
+
+class TraverserRegistryCaching(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.folder, 'cashflow_test.csv')
+        shutil.copyfile('testdata/cashflow_test.csv', self.data_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def copy_report(self, name):
+        file_name = os.path.join(self.folder, name)
+        shutil.copyfile('testdata/cashflow_test.csv', file_name)
+        return file_name
+
+    def test_shares_traversers(self):
+        registry = TraverserRegistry()
+        traverser = registry.get(self.data_file)
+        self.assertIs(registry.get(self.data_file), traverser)
+        self.assertIsNot(registry.get(self.data_file, numeric=True),
+                         traverser)
+        self.assertEqual(traverser.date_axis_index, 21)
+        self.assertEqual(
+            traverser.get_cell_by_text('Late Fee', 'OCT 17').val, '220.0')
+        stats = registry.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses']),
+                         (2, 1, 2))
+
+    def test_reloads_changed_reports(self):
+        registry = TraverserRegistry()
+        traverser = registry.get(self.data_file)
+        with open(self.data_file, 'a') as f:
+            f.write('"Appended","1.0"\n')
+        reloaded = registry.get(self.data_file)
+        self.assertIsNot(reloaded, traverser)
+        self.assertEqual(len(reloaded.grid), len(traverser.grid) + 1)
+        registry.invalidate(self.data_file)
+        self.assertIsNot(registry.get(self.data_file), reloaded)
+        self.assertEqual(registry.stats()['misses'], 3)
+
+    def test_evicts_least_recently_used(self):
+        registry = TraverserRegistry(max_size=2)
+        other_file = self.copy_report('other.csv')
+        third_file = self.copy_report('third.csv')
+        traverser = registry.get(self.data_file)
+        registry.get(other_file)
+        registry.get(self.data_file)
+        registry.get(third_file)
+        self.assertIs(registry.get(self.data_file), traverser)
+        self.assertEqual(registry.stats()['evictions'], 1)
+        self.assertEqual(registry.stats()['misses'], 3)
+        registry.get(other_file)
+        self.assertEqual(registry.stats()['misses'], 4)
+
+    def test_evicts_by_bytes(self):
+        size = traverser_bytes(TraverserRegistry().get(self.data_file))
+        registry = TraverserRegistry(max_bytes=size + 1)
+        registry.get(self.data_file)
+        registry.get(self.copy_report('other.csv'))
+        stats = registry.stats()
+        self.assertEqual((stats['size'], stats['bytes'], stats['evictions']),
+                         (1, size, 1))
+
+    def test_versions(self):
+        registry = TraverserRegistry()
+        traverser, version = registry.get_versioned(self.data_file)
+        self.assertEqual(registry.get_versioned(self.data_file),
+                         (traverser, version))
+        self.assertTrue(version.endswith(content_hash(self.data_file)))
+        # A file of the same size and mtime moved over the report.
+        stat = os.stat(self.data_file)
+        with open(self.data_file) as f:
+            contents = f.read()
+        replacement = self.copy_report('replacement.csv')
+        with open(replacement, 'w') as f:
+            f.write(contents.replace('220.0', '221.0', 1))
+        os.utime(replacement, (stat.st_atime, stat.st_mtime))
+        os.rename(replacement, self.data_file)
+        reloaded, reloaded_version = registry.get_versioned(self.data_file)
+        self.assertIsNot(reloaded, traverser)
+        self.assertNotEqual(reloaded_version, version)
+        self.assertEqual(
+            reloaded.get_cell_by_text('Late Fee', 'OCT 17').val, '221.0')
+        # Registered traversers are versioned by the file they were put for.
+        other = load_xlsx('testdata/cashflow_test.xlsx', self.folder)
+        registry.put(other.file_name, other)
+        self.assertEqual(registry.get_versioned(other.file_name)[1].split(':')[-1],
+                         content_hash(other.file_name))
+
+    def test_sizes_outside_lock(self):
+        registry = TraverserRegistry()
+        locked = []
+        def sizing(traverser):
+            locked.append(registry.lock.locked())
+            return traverser_bytes(traverser)
+        traverser_registry.traverser_bytes = sizing
+        self.addCleanup(setattr, traverser_registry, 'traverser_bytes',
+                        traverser_bytes)
+        registry.get(self.data_file)
+        registry.put(self.data_file, registry.get(self.data_file, numeric=True))
+        self.assertEqual(locked, [False, False, False])
+
+    def test_hashes_once(self):
+        hashed = []
+        def hashing(file_name):
+            hashed.append(file_name)
+            return content_hash(file_name)
+        for module in (axis_decision_cache, traverser_registry):
+            module.content_hash = hashing
+            self.addCleanup(setattr, module, 'content_hash', content_hash)
+        registry = TraverserRegistry(axis_decision_cache=AxisDecisionCache())
+        traverser, version = registry.get_versioned(self.data_file)
+        self.assertEqual(hashed, [self.data_file])
+        self.assertTrue(version.endswith(content_hash(self.data_file)))
+        # The decision cached while loading serves the numeric traverser.
+        registry.get(self.data_file, numeric=True)
+        self.assertEqual(hashed, [self.data_file])
+        self.assertEqual(registry.axis_decision_cache.stats()['hits'], 1)
+
+    def test_put(self):
+        registry = TraverserRegistry()
+        traverser = load_xlsx('testdata/cashflow_test.xlsx', self.folder)
+        registry.put(traverser.file_name, traverser)
+        self.assertIs(registry.get(traverser.file_name), traverser)
+        with self.assertRaises(Exception):
+            registry.put(self.data_file, ReportTraverser(
+                self.data_file, Axis.ROW, 21, Axis.COL, 0))
+
+    def test_concurrent_gets(self):
+        registry = TraverserRegistry(max_size=2)
+        file_names = [self.data_file, self.copy_report('other.csv'),
+                      self.copy_report('third.csv')]
+        errors = []
+
+        def run(offset):
+            try:
+                for i in range(30):
+                    file_name = file_names[(i + offset) % len(file_names)]
+                    traverser = registry.get(file_name)
+                    self.assertEqual(traverser.file_name, file_name)
+                    self.assertEqual(len(traverser.get_titles()), 51)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        stats = registry.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['hits'] + stats['misses'], 120)
+        self.assertEqual(stats['bytes'], sum(
+            [traverser_bytes(entry[1]) for entry in
+             registry.entries.values()]))
+
+class ReportTraverserInMemory(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.data_file = open('testdata/cashflow_test.csv').name
+
+    def test_matches_file_backed(self):
+        self.assertEqual(
+            ReportTraverserGoldens.run_goldens_test(self.data_file),
+            ReportTraverserGoldens.run_goldens_test(self.data_file,
+                                                    in_memory=True))
+
+    def test_grid_is_immutable(self):
+        axis_decision = AxisDecision(self.data_file)
+        axis_decision.decide()
+        traverser = ReportTraverser(self.data_file,
+                                    axis_decision.date_axis,
+                                    axis_decision.date_index,
+                                    axis_decision.title_axis,
+                                    axis_decision.title_index,
+                                    in_memory=True)
+        self.assertIsInstance(traverser.grid, tuple)
+        self.assertTrue(all(isinstance(row, tuple) for row in traverser.grid))
+
+class ReportTraverserBlocks(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.data_file = open('testdata/cashflow_test.csv').name
+        with open(self.data_file) as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.traversers = [
+            ReportTraverser(self.data_file, Axis.ROW, 21, Axis.COL, 0),
+            ReportTraverser(self.data_file, Axis.ROW, 21, Axis.COL, 0,
+                            in_memory=True),
+            # The same report with dates down the first col.
+            ReportTraverser(self.data_file, Axis.COL, 21, Axis.ROW, 0,
+                            rows=zip(*rows))]
+
+    def assertSameCells(self, cells, expected):
+        self.assertEqual([(i.val, i.title.val, i.date.val) for i in cells],
+                         [(i.val, i.title.val, i.date.val) for i in expected])
+
+    def test_grid_matches_cells_by_title(self):
+        for traverser in self.traversers:
+            titles = [i.val for i in traverser.get_titles()]
+            grid = traverser.get_grid()
+            self.assertEqual(len(grid), len(titles))
+            for title, cells in zip(titles, grid):
+                # Duplicate titles only match their first occurrence.
+                if titles.count(title) == 1:
+                    self.assertSameCells(
+                        cells, traverser.get_cells_by_title(title))
+
+    def test_block_matches_cells_by_index(self):
+        for traverser in self.traversers:
+            block = traverser.get_block('3', '8', '2', '6')
+            self.assertEqual(len(block), 5)
+            for title_index, cells in zip(range(3, 8), block):
+                self.assertSameCells(
+                    cells, [traverser.get_cell_by_index(title_index, i)
+                            for i in range(2, 6)])
+
+    def test_block_bounds(self):
+        traverser = self.traversers[1]
+        block = traverser.get_block(-5, 1000, 0, 1000)
+        self.assertEqual(len(block), len(traverser.get_titles()))
+        for cells, expected in zip(block,
+                                   traverser.get_block(0, 1000, 0, 1000)):
+            self.assertSameCells(cells, expected)
+        self.assertEqual(traverser.get_block(5, 2, 0, 3), [])
+        self.assertEqual(traverser.get_block(2, 5, 3, 3), [[], [], []])
+        with self.assertRaises(Exception):
+            traverser.get_block('first', 5, 0, 3)
+
+class CellRepresentation(unittest.TestCase):
+    def test_slots(self):
+        cell = Cell('4600.00', Cell('Rent'), Cell('JAN 17'))
+        self.assertFalse(hasattr(cell, '__dict__'))
+        with self.assertRaises(AttributeError):
+            cell.note = 'unexpected'
+
+    def test_repr_and_dict(self):
+        title = Cell('Rent')
+        date = Cell('JAN 17')
+        cell = Cell('4600.00', title, date)
+        self.assertEqual(repr(cell),
+                         '{ val=4600.00 | title=Rent | date=JAN 17 }')
+        self.assertEqual(cell.to_dict(),
+                         {'val' : '4600.00', 'title' : title, 'date' : date})
+        self.assertIs(ReportTraverser.cell_to_float(cell).title, title)
+
+class ReportTraverserHeaderLookup(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        data_file = open('testdata/cashflow_test.csv').name
+        axis_decision = AxisDecision(data_file)
+        axis_decision.decide()
+        self.traverser = ReportTraverser(data_file,
+                                         axis_decision.date_axis,
+                                         axis_decision.date_index,
+                                         axis_decision.title_axis,
+                                         axis_decision.title_index)
+
+    def test_positions(self):
+        titles = [i.val for i in self.traverser.get_titles()]
+        dates = [i.val for i in self.traverser.get_dates()]
+        self.assertEqual(self.traverser.title_positions('Late Fee'),
+                         [titles.index('Late Fee')])
+        self.assertEqual(self.traverser.date_positions('OCT 17'),
+                         [dates.index('OCT 17')])
+        self.assertEqual(self.traverser.title_positions('IDONTEXIST'), [])
+
+    def test_duplicate_positions(self):
+        titles = [i.val for i in self.traverser.get_titles()]
+        positions = self.traverser.title_positions(' ')
+        self.assertEqual(positions,
+                         [i for i, title in enumerate(titles) if title == ' '])
+        # Duplicate titles resolve to the first matching row.
+        self.assertEqual(
+            self.traverser.get_cell_by_text(' ', 'OCT 17').val,
+            self.traverser.get_cell_by_index(positions[0], 10).val)
+
+    def test_shared_header_cells(self):
+        titles = self.traverser.get_titles()
+        dates = self.traverser.get_dates()
+        title_index = self.traverser.title_positions('Late Fee')[0]
+        date_index = self.traverser.date_positions('OCT 17')[0]
+        for cell in self.traverser.get_cells_by_title('Late Fee'):
+            self.assertIs(cell.title, titles[title_index])
+        for cell in self.traverser.get_cells_by_date('OCT 17'):
+            self.assertIs(cell.date, dates[date_index])
+        cell = self.traverser.get_cell_by_index(title_index, date_index)
+        self.assertIs(cell.title, titles[title_index])
+        self.assertIs(cell.date, dates[date_index])
+
+class ReportTraverserNumeric(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        data_file = open('testdata/cashflow_test.csv').name
+        axis_decision = AxisDecision(data_file)
+        axis_decision.decide()
+        self.traverser = ReportTraverser(data_file,
+                                         axis_decision.date_axis,
+                                         axis_decision.date_index,
+                                         axis_decision.title_axis,
+                                         axis_decision.title_index,
+                                         numeric=True)
+
+    def assertSameCells(self, expected, actual):
+        self.assertEqual([(i.val, i.title, i.date) for i in expected],
+                         [(i.val, i.title, i.date) for i in actual])
+
+    def test_float_cells(self):
+        for title in [i.val for i in self.traverser.get_titles()]:
+            self.assertSameCells(
+                ReportTraverser.cells_to_floats(
+                    self.traverser.get_cells_by_title(title), True),
+                self.traverser.get_float_cells_by_title(title))
+        for date in [i.val for i in self.traverser.get_dates()]:
+            self.assertSameCells(
+                ReportTraverser.cells_to_floats(
+                    self.traverser.get_cells_by_date(date), True),
+                self.traverser.get_float_cells_by_date(date))
+        self.assertSameCells(
+            ReportTraverser.cells_to_floats(
+                [self.traverser.get_cell_by_text('Late Fee', 'OCT 17')]),
+            self.traverser.get_float_cells_by_text('Late Fee', 'OCT 17'))
+        self.assertEqual(self.traverser.get_float_cells_by_index(0, 0), [])
+
+    def test_float_views(self):
+        values, valid = self.traverser.get_floats_by_title('Late Fee')
+        self.assertIs(values.base, self.traverser.values)
+        self.assertIs(valid.base, self.traverser.valid)
+        self.assertEqual(values[valid].tolist(),
+                         [i.val for i in
+                          self.traverser.get_float_cells_by_title('Late Fee')])
+        values, valid = self.traverser.get_floats_by_date('OCT 17')
+        self.assertIs(values.base, self.traverser.values)
+        self.assertFalse(values.flags.writeable)
+        values, valid = self.traverser.get_floats_by_date('IDONTEXIST')
+        self.assertEqual(len(values), 0)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -16,9 +16,14 @@ class TitleAxisDecider(Decider):
         '\d+'
         # '.*\d+' # e.g. "JUNE 2017" but this is very flaky.
     ])
+    # Precompiled once at class load.
+    NEG_REGEXPS = [re.compile(pattern, re.IGNORECASE)
+                   for pattern in neg_patterns]
+
     def score(self, regstr, cell):
-        regexp = re.compile(regstr, re.IGNORECASE)
-        match_prefix = re.match(regexp, cell)
+        regexp = re.compile(regstr, re.IGNORECASE) if \
+            isinstance(regstr, basestring) else regstr
+        match_prefix = regexp.match(cell)
         # If entry matches a date pattern, score high.
         return 1 if match_prefix is not None else 0
 
@@ -27,6 +32,6 @@ class TitleAxisDecider(Decider):
         # If entry is an empty or all whitespace string, score low.
         if not cell.strip():
             return 0
-        for pattern in (TitleAxisDecider.neg_patterns):
-            entry_score -= self.score(pattern, cell)
+        for regexp in TitleAxisDecider.NEG_REGEXPS:
+            entry_score -= self.score(regexp, cell)
         return entry_score
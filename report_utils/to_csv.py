@@ -9,25 +9,58 @@ __email__ = 'aditya@adityaviswanathan.com'
 
 import csv
 import os
-import xlrd
+import tempfile
+import time
+from xlsx_reader import read_xlsx_rows
+
+# Permissions of converted CSVs, which mkstemp would otherwise leave private
+# to the owner.
+CSV_FILE_MODE = 0o644
+
+def write_csv(rows, csv_path_name):
+     '''
+     Writes @rows to the CSV at @csv_path_name and returns the number of rows
+     written. Rows are streamed into a temp file next to the CSV, which is
+     renamed over it once complete so that readers never see a partial CSV.
+     '''
+     num_rows = 0
+     fd, temp_name = tempfile.mkstemp(
+         dir=os.path.dirname(os.path.abspath(csv_path_name)), suffix='.tmp')
+     try:
+         with os.fdopen(fd, 'w') as csv_file:
+             csv_writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+             for row in rows:
+                 csv_writer.writerow(row)
+                 num_rows += 1
+         os.chmod(temp_name, CSV_FILE_MODE)
+         os.rename(temp_name, csv_path_name)
+     except Exception:
+         if os.path.exists(temp_name):
+             os.remove(temp_name)
+         raise
+     return num_rows
+
+def csv_path(file_name, folder=''):
+     return (folder + '/' if folder else folder) + file_name + '.csv'
 
 def xlsx_to_csv(path_name, file_name, ext, folder=''):
-     wb = xlrd.open_workbook(path_name)
-     # Below is a HACK that assumes the first sheet in the excel workbook
-     # is the one that is to be processed.
-     sheet = wb.sheet_by_index(0)
-     csv_file = open((folder + '/' if folder else folder) +
-                     file_name + '.csv', 'w')
-     csv_file_name = os.path.basename(csv_file.name)
-     if os.path.isfile(csv_file.name):
+     csv_path_name = csv_path(file_name, folder)
+     csv_file_name = os.path.basename(csv_path_name)
+     if os.path.isfile(csv_path_name):
          print('Overwriting existing CSV file ' + csv_file_name + '.');
-     csv_writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
      print('Converting {name}.{ext} to CSV via temp file {csv}'
             .format(name=file_name, ext=ext, csv=csv_file_name))
-     for row_index in range(sheet.nrows):
-         csv_writer.writerow(sheet.row_values(row_index))
-     csv_file.close()
-     return csv_file.name
+     start = time.time()
+     # Below is a HACK that assumes the first sheet in the excel workbook
+     # is the one that is to be processed. See load_workbook for loading
+     # every sheet.
+     num_rows = write_csv(read_xlsx_rows(path_name, 0), csv_path_name)
+     elapsed = time.time() - start
+     print('Converted {rows} rows of {name}.{ext} in {secs:.2f}s '
+           '({rate:.0f} rows/sec)'.format(
+               rows=num_rows, name=file_name, ext=ext, secs=elapsed,
+               rate=num_rows / elapsed if elapsed > 0 else 0))
+     return csv_path_name
 
 def could_not_convert(path_name, file_name, ext, folder=''):
     raise Exception('Cannot convert file with extension {ext} to CSV'
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+'''
+Process-wide registry of loaded ReportTraversers, so that every request over a
+report shares one in-memory traverser rather than rereading the report.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import collections
+import os
+import sys
+import threading
+from axis_decision import AxisDecision
+from axis_decision_cache import content_hash
+from report_traverser import ReportTraverser
+
+def traverser_bytes(traverser):
+    '''
+    Returns an estimate of the memory held by the grid and float matrices of
+    @traverser, in bytes.
+    '''
+    total = 0
+    if traverser.grid is not None:
+        total += sys.getsizeof(traverser.grid)
+        for row in traverser.grid:
+            total += sys.getsizeof(row)
+            for cell in row:
+                total += sys.getsizeof(cell)
+    if traverser.values is not None:
+        total += traverser.values.nbytes + traverser.valid.nbytes
+    return total
+
+class TraverserRegistry(object):
+    DEFAULT_MAX_SIZE = 32
+    DEFAULT_MAX_BYTES = 256 << 20
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_bytes=DEFAULT_MAX_BYTES,
+                 axis_decision_cache=None, sample_rows=None):
+        '''
+        Holds up to @max_size in-memory traversers, whose grids take up to
+        around @max_bytes in total. Reports are decided with the
+        AxisDecisionCache @axis_decision_cache and @sample_rows, as in
+        AxisDecision, when first loaded.
+        '''
+        if max_size < 1:
+            raise Exception('TraverserRegistry requires a max_size of at least 1')
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.axis_decision_cache = axis_decision_cache
+        self.sample_rows = sample_rows
+        # (real path, numeric) -> (file stamp, traverser, bytes, content hash),
+        # in least to most recently used order.
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_stamp(file_name):
+        # Changes whenever the file is modified or replaced.
+        stat = os.stat(file_name)
+        return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    @staticmethod
+    def version(stamp, file_hash):
+        return '%r:%d:%d:%s' % (stamp[0], stamp[1], stamp[2], file_hash)
+
+    def file_hash(self, file_name):
+        # The AxisDecisionCache memoizes hashes by the same stamp that entries
+        # are validated against, so hashing through it means that deciding
+        # the axes of a report does not hash it again.
+        if self.axis_decision_cache is not None:
+            return self.axis_decision_cache.file_hash(file_name)
+        return content_hash(file_name)
+
+    def get(self, file_name, numeric=False):
+        '''
+        Returns the in-memory (and, if @numeric, numeric) ReportTraverser over
+        the current contents of the report at @file_name, loading it and
+        deciding its axes if it is not registered yet or has since changed.
+        '''
+        return self.get_versioned(file_name, numeric)[0]
+
+    def get_versioned(self, file_name, numeric=False):
+        '''
+        Returns the traverser that get would, along with a version string of
+        the contents it was loaded from: the file's mtime, size and inode, as
+        checked on every lookup, and the hash of its contents, taken when the
+        traverser was loaded. Versions differ whenever the traverser does.
+        '''
+        key = (os.path.realpath(file_name), numeric)
+        stamp = TraverserRegistry.file_stamp(file_name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries[key] = self.entries.pop(key)
+                self.hits += 1
+                return entry[1], TraverserRegistry.version(stamp, entry[3])
+            self.misses += 1
+        # Reports are loaded outside of the lock so that lookups of other
+        # reports are not held up. Concurrent loads of the same report each
+        # register their traverser, the last one winning. The contents are
+        # hashed before loading. If the file changes meanwhile, the entry
+        # keeps the stamp taken before hashing, so the next lookup reloads.
+        file_hash = self.file_hash(file_name)
+        axis_decision = AxisDecision(file_name, self.axis_decision_cache,
+                                     sample_rows=self.sample_rows)
+        axis_decision.decide()
+        traverser = ReportTraverser(file_name,
+                                    axis_decision.date_axis,
+                                    axis_decision.date_index,
+                                    axis_decision.title_axis,
+                                    axis_decision.title_index,
+                                    in_memory=True,
+                                    numeric=numeric)
+        # Sizing walks every cell, so is done before taking the lock.
+        size = traverser_bytes(traverser)
+        with self.lock:
+            self.insert(key, stamp, traverser, size, file_hash)
+        return traverser, TraverserRegistry.version(stamp, file_hash)
+
+    def put(self, file_name, traverser, numeric=False):
+        '''
+        Registers @traverser, an in-memory traverser already loaded from the
+        current contents of @file_name, e.g. by load_workbook.
+        '''
+        if traverser.grid is None:
+            raise Exception('TraverserRegistry only holds in-memory traversers')
+        key = (os.path.realpath(file_name), numeric)
+        stamp = TraverserRegistry.file_stamp(file_name)
+        file_hash = self.file_hash(file_name)
+        size = traverser_bytes(traverser)
+        with self.lock:
+            self.insert(key, stamp, traverser, size, file_hash)
+
+    def insert(self, key, stamp, traverser, size, file_hash):
+        # Expects self.lock to be held. @size is traverser_bytes(@traverser).
+        self.remove(key)
+        self.entries[key] = (stamp, traverser, size, file_hash)
+        self.bytes += size
+        # The newest traverser is kept even if it alone exceeds max_bytes.
+        while len(self.entries) > 1 and (len(self.entries) > self.max_size or
+                                         self.bytes > self.max_bytes):
+            _, (_, _, evicted_size, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def remove(self, key):
+        # Expects self.lock to be held.
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def invalidate(self, file_name):
+        '''
+        Drops the traversers registered for @file_name.
+        '''
+        path = os.path.realpath(file_name)
+        with self.lock:
+            for numeric in (False, True):
+                self.remove((path, numeric))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size' : len(self.entries),
+                'max_size' : self.max_size,
+                'bytes' : self.bytes,
+                'max_bytes' : self.max_bytes,
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'evictions' : self.evictions
+            }
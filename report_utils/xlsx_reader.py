@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+'''
+Streams the rows of a sheet of an .xlsx workbook with bounded memory. The
+zipped sheet XML is parsed in chunks without building a tree of it, and rows
+hold the same values as xlrd's Sheet.row_values would.
+'''
+
+__author__ = 'Aditya Viswanathan'
+__email__ = 'aditya@adityaviswanathan.com'
+
+import marshal
+import posixpath
+import re
+import tempfile
+import zipfile
+from xml.parsers import expat
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+try:
+    text_type = unicode
+    unichr_ = unichr
+except NameError:
+    # Python 3.
+    text_type = str
+    unichr_ = chr
+
+SSML = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+ODREL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKGREL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+XML_WHITESPACE = '\t\n \r'
+# Tags as reported by expat, which separates namespaces from names by a space.
+EXPAT_NS_SEPARATOR = ' '
+SHEET_ROW = SSML[1:-1] + EXPAT_NS_SEPARATOR + 'row'
+SHEET_CELL = SSML[1:-1] + EXPAT_NS_SEPARATOR + 'c'
+SHEET_VALUE = SSML[1:-1] + EXPAT_NS_SEPARATOR + 'v'
+SHEET_INLINE = SSML[1:-1] + EXPAT_NS_SEPARATOR + 'is'
+SHEET_TEXT = SSML[1:-1] + EXPAT_NS_SEPARATOR + 't'
+SHEET_PHONETIC = SSML[1:-1] + EXPAT_NS_SEPARATOR + 'rPh'
+SHEET_MERGE = SSML[1:-1] + EXPAT_NS_SEPARATOR + 'mergeCell'
+EXPAT_XML_SPACE = XML_SPACE[1:].replace('}', EXPAT_NS_SEPARATOR)
+CHUNK_SIZE = 1 << 16
+# Values of error cells, as in xlrd.
+ERROR_CODES = {
+    '#NULL!' : 0x00,
+    '#DIV/0!' : 0x07,
+    '#VALUE!' : 0x0F,
+    '#REF!' : 0x17,
+    '#NAME?' : 0x1D,
+    '#NUM!' : 0x24,
+    '#N/A' : 0x2A
+}
+ESCAPE_REGEXP = re.compile(r'_x[0-9A-Fa-f]{4,4}_')
+
+def unescape(text):
+    if '_' in text:
+        return ESCAPE_REGEXP.sub(
+            lambda match : unichr_(int(match.group(0)[2:6], 16)), text)
+    return text
+
+def cook(text, preserve):
+    if text is None:
+        return text_type('')
+    if not preserve:
+        text = text.strip(XML_WHITESPACE)
+    return text_type(unescape(text))
+
+def cooked_text(elem):
+    return cook(elem.text, elem.get(XML_SPACE) == 'preserve')
+
+def rich_text(elem):
+    # Concatenates the text runs of a shared or inline string.
+    texts = []
+    for child in elem:
+        if child.tag == SSML + 't':
+            texts.append(cooked_text(child))
+        elif child.tag == SSML + 'r':
+            texts += [cooked_text(t) for t in child if t.tag == SSML + 't']
+    return text_type('').join(texts)
+
+# Column letters -> col index, filled in as columns are seen.
+COL_INDEXES = {}
+
+def cell_col_index(cell_name):
+    # e.g. 'A1' => 0, 'AB12' => 27, '$C$3' => 2.
+    letters = cell_name.rstrip('0123456789$')
+    col_index = COL_INDEXES.get(letters)
+    if col_index is None:
+        col_index = 0
+        for c in letters.replace('$', '').upper():
+            col_index = col_index * 26 + ord(c) - ord('A') + 1
+        col_index -= 1
+        COL_INDEXES[letters] = col_index
+    return col_index
+
+def cell_row_index(cell_name):
+    return int(cell_name.lstrip('$ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+               .replace('$', '')) - 1
+
+def boolean_value(text):
+    if not text:
+        return 0
+    if text in ('1', 'true', 'on'):
+        return 1
+    if text in ('0', 'false', 'off'):
+        return 0
+    raise Exception('Unexpected boolean value ' + repr(text))
+
+class XlsxReader(object):
+    def __init__(self, path_name):
+        self.path_name = path_name
+        self.zip_file = zipfile.ZipFile(path_name)
+        # Part names are matched case-insensitively, as in xlrd.
+        self.part_names = dict([(name.replace('\\', '/').lower(), name)
+                                for name in self.zip_file.namelist()])
+        self.sheet_names = []
+        self.sheet_parts = []
+        self.read_sheets()
+        self.shared_strings = []
+        self.read_shared_strings()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.zip_file.close()
+
+    def open_part(self, name):
+        return self.zip_file.open(self.part_names[name.lower()])
+
+    def read_sheets(self):
+        targets = {}
+        rels = ET.parse(self.open_part('xl/_rels/workbook.xml.rels'))
+        for rel in rels.getroot().iter(PKGREL + 'Relationship'):
+            if rel.get('Type').split('/')[-1] != 'worksheet':
+                continue
+            target = rel.get('Target').replace('\\', '/')
+            targets[rel.get('Id')] = target[1:] if target.startswith('/') \
+                else posixpath.normpath(posixpath.join('xl', target))
+        workbook = ET.parse(self.open_part('xl/workbook.xml'))
+        for sheet in workbook.getroot().iter(SSML + 'sheet'):
+            rel_id = sheet.get(ODREL + 'id')
+            if rel_id in targets:
+                self.sheet_names.append(text_type(unescape(sheet.get('name'))))
+                self.sheet_parts.append(targets[rel_id])
+
+    def read_shared_strings(self):
+        # Cells refer to shared strings by index, so these are kept in memory.
+        if 'xl/sharedstrings.xml' not in self.part_names:
+            return
+        for _, elem in ET.iterparse(self.open_part('xl/sharedStrings.xml')):
+            if elem.tag == SSML + 'si':
+                self.shared_strings.append(rich_text(elem))
+                elem.clear()
+
+    def iter_sheet(self, sheet_index):
+        '''
+        Yields ('row', row index, [(col index, value), ...]) for each row of
+        the sheet at @sheet_index and ('merge', last row index, last col
+        index) for each merged range. The sheet XML is parsed in chunks, and
+        no more than a chunk's worth of rows is held at a time.
+        '''
+        handler = SheetHandler(self.shared_strings)
+        parser = expat.ParserCreate(namespace_separator=EXPAT_NS_SEPARATOR)
+        parser.buffer_text = True
+        parser.StartElementHandler = handler.start
+        parser.EndElementHandler = handler.end
+        parser.CharacterDataHandler = handler.data
+        part = self.open_part(self.sheet_parts[sheet_index])
+        try:
+            for chunk in iter(lambda : part.read(CHUNK_SIZE), b''):
+                parser.Parse(chunk, False)
+                for event in handler.events:
+                    yield event
+                del handler.events[:]
+            parser.Parse(b'', True)
+            for event in handler.events:
+                yield event
+        finally:
+            part.close()
+
+    def rows(self, sheet_index=0):
+        '''
+        Yields the rows of the sheet at @sheet_index as lists of values padded
+        with empty strings to the width of the sheet, as xlrd's
+        Sheet.row_values. The width is only known once the whole sheet is
+        parsed, so parsed rows are spilled to a temp file rather than held in
+        memory, and replayed from there.
+        '''
+        num_rows = 0
+        num_cols = 0
+        with tempfile.TemporaryFile() as spill:
+            for event in self.iter_sheet(sheet_index):
+                if event[0] == 'merge':
+                    num_rows = max(num_rows, event[1] + 1)
+                    num_cols = max(num_cols, event[2] + 1)
+                elif len(event[2]) > 0:
+                    num_rows = max(num_rows, event[1] + 1)
+                    num_cols = max(num_cols, max([c for c, _ in event[2]]) + 1)
+                    marshal.dump((event[1], event[2]), spill)
+            spill.seek(0)
+            next_index = 0
+            while True:
+                try:
+                    row_index, cells = marshal.load(spill)
+                except EOFError:
+                    break
+                if row_index < next_index:
+                    raise Exception('Rows of sheet ' + str(sheet_index) +
+                                    ' in ' + self.path_name +
+                                    ' are out of order')
+                while next_index < row_index:
+                    yield [text_type('')] * num_cols
+                    next_index += 1
+                row = [text_type('')] * num_cols
+                for col_index, value in cells:
+                    row[col_index] = value
+                yield row
+                next_index += 1
+        while next_index < num_rows:
+            yield [text_type('')] * num_cols
+            next_index += 1
+
+def read_xlsx_rows(path_name, sheet_index=0):
+    '''
+    Yields the rows of the sheet at @sheet_index of the .xlsx workbook at
+    @path_name, as XlsxReader.rows.
+    '''
+    with XlsxReader(path_name) as reader:
+        for row in reader.rows(sheet_index):
+            yield row
+
+class SheetHandler(object):
+    '''
+    Expat handlers that collect the rows and merged ranges of a sheet into
+    events, as they are parsed, with the cell values of xlrd.
+    '''
+    def __init__(self, shared_strings):
+        self.shared_strings = shared_strings
+        self.events = []
+        self.row_index = -1
+        self.cells = []
+        self.col_index = -1
+        self.cell_type = None
+        # Text of the <v> of the current cell, None if it has none.
+        self.value = None
+        self.value_preserve = False
+        # Text runs of the <is> of the current cell, None if it has none.
+        self.inline = None
+        self.in_phonetic = False
+        # Character data being collected, None outside of <v> and <t>.
+        self.text = None
+        self.preserve = False
+
+    def start(self, name, attrs):
+        if name == SHEET_CELL:
+            cell_name = attrs.get('r')
+            self.col_index = cell_col_index(cell_name) if cell_name \
+                is not None else self.col_index + 1
+            self.cell_type = attrs.get('t', 'n')
+            self.value = None
+            self.inline = None
+        elif name == SHEET_VALUE or (name == SHEET_TEXT and
+                                     self.inline is not None and
+                                     not self.in_phonetic):
+            self.text = []
+            self.preserve = attrs.get(EXPAT_XML_SPACE) == 'preserve'
+        elif name == SHEET_INLINE:
+            self.inline = []
+        elif name == SHEET_PHONETIC:
+            self.in_phonetic = True
+        elif name == SHEET_ROW:
+            row_number = attrs.get('r')
+            self.row_index = int(row_number) - 1 if row_number is not None \
+                else self.row_index + 1
+            self.cells = []
+            self.col_index = -1
+        elif name == SHEET_MERGE and attrs.get('ref'):
+            last_cell = attrs['ref'].split(':')[-1]
+            self.events.append(('merge', cell_row_index(last_cell),
+                                cell_col_index(last_cell)))
+
+    def data(self, text):
+        if self.text is not None:
+            self.text.append(text)
+
+    def end(self, name):
+        if name == SHEET_VALUE:
+            self.value = ''.join(self.text)
+            self.value_preserve = self.preserve
+            self.text = None
+        elif name == SHEET_TEXT and self.text is not None:
+            self.inline.append(cook(''.join(self.text), self.preserve))
+            self.text = None
+        elif name == SHEET_PHONETIC:
+            self.in_phonetic = False
+        elif name == SHEET_CELL:
+            value, stored = self.cell_value()
+            if stored:
+                self.cells.append((self.col_index, value))
+        elif name == SHEET_ROW:
+            self.events.append(('row', self.row_index, self.cells))
+
+    def cell_value(self):
+        '''
+        Returns the value of the current cell and whether xlrd would store it,
+        i.e. False for cells that hold no value.
+        '''
+        cell_type = self.cell_type
+        text = self.value
+        if cell_type == 'n':
+            return (float(text), True) if text else (None, False)
+        if cell_type == 's':
+            return (self.shared_strings[int(text)], True) if text else \
+                (None, False)
+        if cell_type == 'str':
+            return (cook(text, self.value_preserve) if text is not None
+                    else None, True)
+        if cell_type == 'b':
+            return boolean_value(text), True
+        if cell_type == 'e':
+            return ERROR_CODES[text if text is not None else '#N/A'], True
+        if cell_type == 'inlineStr':
+            if self.inline is not None:
+                text = text_type('').join(self.inline)
+            return (text, True) if text else (None, False)
+        raise Exception('Unknown cell type ' + repr(cell_type))